@@ -0,0 +1,244 @@
+"""An asyncio based OAI-PMH client.
+
+This module requires Python 3.6 or later.
+"""
+import asyncio
+import base64
+import http.client
+import urllib.error
+import zlib
+from io import BytesIO
+from urllib.parse import urlencode, urljoin, urlsplit
+
+from oaipmh import client
+
+LIST_VERBS = ['ListIdentifiers', 'ListRecords', 'ListSets']
+
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+
+# redirects followed for a single request, as urllib does
+MAX_REDIRECTS = 10
+
+class AsyncBaseClient(client.BaseClient):
+    """A client with the same verb methods as BaseClient, for use with
+    asyncio.
+
+    identify, getRecord, getMetadata and listMetadataFormats are
+    coroutines. listIdentifiers, listRecords and listSets return
+    asynchronous generators that follow resumption tokens:
+
+      async for header, metadata, about in client.listRecords(...):
+          ...
+
+    Responses are parsed the same way as by BaseClient. Prefetching and
+    streaming are not supported.
+    """
+    def handleVerb(self, verb, kw):
+        self.encodeArguments(verb, kw)
+        if verb in LIST_VERBS:
+            return self.listVerb(verb, kw)
+        return self.singleVerb(verb, kw)
+
+    async def singleVerb(self, verb, kw):
+        tree = await self.makeRequestErrorHandling(verb=verb, **kw)
+        return getattr(self, verb + '_impl')(kw, tree)
+
+    async def listVerb(self, verb, kw):
+        tree = await self.makeRequestErrorHandling(verb=verb, **kw)
+        while 1:
+            result, token = self.buildBatch(verb, kw, tree)
+            for item in result:
+                yield item
+            if token is None or not result:
+                break
+            tree = await self.makeRequestErrorHandling(
+                verb=verb, resumptionToken=token)
+
+    async def updateGranularity(self):
+        """Update the granularity setting dependent on that the server says.
+        """
+        identify = await self.identify()
+        self.setGranularity(identify.granularity())
+
+    async def makeRequestErrorHandling(self, **kw):
+        xml = await self.makeRequest(**kw)
+        return self.handleResponse(xml, kw)
+
+    async def makeRequest(self, **kw):
+        raise NotImplementedError
+
+class AsyncClient(AsyncBaseClient):
+    """Retrieves responses over HTTP without blocking the event loop.
+
+    Requests the server asks to retry later (HTTP 503 by default, see
+    the retry policy of BaseClient) are retried after a non-blocking
+    sleep. Redirects are followed, at most MAX_REDIRECTS for a request.
+
+    If use_compression is true, gzip or deflate compressed responses are
+    accepted. Unlike Client, this doesn't ask Identify first; servers
+    that don't compress ignore the header.
+    """
+    def __init__(self, base_url, metadata_registry=None, credentials=None,
+                 force_http_get=False, custom_retry_policy=None,
+                 timeout=None, use_compression=False):
+        AsyncBaseClient.__init__(self, metadata_registry,
+                                 custom_retry_policy=custom_retry_policy)
+        self._base_url = base_url
+        self._force_http_get = force_http_get
+        self._timeout = timeout
+        self._use_compression = use_compression
+        if credentials is not None:
+            self._credentials = base64.b64encode(
+                ('%s:%s' % credentials).encode('utf-8')).decode('ascii')
+        else:
+            self._credentials = None
+
+    async def makeRequest(self, **kw):
+        headers = {'User-Agent': 'pyoai'}
+        if self._credentials is not None:
+            headers['Authorization'] = 'Basic ' + self._credentials
+        if self._use_compression:
+            headers['Accept-Encoding'] = ', '.join(
+                client.SUPPORTED_COMPRESSIONS)
+        data = urlencode(kw)
+        if self._force_http_get:
+            method = 'GET'
+            url = '%s?%s' % (self._base_url, data)
+            body = None
+        else:
+            method = 'POST'
+            url = self._base_url
+            body = data.encode('utf-8')
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        retry_policy = self.retry_policy
+        for i in range(retry_policy['retry']):
+            final_url, status, reason, msg, text = await asyncio.wait_for(
+                fetchRedirected(method, url, body, headers), self._timeout)
+            if status < 300:
+                return text
+            if status not in retry_policy['expected-errcodes']:
+                raise urllib.error.HTTPError(
+                    final_url, status, reason, msg, BytesIO(text))
+            try:
+                retryAfter = int(msg.get('Retry-After'))
+            except TypeError:
+                retryAfter = retry_policy['wait-default']
+            await asyncio.sleep(retryAfter)
+        raise client.Error(
+            "Waited too often (more than %s times)" % retry_policy['retry'])
+
+async def fetchRedirected(method, url, body=None, headers=None,
+                          max_redirects=MAX_REDIRECTS):
+    """Perform a HTTP/1.1 request like fetch, following redirects.
+
+    A 303 response is followed with a GET request, other redirects
+    repeat the request as it was. Returns a tuple of the final URL,
+    status code, reason, headers and body.
+    """
+    headers = dict(headers or {})
+    for i in range(max_redirects + 1):
+        status, reason, msg, text = await fetch(method, url, body, headers)
+        location = msg.get('Location')
+        if status not in REDIRECT_CODES or location is None:
+            return url, status, reason, msg, text
+        url = urljoin(url, location)
+        if status == 303 and method != 'HEAD':
+            method = 'GET'
+            body = None
+            headers.pop('Content-Type', None)
+    raise client.Error(
+        "Redirected too often (more than %s times)" % max_redirects)
+
+async def fetch(method, url, body=None, headers=None):
+    """Perform a HTTP/1.1 request on a new connection.
+
+    The body is decompressed if the server compressed it. Returns a
+    tuple of status code, reason, headers and body.
+    """
+    headers = dict(headers or {})
+    headers.setdefault('Accept-Encoding', 'identity')
+    parts = urlsplit(url)
+    https = parts.scheme == 'https'
+    port = parts.port or (https and 443 or 80)
+    selector = parts.path or '/'
+    if parts.query:
+        selector += '?' + parts.query
+    reader, writer = await asyncio.open_connection(
+        parts.hostname, port, ssl=https or None)
+    try:
+        lines = ['%s %s HTTP/1.1' % (method, selector),
+                 'Host: %s' % parts.netloc,
+                 'Connection: close']
+        for key, value in headers.items():
+            lines.append('%s: %s' % (key, value))
+        if body is not None:
+            lines.append('Content-Length: %s' % len(body))
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+        if body is not None:
+            writer.write(body)
+        await writer.drain()
+
+        status_line = await reader.readline()
+        status_parts = status_line.decode('latin-1').rstrip('\r\n').split(
+            ' ', 2)
+        try:
+            status = int(status_parts[1])
+        except (IndexError, ValueError):
+            raise http.client.BadStatusLine(status_line)
+        reason = status_parts[2:] and status_parts[2] or ''
+        header_lines = []
+        while 1:
+            line = await reader.readline()
+            header_lines.append(line)
+            if line in (b'\r\n', b'\n', b''):
+                break
+        msg = http.client.parse_headers(BytesIO(b''.join(header_lines)))
+        if method == 'HEAD' or status in (204, 304):
+            text = b''
+        elif msg.get('Transfer-Encoding', '').lower() == 'chunked':
+            text = await readChunked(reader)
+        elif msg.get('Content-Length') is not None:
+            text = await reader.readexactly(int(msg.get('Content-Length')))
+        else:
+            text = await reader.read()
+    finally:
+        writer.close()
+        # wait_closed is new in Python 3.7
+        if hasattr(writer, 'wait_closed'):
+            await writer.wait_closed()
+    return status, reason, msg, decodeBody(msg, text)
+
+def decodeBody(msg, text):
+    """Decompress a response body according to its Content-Encoding.
+    """
+    encoding = (msg.get('Content-Encoding') or 'identity').lower()
+    if not text:
+        return text
+    if encoding in ('gzip', 'x-gzip'):
+        return zlib.decompress(text, 16 + zlib.MAX_WBITS)
+    elif encoding == 'deflate':
+        try:
+            return zlib.decompress(text)
+        except zlib.error:
+            # some servers send raw deflate data without zlib header
+            return zlib.decompress(text, -zlib.MAX_WBITS)
+    elif encoding == 'identity':
+        return text
+    raise client.Error("Unsupported content encoding: %s" % encoding)
+
+async def readChunked(reader):
+    chunks = []
+    while 1:
+        size_line = await reader.readline()
+        size = int(size_line.split(b';')[0].strip(), 16)
+        if size == 0:
+            break
+        chunks.append(await reader.readexactly(size))
+        # skip the CRLF after the chunk data
+        await reader.readline()
+    # skip trailers
+    while 1:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+    return b''.join(chunks)
@@ -0,0 +1,198 @@
+"""An on-disk cache of OAI-PMH responses.
+"""
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    from urllib.parse import urlencode
+except ImportError:
+    from urllib import urlencode
+
+from oaipmh import client
+from oaipmh.fileutil import replaceFile
+
+# seconds responses are kept by default for each verb, None means
+# forever and 0 means responses aren't cached at all
+DEFAULT_TTLS = {
+    'Identify': 24 * 60 * 60,
+    'ListMetadataFormats': 24 * 60 * 60,
+    'ListSets': 24 * 60 * 60,
+    'GetRecord': 0,
+    'GetMetadata': 0,
+    'ListIdentifiers': 0,
+    'ListRecords': 0,
+    }
+
+# seconds after which a temporary file is considered left behind by a
+# crash
+TMP_MAX_AGE = 60 * 60
+
+def getRequestKey(kw):
+    """Create a stable key for the arguments of a request.
+    """
+    items = list(kw.items())
+    items.sort()
+    return urlencode(items)
+
+class ResponseCache(object):
+    """Keeps responses in files in a directory.
+
+    ttls maps verbs to the number of seconds their responses are kept,
+    see DEFAULT_TTLS. If max_size is given, the least recently used
+    responses are removed when the files together take more than
+    max_size bytes. Files are written under a temporary name and then
+    renamed, so that readers never see a partial response; temporary
+    files older than TMP_MAX_AGE are removed when the cache is created.
+    """
+    def __init__(self, directory, ttls=None, max_size=None):
+        self._directory = directory
+        self._ttls = DEFAULT_TTLS.copy()
+        if ttls is not None:
+            self._ttls.update(ttls)
+        self._max_size = max_size
+        self._lock = threading.Lock()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        # file name -> size, least recently used first
+        self._sizes = OrderedDict()
+        self._size = 0
+        entries = []
+        now = time.time()
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if name.endswith('.tmp'):
+                try:
+                    if os.path.getmtime(path) + TMP_MAX_AGE < now:
+                        os.remove(path)
+                except OSError:
+                    pass
+                continue
+            if not name.endswith('.xml'):
+                continue
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, name, stat.st_size))
+        entries.sort()
+        for mtime, name, size in entries:
+            self._sizes[name] = size
+            self._size += size
+
+    def getTTL(self, verb):
+        return self._ttls.get(verb, 0)
+
+    def get(self, key, verb):
+        """Return the cached response for key, or None if there's none or
+        it has expired.
+        """
+        ttl = self.getTTL(verb)
+        if ttl == 0:
+            return None
+        name = self._getName(key)
+        path = os.path.join(self._directory, name)
+        try:
+            if ttl is not None and os.path.getmtime(path) + ttl < time.time():
+                return None
+            with open(path, 'rb') as f:
+                response = f.read()
+        except (IOError, OSError):
+            return None
+        with self._lock:
+            if name in self._sizes:
+                size = self._sizes.pop(name)
+            else:
+                # written by another process
+                size = len(response)
+                self._size += size
+            self._sizes[name] = size
+        return response
+
+    def put(self, key, verb, response):
+        """Store response for key, if responses to verb are cached.
+        """
+        if self.getTTL(verb) == 0:
+            return
+        name = self._getName(key)
+        fd, tmp_path = tempfile.mkstemp(
+            suffix='.tmp', dir=self._directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(response)
+            replaceFile(tmp_path, os.path.join(self._directory, name))
+        except Exception:
+            os.remove(tmp_path)
+            raise
+        with self._lock:
+            self._size -= self._sizes.pop(name, 0)
+            self._sizes[name] = len(response)
+            self._size += len(response)
+            self._evict()
+
+    def size(self):
+        """The number of bytes taken by the cached responses.
+        """
+        return self._size
+
+    def clear(self):
+        """Remove all cached responses.
+        """
+        with self._lock:
+            for name in list(self._sizes):
+                self._remove(name)
+
+    def _evict(self):
+        if self._max_size is None:
+            return
+        while self._size > self._max_size and self._sizes:
+            self._remove(next(iter(self._sizes)))
+
+    def _remove(self, name):
+        self._size -= self._sizes.pop(name)
+        try:
+            os.remove(os.path.join(self._directory, name))
+        except OSError:
+            pass
+
+    def _getName(self, key):
+        return hashlib.sha1(key.encode('utf-8')).hexdigest() + '.xml'
+
+class CachingClient(client.Client):
+    """A Client that keeps the responses it retrieves in a ResponseCache.
+
+    Requests are identified by the base URL and their arguments, so a
+    cache can be shared by clients for different repositories. Only
+    responses that parse and report no OAI-PMH errors are kept.
+    """
+    def __init__(self, base_url, cache, metadata_registry=None, **kw):
+        client.Client.__init__(self, base_url, metadata_registry, **kw)
+        self._cache = cache
+
+    def makeRequest(self, **kw):
+        key = '%s?%s' % (self._base_url, getRequestKey(kw))
+        verb = kw.get('verb')
+        response = self._cache.get(key, verb)
+        if response is not None:
+            return response
+        response = client.Client.makeRequest(self, **kw)
+        if not isinstance(response, bytes):
+            response = response.encode('utf-8')
+        if self._cache.getTTL(verb) != 0 and self.isCacheable(response):
+            self._cache.put(key, verb, response)
+        return response
+
+    def makeRequestChunks(self, **kw):
+        # responses are cached as a whole
+        return [self.makeRequest(**kw)]
+
+    def isCacheable(self, response):
+        """Check that response is an OAI-PMH response without errors.
+        """
+        try:
+            tree = self.parse(response)
+        except SyntaxError:
+            return False
+        ns = self.getNamespaces()['oai']
+        return (tree.tag == '{%s}OAI-PMH' % ns and
+                tree.find('{%s}error' % ns) is None)
@@ -0,0 +1,226 @@
+"""Checkpointing of long harvests, so that they can be resumed after a
+crash or restart.
+"""
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+from oaipmh import error
+from oaipmh.datestamp import datestamp_to_datetime, datetime_to_datestamp
+from oaipmh.fileutil import writeJSON
+
+class Checkpoint(object):
+    """How far a harvest got.
+
+    token - resumption token of the next response to handle, or None
+    expirationDate - datetime at which token expires, or None
+    datestamp - latest datestamp of the items handled, or None; this is
+                for information only, lists aren't ordered by datestamp
+                so it can't be used to resume a harvest
+    count - number of items handled
+    """
+    def __init__(self, token=None, expirationDate=None, datestamp=None,
+                 count=0):
+        self.token = token
+        self.expirationDate = expirationDate
+        self.datestamp = datestamp
+        self.count = count
+
+    def toDict(self):
+        return {
+            'token': self.token,
+            'expirationDate': encodeDatetime(self.expirationDate),
+            'datestamp': encodeDatetime(self.datestamp),
+            'count': self.count,
+            }
+
+    def fromDict(cls, d):
+        return cls(d['token'], decodeDatetime(d['expirationDate']),
+                   decodeDatetime(d['datestamp']), d['count'])
+    fromDict = classmethod(fromDict)
+
+def encodeDatetime(dt):
+    if dt is None:
+        return None
+    return datetime_to_datestamp(dt)
+
+def decodeDatetime(datestamp):
+    if datestamp is None:
+        return None
+    return datestamp_to_datetime(datestamp)
+
+class FileCheckpointStore(object):
+    """Keeps checkpoints in a JSON file.
+
+    The file is replaced as a whole each time a checkpoint is saved, so
+    that a crash while saving leaves the previous checkpoint intact.
+    """
+    def __init__(self, path):
+        self._path = path
+        self._lock = threading.Lock()
+
+    def load(self, key):
+        with self._lock:
+            checkpoint = self._read().get(key)
+        if checkpoint is None:
+            return None
+        return Checkpoint.fromDict(checkpoint)
+
+    def save(self, key, checkpoint):
+        with self._lock:
+            checkpoints = self._read()
+            checkpoints[key] = checkpoint.toDict()
+            self._write(checkpoints)
+
+    def clear(self, key):
+        with self._lock:
+            checkpoints = self._read()
+            if key in checkpoints:
+                del checkpoints[key]
+                self._write(checkpoints)
+
+    def _read(self):
+        if not os.path.exists(self._path):
+            return {}
+        with open(self._path) as f:
+            return json.load(f)
+
+    def _write(self, checkpoints):
+        writeJSON(self._path, checkpoints)
+
+class SQLiteCheckpointStore(object):
+    """Keeps checkpoints in a SQLite database, which can be shared by
+    several processes.
+    """
+    def __init__(self, path):
+        self._path = path
+        connection = self._connect()
+        try:
+            with connection:
+                connection.execute(
+                    'CREATE TABLE IF NOT EXISTS checkpoint ('
+                    'key TEXT PRIMARY KEY, token TEXT, '
+                    'expiration_date TEXT, datestamp TEXT, count INTEGER)')
+        finally:
+            connection.close()
+
+    def _connect(self):
+        return sqlite3.connect(self._path, timeout=30)
+
+    def load(self, key):
+        connection = self._connect()
+        try:
+            row = connection.execute(
+                'SELECT token, expiration_date, datestamp, count '
+                'FROM checkpoint WHERE key = ?', (key,)).fetchone()
+        finally:
+            connection.close()
+        if row is None:
+            return None
+        token, expirationDate, datestamp, count = row
+        return Checkpoint(token, decodeDatetime(expirationDate),
+                          decodeDatetime(datestamp), count)
+
+    def save(self, key, checkpoint):
+        connection = self._connect()
+        try:
+            with connection:
+                connection.execute(
+                    'INSERT OR REPLACE INTO checkpoint '
+                    '(key, token, expiration_date, datestamp, count) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    (key, checkpoint.token,
+                     encodeDatetime(checkpoint.expirationDate),
+                     encodeDatetime(checkpoint.datestamp),
+                     checkpoint.count))
+        finally:
+            connection.close()
+
+    def clear(self, key):
+        connection = self._connect()
+        try:
+            with connection:
+                connection.execute(
+                    'DELETE FROM checkpoint WHERE key = ?', (key,))
+        finally:
+            connection.close()
+
+class CheckpointedHarvest(object):
+    """Harvests a list, saving a checkpoint in a store after each
+    response has been handled.
+
+    If a checkpoint exists when the harvest is started, the harvest
+    continues from its resumption token. If the token has expired or is
+    rejected by the repository (badResumptionToken), the list is
+    requested again from the start instead, with the original
+    arguments, and the checkpoint starts over.
+
+    Items are handled at least once: the items of a response that was
+    being handled during a crash are handled again.
+    """
+    def __init__(self, oai_client, store):
+        self._client = oai_client
+        self._store = store
+
+    def harvest(self, key, verb, callback, **kw):
+        """Do a ListIdentifiers, ListRecords or ListSets request with
+        arguments kw, passing each item to callback.
+
+        key identifies the harvest in the store. The checkpoint is
+        cleared once the list is complete.
+
+        Returns the number of items handled in this harvest and the
+        ones it continued, or only in this harvest if the list had to be
+        requested again from the start.
+        """
+        checkpoint = self._store.load(key)
+        if checkpoint is None:
+            checkpoint = Checkpoint()
+        batches = None
+        if checkpoint.token is not None and not (
+            checkpoint.expirationDate is not None and
+            checkpoint.expirationDate <= datetime.utcnow()):
+            batches = self._client.iterBatches(
+                verb, resumptionToken=checkpoint.token, **kw.copy())
+            try:
+                first = next(batches)
+            except error.BadResumptionTokenError:
+                batches = None
+        if batches is None:
+            # the items handled before will be handled again
+            checkpoint = Checkpoint()
+            batches = self._client.iterBatches(verb, **kw.copy())
+            try:
+                first = next(batches)
+            except error.NoRecordsMatchError:
+                first = [], None
+        items, token = first
+        while 1:
+            for item in items:
+                callback(item)
+                checkpoint.count += 1
+                datestamp = getDatestamp(verb, item)
+                if datestamp is not None and (
+                    checkpoint.datestamp is None or
+                    datestamp > checkpoint.datestamp):
+                    checkpoint.datestamp = datestamp
+            if token is None:
+                break
+            checkpoint.token = token
+            checkpoint.expirationDate = token.expirationDate
+            self._store.save(key, checkpoint)
+            try:
+                items, token = next(batches)
+            except StopIteration:
+                break
+        self._store.clear(key)
+        return checkpoint.count
+
+def getDatestamp(verb, item):
+    if verb == 'ListRecords':
+        return item[0].datestamp()
+    elif verb == 'ListIdentifiers':
+        return item.datestamp()
+    return None
@@ -17,6 +17,9 @@ import base64
 from lxml import etree
 import time
 import codecs
+import zlib
+import threading
+from six.moves import intern, queue
 
 from oaipmh import common, metadata, validation, error
 from oaipmh.datestamp import datestamp_to_datetime, datetime_to_datestamp
@@ -24,6 +27,10 @@ from oaipmh.datestamp import datestamp_to_datetime, datetime_to_datestamp
 WAIT_DEFAULT = 120 # two minutes
 WAIT_MAX = 5
 
+# content codings the client can decode, in order of preference
+SUPPORTED_COMPRESSIONS = ['gzip', 'deflate']
+CHUNK_SIZE = 64 * 1024
+
 class Error(Exception):
     pass
 
@@ -45,6 +52,10 @@ class BaseClient(common.OAIPMH):
             metadata_registry or metadata.global_metadata_registry)
         self._ignore_bad_character_hack = 0
         self._day_granularity = False
+        self._prefetch_depth = 0
+        self._streaming = False
+        # None, or whether to serialize elements when detaching them
+        self._detach = None
         self.retry_policy = self.default_retry_policy.copy()
         if custom_retry_policy is not None:
             self.retry_policy.update(custom_retry_policy)
@@ -53,7 +64,11 @@ class BaseClient(common.OAIPMH):
         """Update the granularity setting dependent on that the server says.
         """
         identify = self.identify()
-        granularity = identify.granularity()
+        self.setGranularity(identify.granularity())
+
+    def setGranularity(self, granularity):
+        """Set the granularity of datestamps sent to the server.
+        """
         if granularity == 'YYYY-MM-DD':
             self._day_granularity = True
         elif granularity == 'YYYY-MM-DDThh:mm:ssZ':
@@ -61,7 +76,25 @@ class BaseClient(common.OAIPMH):
         else:
             raise Error("Non-standard granularity on server: %s" % granularity)
 
+    def getDayGranularity(self):
+        """Return True if datestamps are sent to the server as days.
+        """
+        return self._day_granularity
+
     def handleVerb(self, verb, kw):
+        self.encodeArguments(verb, kw)
+        # now call underlying implementation
+        if self._streaming and verb in ['ListIdentifiers', 'ListRecords']:
+            return self.streamVerb(verb, kw)
+        method_name = verb + '_impl'
+        return getattr(self, method_name)(
+            kw, self.makeRequestErrorHandling(verb=verb, **kw))
+
+    def encodeArguments(self, verb, kw):
+        """Validate the arguments for verb and encode them for a request.
+
+        The kw dictionary is changed in place.
+        """
         # validate kw first
         validation.validateArguments(verb, kw)
         # encode datetimes as datestamps
@@ -82,11 +115,6 @@ class BaseClient(common.OAIPMH):
             # until is None but is explicitly in kw, remove it
             del kw['until']
 
-        # now call underlying implementation
-        method_name = verb + '_impl'
-        return getattr(self, method_name)(
-            kw, self.makeRequestErrorHandling(verb=verb, **kw))
-
     def getNamespaces(self):
         """Get OAI namespaces.
         """
@@ -107,9 +135,104 @@ class BaseClient(common.OAIPMH):
         """
         self._ignore_bad_character_hack = true_or_false
 
+    def setPrefetchDepth(self, depth):
+        """Fetch up to `depth` resumption batches ahead in a worker thread.
+
+        This lets network latency overlap with the processing of the
+        current batch by the consumer of listRecords, listIdentifiers and
+        listSets. A depth of 0 (the default) disables prefetching.
+        """
+        if depth < 0:
+            raise ValueError("Prefetch depth cannot be negative: %s" % depth)
+        self._prefetch_depth = depth
+
+    def setStreaming(self, true_or_false):
+        """Set to parse the pages of listRecords and listIdentifiers
+        incrementally.
+
+        Records and headers are then produced as soon as their element
+        has been parsed, and the elements that have been processed are
+        removed from the page tree. This keeps memory use flat on very
+        large pages. Prefetching is not used in streaming mode.
+        """
+        self._streaming = true_or_false
+
+    def setDetached(self, true_or_false, serialize=False):
+        """Set to detach headers and metadata from the response tree.
+
+        The element() of headers and metadata is then None, or a copy
+        of the element if serialize is true, and the response trees can
+        be freed as soon as they have been handled. Use this when
+        holding on to many headers or records.
+        """
+        if true_or_false:
+            self._detach = serialize
+        else:
+            self._detach = None
+
+    def resumptionList(self, firstBatch, nextBatch):
+        """Create a generator that follows resumption tokens.
+
+        Depending on the prefetch depth, batches are retrieved either
+        on demand or in a worker thread.
+        """
+        if self._prefetch_depth:
+            return PrefetchingResumptionListGenerator(
+                firstBatch, nextBatch, self._prefetch_depth)
+        return ResumptionListGenerator(firstBatch, nextBatch)
+
+    def iterBatches(self, verb, resumptionToken=None, **kw):
+        """Iterate over the responses to a ListIdentifiers, ListRecords or
+        ListSets request, following resumption tokens.
+
+        Yields a tuple of the list of items in the response and its
+        resumption token (None for the last response). Unlike the list
+        verb methods this gives access to the token and the attributes
+        that come with it, such as completeListSize.
+
+        If resumptionToken is given the list is continued from there; kw
+        should then hold the arguments the list was started with.
+        """
+        self.encodeArguments(verb, kw)
+        if resumptionToken is not None:
+            tree = self.makeRequestErrorHandling(
+                verb=verb, resumptionToken=resumptionToken)
+        else:
+            tree = self.makeRequestErrorHandling(verb=verb, **kw)
+        while 1:
+            result, token = self.buildBatch(verb, kw, tree)
+            yield result, token
+            if token is None or not result:
+                break
+            tree = self.makeRequestErrorHandling(
+                verb=verb, resumptionToken=token)
+
+    def listIdentifierBatches(self, **kw):
+        """Do a ListIdentifiers request, following resumption tokens.
+
+        Takes the same arguments as listIdentifiers, but yields a
+        common.HeaderBatch for each response instead of a Header for
+        each header. This is a lot cheaper when only the identifiers,
+        datestamps, setSpecs and deleted flags are needed.
+        """
+        self.encodeArguments('ListIdentifiers', kw)
+        tree = self.makeRequestErrorHandling(verb='ListIdentifiers', **kw)
+        while 1:
+            batch = self.buildHeaderBatch(self.getNamespaces(), tree)
+            yield batch
+            if batch.token is None or not len(batch):
+                break
+            tree = self.makeRequestErrorHandling(
+                verb='ListIdentifiers', resumptionToken=batch.token)
+
     def parse(self, xml):
         """Parse the XML to a lxml tree.
         """
+        return etree.XML(self.prepareXML(xml))
+
+    def prepareXML(self, xml):
+        """Prepare the XML text of a response for parsing.
+        """
         # XXX this is only safe for UTF-8 encoded content,
         # and we're basically hacking around non-wellformedness anyway,
         # but oh well
@@ -122,7 +245,7 @@ class BaseClient(common.OAIPMH):
             if hasattr(xml, "encode"):
                 xml = xml.encode("utf-8")
             # xml = xml.encode("utf-8")
-        return etree.XML(xml)
+        return xml
 
     # implementation of the various methods, delegated here by
     # handleVerb method
@@ -142,12 +265,10 @@ class BaseClient(common.OAIPMH):
 
     def Identify_impl(self, args, tree):
         namespaces = self.getNamespaces()
-        evaluator = etree.XPathEvaluator(tree, namespaces=namespaces)
-        identify_node = evaluator.evaluate(
+        evaluator = xpathEvaluator(tree, namespaces)
+        identify_node = evaluator(
             '/oai:OAI-PMH/oai:Identify')[0]
-        identify_evaluator = etree.XPathEvaluator(identify_node,
-                                                  namespaces=namespaces)
-        e = identify_evaluator.evaluate
+        e = xpathEvaluator(identify_node, namespaces)
 
         repositoryName = e('string(oai:repositoryName/text())')
         baseURL = e('string(oai:baseURL/text())')
@@ -173,19 +294,17 @@ class BaseClient(common.OAIPMH):
             tree = self.makeRequestErrorHandling(verb='ListIdentifiers',
                                                  resumptionToken=token)
             return self.buildIdentifiers(namespaces, tree)
-        return ResumptionListGenerator(firstBatch, nextBatch)
+        return self.resumptionList(firstBatch, nextBatch)
 
     def ListMetadataFormats_impl(self, args, tree):
         namespaces = self.getNamespaces()
-        evaluator = etree.XPathEvaluator(tree,
-                                         namespaces=namespaces)
+        evaluator = xpathEvaluator(tree, namespaces)
 
-        metadataFormat_nodes = evaluator.evaluate(
+        metadataFormat_nodes = evaluator(
             '/oai:OAI-PMH/oai:ListMetadataFormats/oai:metadataFormat')
         metadataFormats = []
         for metadataFormat_node in metadataFormat_nodes:
-            e = etree.XPathEvaluator(metadataFormat_node,
-                                     namespaces=namespaces).evaluate
+            e = xpathEvaluator(metadataFormat_node, namespaces)
             metadataPrefix = e('string(oai:metadataPrefix/text())')
             schema = e('string(oai:schema/text())')
             metadataNamespace = e('string(oai:metadataNamespace/text())')
@@ -209,7 +328,7 @@ class BaseClient(common.OAIPMH):
             return self.buildRecords(
                 metadata_prefix, namespaces,
                 metadata_registry, tree)
-        return ResumptionListGenerator(firstBatch, nextBatch)
+        return self.resumptionList(firstBatch, nextBatch)
 
     def ListSets_impl(self, args, tree):
         namespaces = self.getNamespaces()
@@ -220,74 +339,146 @@ class BaseClient(common.OAIPMH):
                 verb='ListSets',
                 resumptionToken=token)
             return self.buildSets(namespaces, tree)
-        return ResumptionListGenerator(firstBatch, nextBatch)
+        return self.resumptionList(firstBatch, nextBatch)
+
+    def streamVerb(self, verb, kw):
+        """Handle ListIdentifiers or ListRecords in streaming mode.
+        """
+        namespaces = self.getNamespaces()
+        if verb == 'ListRecords':
+            tag = 'record'
+            metadata_prefix = kw['metadataPrefix']
+            metadata_registry = self._metadata_registry
+            def build(record_node):
+                return self.buildRecord(
+                    metadata_prefix, namespaces,
+                    metadata_registry, record_node)
+        else:
+            tag = 'header'
+            def build(header_node):
+                header = buildHeader(header_node, namespaces)
+                if self._detach is not None:
+                    header.detach(self._detach)
+                return header
+        # the first batch is requested straight away, like in non-streaming
+        # mode, so that errors are raised early
+        batch = self.makeStreamingRequest(tag, build, verb=verb, **kw)
+        def firstBatch():
+            return batch
+        def nextBatch(token):
+            return self.makeStreamingRequest(
+                tag, build, verb=verb, resumptionToken=token)
+        return StreamingResumptionListGenerator(firstBatch, nextBatch)
 
     # various helper methods
 
+    def buildBatch(self, verb, args, tree):
+        """Build a list of items and resumption token from the response
+        tree of a ListIdentifiers, ListRecords or ListSets request.
+
+        args - the arguments of the first request of the list
+        """
+        namespaces = self.getNamespaces()
+        if verb == 'ListRecords':
+            return self.buildRecords(
+                args['metadataPrefix'], namespaces,
+                self._metadata_registry, tree)
+        elif verb == 'ListIdentifiers':
+            return self.buildIdentifiers(namespaces, tree)
+        elif verb == 'ListSets':
+            return self.buildSets(namespaces, tree)
+        raise ValueError("Not a list verb: %s" % verb)
+
+
     def buildRecords(self,
                      metadata_prefix, namespaces, metadata_registry, tree):
         # first find resumption token if available
-        evaluator = etree.XPathEvaluator(tree,
-                                         namespaces=namespaces)
-        token = evaluator.evaluate(
-            'string(/oai:OAI-PMH/*/oai:resumptionToken/text())')
-        if token.strip() == '':
-            token = None
-        record_nodes = evaluator.evaluate(
+        evaluator = xpathEvaluator(tree, namespaces)
+        token = buildResumptionToken(
+            evaluator('/oai:OAI-PMH/*/oai:resumptionToken'))
+        record_nodes = evaluator(
             '/oai:OAI-PMH/*/oai:record')
         result = []
         for record_node in record_nodes:
-            record_evaluator = etree.XPathEvaluator(record_node,
-                                                    namespaces=namespaces)
-            e = record_evaluator.evaluate
-            # find header node
-            header_node = e('oai:header')[0]
-            # create header
-            header = buildHeader(header_node, namespaces)
-            # find metadata node
-            metadata_list = e('oai:metadata')
-            if metadata_list:
-                metadata_node = metadata_list[0]
-                # create metadata
-                metadata = metadata_registry.readMetadata(metadata_prefix,
-                                                          metadata_node)
-            else:
-                metadata = None
-            # XXX TODO: about, should be third element of tuple
-            result.append((header, metadata, None))
+            result.append(self.buildRecord(
+                metadata_prefix, namespaces, metadata_registry, record_node))
         return result, token
 
+    def buildRecord(self,
+                    metadata_prefix, namespaces, metadata_registry,
+                    record_node):
+        e = xpathEvaluator(record_node, namespaces)
+        # find header node
+        header_node = e('oai:header')[0]
+        # create header
+        header = buildHeader(header_node, namespaces)
+        # find metadata node
+        metadata_list = e('oai:metadata')
+        if metadata_list:
+            metadata_node = metadata_list[0]
+            # create metadata
+            metadata = metadata_registry.readMetadata(metadata_prefix,
+                                                      metadata_node)
+        else:
+            metadata = None
+        if self._detach is not None:
+            header.detach(self._detach)
+            if isinstance(metadata, common.Metadata):
+                metadata.detach(self._detach)
+        # XXX TODO: about, should be third element of tuple
+        return header, metadata, None
+
     def buildIdentifiers(self, namespaces, tree):
-        evaluator = etree.XPathEvaluator(tree,
-                                         namespaces=namespaces)
+        evaluator = xpathEvaluator(tree, namespaces)
         # first find resumption token is available
-        token = evaluator.evaluate(
-            'string(/oai:OAI-PMH/*/oai:resumptionToken/text())')
-        #'string(/oai:OAI-PMH/oai:ListIdentifiers/oai:resumptionToken/text())')
-        if token.strip() == '':
-            token = None
-        header_nodes = evaluator.evaluate(
+        token = buildResumptionToken(
+            evaluator('/oai:OAI-PMH/*/oai:resumptionToken'))
+        header_nodes = evaluator(
                 '/oai:OAI-PMH/oai:ListIdentifiers/oai:header')
         result = []
         for header_node in header_nodes:
             header = buildHeader(header_node, namespaces)
+            if self._detach is not None:
+                header.detach(self._detach)
             result.append(header)
         return result, token
 
+    def buildHeaderBatch(self, namespaces, tree):
+        evaluator = xpathEvaluator(tree, namespaces)
+        batch = common.HeaderBatch(buildResumptionToken(
+            evaluator('/oai:OAI-PMH/*/oai:resumptionToken')))
+        ns = '{%s}' % namespaces['oai']
+        identifier_tag = ns + 'identifier'
+        datestamp_tag = ns + 'datestamp'
+        setspec_tag = ns + 'setSpec'
+        # look at the children of each header directly, instead of
+        # evaluating an XPath expression for each field
+        for header_node in evaluator(
+            '/oai:OAI-PMH/oai:ListIdentifiers/oai:header'):
+            identifier = datestamp = ''
+            setspec = []
+            for child in header_node:
+                if child.tag == identifier_tag:
+                    identifier = child.text or ''
+                elif child.tag == datestamp_tag:
+                    datestamp = child.text or ''
+                elif child.tag == setspec_tag:
+                    setspec.append(child.text or '')
+            batch.append(
+                identifier, datestamp_to_datetime(datestamp), setspec,
+                header_node.get('status') == 'deleted')
+        return batch
+
     def buildSets(self, namespaces, tree):
-        evaluator = etree.XPathEvaluator(tree,
-                                         namespaces=namespaces)
+        evaluator = xpathEvaluator(tree, namespaces)
         # first find resumption token if available
-        token = evaluator.evaluate(
-            'string(/oai:OAI-PMH/oai:ListSets/oai:resumptionToken/text())')
-        if token.strip() == '':
-            token = None
-        set_nodes = evaluator.evaluate(
+        token = buildResumptionToken(
+            evaluator('/oai:OAI-PMH/oai:ListSets/oai:resumptionToken'))
+        set_nodes = evaluator(
             '/oai:OAI-PMH/oai:ListSets/oai:set')
         sets = []
         for set_node in set_nodes:
-            e = etree.XPathEvaluator(set_node,
-                                     namespaces=namespaces).evaluate
+            e = xpathEvaluator(set_node, namespaces)
             # make sure we get back unicode strings instead
             # of lxml.etree._ElementUnicodeResult objects.
             setSpec = six.text_type(e('string(oai:setSpec/text())'))
@@ -297,48 +488,179 @@ class BaseClient(common.OAIPMH):
         return sets, token
 
     def makeRequestErrorHandling(self, **kw):
-        xml = self.makeRequest(**kw)
+        return self.handleResponse(self.makeRequest(**kw), kw)
+
+    def handleResponse(self, xml, kw):
+        """Parse the response to a request, raising any OAI-PMH errors.
+        """
         try:
             tree = self.parse(xml)
         except SyntaxError:
             raise error.XMLSyntaxError(kw)
         # check whether there are errors first
-        e_errors = tree.xpath('/oai:OAI-PMH/oai:error',
-                              namespaces=self.getNamespaces())
+        e_errors = compileXPath('/oai:OAI-PMH/oai:error',
+                                self.getNamespaces())(tree)
         if e_errors:
             # XXX right now only raise first error found, does not
             # collect error info
             for e_error in e_errors:
-                code = e_error.get('code')
-                msg = e_error.text
-                if code not in ['badArgument', 'badResumptionToken',
-                                'badVerb', 'cannotDisseminateFormat',
-                                'idDoesNotExist', 'noRecordsMatch',
-                                'noMetadataFormats', 'noSetHierarchy']:
-                    raise error.UnknownError(
-                          "Unknown error code from server: %s, message: %s" % (
-                        code, msg))
-                # find exception in error module and raise with msg
-                raise getattr(error, code[0].upper() + code[1:] + 'Error')(msg)
+                raiseError(e_error.get('code'), e_error.text)
         return tree
 
+    def makeStreamingRequest(self, tag, build, **kw):
+        """Make a request and return a StreamingBatch for the response.
+
+        tag - local name of the OAI elements that make up the list
+        build - function that turns such an element into an item
+        """
+        chunks = self.makeRequestChunks(**kw)
+        if self._ignore_bad_character_hack:
+            # the hack needs the complete response
+            chunks = list(chunks)
+            if len(chunks) == 1:
+                xml = chunks[0]
+            else:
+                xml = b''.join(chunks)
+            chunks = [self.prepareXML(xml)]
+        else:
+            chunks = (self.prepareXML(chunk) for chunk in chunks)
+        return StreamingBatch(
+            chunks, '{%s}' % self.getNamespaces()['oai'], tag, build, kw)
+
     def makeRequest(self, **kw):
         raise NotImplementedError
 
+    def makeRequestChunks(self, **kw):
+        """Make a request and return an iterable of chunks of the
+        response, so that it can be parsed while it comes in.
+
+        By default the response is retrieved as a whole by makeRequest.
+        """
+        return [self.makeRequest(**kw)]
+
+class StreamingBatch(object):
+    """A batch of list items that is parsed while it is iterated over.
+
+    The response is parsed from xml, an iterable of chunks of bytes (or
+    the bytes of a complete response), one chunk at a time. Each item is
+    built as soon as its element is complete, and the elements before it
+    are removed from the tree. The resumption token is available as
+    `token` once iteration has finished.
+    """
+    def __init__(self, xml, namespace, tag, build, kw):
+        self.token = None
+        self._namespace = namespace
+        self._tag = namespace + tag
+        self._build = build
+        self._kw = kw
+        self._items = self._parse(xml)
+        # parse up to the first item, so that errors are raised early
+        self._first = next(self._items, _end)
+
+    def __iter__(self):
+        first, self._first = self._first, _end
+        if first is _end:
+            return
+        yield first
+        for item in self._items:
+            yield item
+
+    def _parse(self, xml):
+        if isinstance(xml, bytes):
+            xml = [xml]
+        ns = self._namespace
+        parser = etree.XMLPullParser(
+            events=('end',),
+            tag=(ns + 'error', ns + 'resumptionToken', self._tag))
+        try:
+            for chunk in xml:
+                parser.feed(chunk)
+                for item in self._readEvents(parser):
+                    yield item
+            parser.close()
+            for item in self._readEvents(parser):
+                yield item
+        except etree.XMLSyntaxError:
+            raise error.XMLSyntaxError(self._kw)
+        finally:
+            # let a streamed response close its connection
+            close = getattr(xml, 'close', None)
+            if close is not None:
+                close()
+
+    def _readEvents(self, parser):
+        ns = self._namespace
+        for event, element in parser.read_events():
+            if element.tag == self._tag:
+                item = self._build(element)
+                # free the elements we've already handled
+                parent = element.getparent()
+                while element.getprevious() is not None:
+                    del parent[0]
+                yield item
+            elif element.tag == ns + 'resumptionToken':
+                self.token = buildResumptionToken([element])
+            else:
+                raiseError(element.get('code'), element.text)
+
+_end = object()
+
+def raiseError(code, msg):
+    """Raise the exception for an OAI-PMH error code.
+    """
+    if code not in ['badArgument', 'badResumptionToken',
+                    'badVerb', 'cannotDisseminateFormat',
+                    'idDoesNotExist', 'noRecordsMatch',
+                    'noMetadataFormats', 'noSetHierarchy']:
+        raise error.UnknownError(
+              "Unknown error code from server: %s, message: %s" % (
+            code, msg))
+    # find exception in error module and raise with msg
+    raise getattr(error, code[0].upper() + code[1:] + 'Error')(msg)
+
 class Client(BaseClient):
 
     def __init__(self, base_url, metadata_registry=None, credentials=None,
-                 local_file=False, force_http_get=False, custom_retry_policy=None):
+                 local_file=False, force_http_get=False, custom_retry_policy=None,
+                 connection_pool=None, use_compression=False):
         BaseClient.__init__(self, metadata_registry,
                             custom_retry_policy=custom_retry_policy)
         self._base_url = base_url
         self._local_file = local_file
         self._force_http_get = force_http_get
+        # a connection.ConnectionPool to reuse persistent connections,
+        # if None a new connection is opened for each request
+        self._connection_pool = connection_pool
+        self._use_compression = use_compression
+        # content codings to accept, None if not negotiated yet
+        self._compressions = None
+        self._statistics = TransferStatistics()
         if credentials is not None:
             self._credentials = base64.encodestring('%s:%s' % credentials)
         else:
             self._credentials = None
 
+    def updateCompression(self):
+        """Update the accepted compressions dependent on what the server
+        says.
+        """
+        # make sure Identify itself does not trigger negotiation again
+        self._compressions = []
+        try:
+            compressions = self.identify().compression() or []
+        except:
+            # negotiate again for the next request
+            self._compressions = None
+            raise
+        self._compressions = [
+            compression for compression in SUPPORTED_COMPRESSIONS
+            if compression in compressions]
+
+    def transferStatistics(self):
+        """Return the TransferStatistics of the requests made so far.
+        """
+        return self._statistics
+
     def makeRequest(self, **kw):
         """Either load a local XML file or actually retrieve XML from a server.
         """
@@ -347,35 +669,172 @@ class Client(BaseClient):
                 text = xmlfile.read()
             return text.encode('ascii', 'replace')
         else:
-            # XXX include From header?
-            headers = {'User-Agent': 'pyoai'}
-            if self._credentials is not None:
-                headers['Authorization'] = 'Basic ' + self._credentials.strip()
-            if self._force_http_get:
-                request_url = '%s?%s' % (self._base_url, urlencode(kw))
-                request = urllib2.Request(request_url, headers=headers)
-            else:
-                binary_data = urlencode(kw).encode('utf-8')
-                request = urllib2.Request(
-                    self._base_url, data=binary_data, headers=headers)
-
             return retrieveFromUrlWaiting(
-                request,
+                self._createRequest(kw),
                 wait_max=self.retry_policy['retry'],
                 wait_default=self.retry_policy['wait-default'],
-                expected_errcodes=self.retry_policy['expected-errcodes']
+                expected_errcodes=self.retry_policy['expected-errcodes'],
+                urlopen=self._getURLOpen(),
+                statistics=self._statistics
             )
 
+    def makeRequestChunks(self, **kw):
+        """Retrieve the response from the server in chunks, which are
+        read from the connection (and decompressed) as they are asked
+        for.
+        """
+        if self._local_file:
+            return [self.makeRequest(**kw)]
+        f = openUrlWaiting(
+            self._createRequest(kw),
+            wait_max=self.retry_policy['retry'],
+            wait_default=self.retry_policy['wait-default'],
+            expected_errcodes=self.retry_policy['expected-errcodes'],
+            urlopen=self._getURLOpen())
+        return iterResponse(f, statistics=self._statistics)
+
+    def _getURLOpen(self):
+        if self._connection_pool is not None:
+            return self._connection_pool.urlopen
+        return None
+
+    def _createRequest(self, kw):
+        """Create the urllib2.Request for a request with arguments kw.
+        """
+        # XXX include From header?
+        headers = {'User-Agent': 'pyoai'}
+        if self._credentials is not None:
+            headers['Authorization'] = 'Basic ' + self._credentials.strip()
+        if self._use_compression:
+            if self._compressions is None and kw.get('verb') != 'Identify':
+                try:
+                    self.updateCompression()
+                except Exception:
+                    # compression is only an optimisation, so the
+                    # request is done uncompressed instead
+                    pass
+            if self._compressions:
+                headers['Accept-Encoding'] = ', '.join(self._compressions)
+        if self._force_http_get:
+            request_url = '%s?%s' % (self._base_url, urlencode(kw))
+            request = urllib2.Request(request_url, headers=headers)
+        else:
+            binary_data = urlencode(kw).encode('utf-8')
+            request = urllib2.Request(
+                self._base_url, data=binary_data, headers=headers)
+        return request
+
+class TransferStatistics(object):
+    """Counts the bytes a client received, before and after decompression.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.compressed_bytes = 0
+        self.uncompressed_bytes = 0
+
+    def add(self, compressed_bytes, uncompressed_bytes):
+        with self._lock:
+            self.requests += 1
+            self.compressed_bytes += compressed_bytes
+            self.uncompressed_bytes += uncompressed_bytes
+
+    def ratio(self):
+        """Uncompressed size relative to the size on the wire.
+        """
+        if not self.compressed_bytes:
+            return 1.0
+        return float(self.uncompressed_bytes) / self.compressed_bytes
+
+class XPathCache(dict):
+    """Compiled XPath expressions for a namespace map, by expression.
+
+    Expressions are compiled the first time they are looked up.
+    """
+    def __init__(self, namespaces):
+        dict.__init__(self)
+        self._namespaces = namespaces
+
+    def __missing__(self, expr):
+        xpath = self[expr] = etree.XPath(expr, namespaces=self._namespaces)
+        return xpath
+
+# namespace map -> XPathCache
+_xpath_caches = {}
+
+def getXPathCache(namespaces):
+    key = tuple(sorted(namespaces.items()))
+    try:
+        return _xpath_caches[key]
+    except KeyError:
+        xpaths = _xpath_caches[key] = XPathCache(dict(namespaces))
+        return xpaths
+
+def compileXPath(expr, namespaces):
+    """Return the compiled XPath for an expression and namespace map.
+
+    Compiled expressions are cached, so each is compiled only once.
+    """
+    return getXPathCache(namespaces)[expr]
+
+def xpathEvaluator(node, namespaces):
+    """Return a function that evaluates XPath expressions on node.
+
+    This works like the evaluate method of etree.XPathEvaluator, but uses
+    cached compiled expressions.
+    """
+    xpaths = getXPathCache(namespaces)
+    def evaluate(expr):
+        return xpaths[expr](node)
+    return evaluate
+
 def buildHeader(header_node, namespaces):
-    e = etree.XPathEvaluator(header_node,
-                            namespaces=namespaces).evaluate
+    e = xpathEvaluator(header_node, namespaces)
     identifier = e('string(oai:identifier/text())')
     datestamp = datestamp_to_datetime(
         str(e('string(oai:datestamp/text())')))
-    setspec = [str(s) for s in e('oai:setSpec/text()')]
+    # the same few setSpecs come back over and over, share them
+    setspec = [intern(str(s)) for s in e('oai:setSpec/text()')]
     deleted = e("@status = 'deleted'")
     return common.Header(header_node, identifier, datestamp, setspec, deleted)
 
+def buildResponseDate(tree, namespaces):
+    """Get the responseDate of a response tree as a datetime.
+    """
+    return datestamp_to_datetime(str(compileXPath(
+        'string(/oai:OAI-PMH/oai:responseDate/text())', namespaces)(tree)))
+
+def buildResumptionToken(token_nodes):
+    """Create a ResumptionToken from a list of resumptionToken elements.
+
+    Returns None if there is no token, or it is empty. Attributes that
+    can't be understood are ignored.
+    """
+    if not token_nodes:
+        return None
+    token_node = token_nodes[0]
+    token = (token_node.text or '').strip()
+    if not token:
+        return None
+    completeListSize = token_node.get('completeListSize')
+    cursor = token_node.get('cursor')
+    expirationDate = token_node.get('expirationDate')
+    try:
+        completeListSize = int(completeListSize)
+    except (TypeError, ValueError):
+        completeListSize = None
+    try:
+        cursor = int(cursor)
+    except (TypeError, ValueError):
+        cursor = None
+    if expirationDate is not None:
+        try:
+            expirationDate = datestamp_to_datetime(expirationDate)
+        except error.DatestampError:
+            expirationDate = None
+    return common.ResumptionToken(
+        token, completeListSize, cursor, expirationDate)
+
 def ResumptionListGenerator(firstBatch, nextBatch):
     result, token = firstBatch()
     while 1:
@@ -387,18 +846,101 @@ def ResumptionListGenerator(firstBatch, nextBatch):
             break
         result, token = nextBatch(token)
 
+def PrefetchingResumptionListGenerator(firstBatch, nextBatch, depth=1):
+    """Like ResumptionListGenerator, but batches are retrieved in a worker
+    thread, up to `depth` batches ahead of the consumer.
+
+    Exceptions raised while retrieving a batch are re-raised in the
+    consumer once it reaches that batch. Closing the generator stops the
+    worker after the request it is busy with.
+    """
+    batches = queue.Queue(depth)
+    stopped = threading.Event()
+
+    def put(entry):
+        # don't block forever on a full queue if the consumer went away
+        while not stopped.is_set():
+            try:
+                batches.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def worker():
+        try:
+            result, token = firstBatch()
+            while 1:
+                # defeat the laziness of batches, parsing should happen
+                # in this thread as well
+                result = list(result)
+                if not put((result, token, None)):
+                    return
+                if token is None or not result:
+                    return
+                result, token = nextBatch(token)
+        except:
+            put((None, None, sys.exc_info()))
+
+    thread = threading.Thread(target=worker)
+    thread.daemon = True
+    thread.start()
+    try:
+        while 1:
+            result, token, exc_info = batches.get()
+            if exc_info is not None:
+                six.reraise(*exc_info)
+            for item in result:
+                yield item
+            if token is None or not result:
+                break
+    finally:
+        stopped.set()
+
+def StreamingResumptionListGenerator(firstBatch, nextBatch):
+    """Like ResumptionListGenerator, for batches of StreamingBatch.
+    """
+    batch = firstBatch()
+    while 1:
+        itemFound = False
+        for item in batch:
+            yield item
+            itemFound = True
+        if batch.token is None or not itemFound:
+            break
+        batch = nextBatch(batch.token)
+
 def retrieveFromUrlWaiting(request,
                            wait_max=WAIT_MAX, wait_default=WAIT_DEFAULT,
-                           expected_errcodes={503}):
+                           expected_errcodes={503}, urlopen=None,
+                           statistics=None):
     """Get text from URL, handling 503 Retry-After.
+
+    urlopen - alternative to urllib2.urlopen to open the request with,
+              such as the urlopen method of a connection.ConnectionPool
+    statistics - TransferStatistics to count the received bytes in
+    """
+    f = openUrlWaiting(request, wait_max, wait_default, expected_errcodes,
+                       urlopen)
+    try:
+        size, text = readResponse(f)
+    finally:
+        f.close()
+    if statistics is not None:
+        statistics.add(size, len(text))
+    return text
+
+def openUrlWaiting(request,
+                   wait_max=WAIT_MAX, wait_default=WAIT_DEFAULT,
+                   expected_errcodes={503}, urlopen=None):
+    """Open URL, handling 503 Retry-After, and return the response.
     """
+    if urlopen is None:
+        urlopen = urllib2.urlopen
     for i in list(range(wait_max)):
         try:
-            f = urllib2.urlopen(request)
-            text = f.read()
-            f.close()
             # we successfully opened without having to wait
-            break
+            return urlopen(request)
         except urllib2.HTTPError as e:
             if e.code in expected_errcodes:
                 try:
@@ -412,9 +954,72 @@ def retrieveFromUrlWaiting(request,
             else:
                 # reraise any other HTTP error
                 raise
+    raise Error("Waited too often (more than %s times)" % wait_max)
+
+def readResponse(f, chunk_size=CHUNK_SIZE):
+    """Read a HTTP response body, decompressing it while it comes in.
+
+    Returns the number of bytes read and the decoded body.
+    """
+    size = 0
+    chunks = []
+    for read, data in decodeResponse(f, chunk_size):
+        size += read
+        chunks.append(data)
+    return size, b''.join(chunks)
+
+def iterResponse(f, chunk_size=CHUNK_SIZE, statistics=None):
+    """Yield the decoded chunks of a HTTP response body as it comes in,
+    and close it at the end.
+
+    statistics - TransferStatistics to count the received bytes in
+    """
+    size = 0
+    decoded = 0
+    try:
+        for read, data in decodeResponse(f, chunk_size):
+            size += read
+            decoded += len(data)
+            if data:
+                yield data
+    finally:
+        f.close()
+    if statistics is not None:
+        statistics.add(size, decoded)
+
+def decodeResponse(f, chunk_size=CHUNK_SIZE):
+    """Yield the number of bytes read and the decoded data for each
+    chunk of a HTTP response body.
+    """
+    encoding = (f.info().get('Content-Encoding') or 'identity').lower()
+    if encoding in ('gzip', 'x-gzip'):
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    elif encoding == 'deflate':
+        decompressor = zlib.decompressobj()
+    elif encoding == 'identity':
+        decompressor = None
     else:
-        raise Error("Waited too often (more than %s times)" % wait_max)
-    return text
+        raise Error("Unsupported content encoding: %s" % encoding)
+    started = False
+    while 1:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            break
+        if decompressor is not None:
+            try:
+                data = decompressor.decompress(chunk)
+            except zlib.error:
+                if started or encoding != 'deflate':
+                    raise
+                # some servers send raw deflate data without zlib header
+                decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+                data = decompressor.decompress(chunk)
+        else:
+            data = chunk
+        started = True
+        yield len(chunk), data
+    if decompressor is not None:
+        yield 0, decompressor.flush()
 
 class ServerClient(BaseClient):
     def __init__(self, server, metadata_registry=None):
@@ -1,8 +1,18 @@
+import calendar
+from array import array
+from datetime import datetime, timedelta
+
 import pkg_resources
 
+import six
+from lxml import etree
+
 from oaipmh import error
 
 class Header(object):
+    __slots__ = ('_element', '_identifier', '_datestamp', '_setspec',
+                 '_deleted')
+
     def __init__(self, element, identifier, datestamp, setspec, deleted):
         self._element = element
         # force identifier to be a string, it might be 
@@ -16,7 +26,7 @@ class Header(object):
         self._deleted = deleted
 
     def element(self):
-        return self._element
+        return getElement(self._element)
 
     def identifier(self):
         return self._identifier
@@ -30,13 +40,23 @@ class Header(object):
     def isDeleted(self):
         return self._deleted
 
+    def detach(self, serialize=False):
+        """Let go of the element, so that the tree it is in can be freed.
+
+        If serialize is true the element is kept as XML text instead,
+        and element() returns a copy of it.
+        """
+        self._element = detachElement(self._element, serialize)
+
 class Metadata(object):
+    __slots__ = ('_element', '_map')
+
     def __init__(self, element, map):
         self._element = element
         self._map = map
 
     def element(self):
-        return self._element
+        return getElement(self._element)
 
     def getMap(self):
         return self._map
@@ -46,6 +66,233 @@ class Metadata(object):
 
     __getitem__ = getField
 
+    def detach(self, serialize=False):
+        """Let go of the element, like Header.detach.
+        """
+        self._element = detachElement(self._element, serialize)
+
+def detachElement(element, serialize):
+    if not serialize:
+        return None
+    if element is None or isinstance(element, bytes):
+        return element
+    return etree.tostring(element)
+
+def getElement(element):
+    if isinstance(element, bytes):
+        return etree.fromstring(element)
+    return element
+
+class LazyMetadata(Metadata):
+    """Metadata that reads its fields from the element when they are
+    first asked for.
+
+    readers - dictionary with for each field a function that reads it
+              from the element
+    """
+    __slots__ = ('_readers',)
+
+    def __init__(self, element, readers):
+        Metadata.__init__(self, element, {})
+        self._readers = readers
+
+    def getMap(self):
+        if len(self._map) < len(self._readers):
+            for name in self._readers:
+                self.getField(name)
+        return self._map
+
+    def getField(self, name):
+        try:
+            return self._map[name]
+        except KeyError:
+            value = self._map[name] = self._readers[name](self._element)
+            return value
+
+    __getitem__ = getField
+
+    def detach(self, serialize=False):
+        # read all fields while the element is still there
+        self.getMap()
+        Metadata.detach(self, serialize)
+
+try:
+    array('q')
+    DATESTAMP_TYPECODE = 'q'
+except ValueError:
+    # Python 2
+    DATESTAMP_TYPECODE = 'l'
+
+EPOCH = datetime(1970, 1, 1)
+
+def datetime_to_epoch(dt):
+    return calendar.timegm(dt.utctimetuple())
+
+def epoch_to_datetime(seconds):
+    return EPOCH + timedelta(seconds=seconds)
+
+class HeaderBatch(object):
+    """The headers of a page of ListIdentifiers, stored column by column.
+
+    Datestamps are kept as seconds since the epoch in an array,
+    identifiers as UTF-8 in a single byte string with an array of
+    offsets, deleted flags in a bitmap and setSpecs as numbers into a
+    table of the distinct setSpecs of the batch. This takes a fraction
+    of the memory and time of a Header object for each row.
+
+    Iterating over a batch gives (identifier, datestamp, setSpecs,
+    deleted) tuples.
+    """
+    def __init__(self, token=None):
+        self.token = token
+        self._datestamps = array(DATESTAMP_TYPECODE)
+        self._identifiers = bytearray()
+        self._identifier_offsets = array('L', [0])
+        self._deleted = bytearray()
+        self._sets = []
+        self._set_numbers = {}
+        self._set_offsets = array('L', [0])
+        self._set_members = array('L')
+
+    def append(self, identifier, datestamp, setspec, deleted):
+        """Add a row, with datestamp as a datetime.
+        """
+        self.appendEpoch(identifier, datetime_to_epoch(datestamp), setspec,
+                         deleted)
+
+    def appendEpoch(self, identifier, seconds, setspec, deleted):
+        """Add a row, with datestamp as seconds since the epoch.
+        """
+        i = len(self._datestamps)
+        self._datestamps.append(seconds)
+        self._identifiers.extend(identifier.encode('utf-8'))
+        self._identifier_offsets.append(len(self._identifiers))
+        if i % 8 == 0:
+            self._deleted.append(0)
+        if deleted:
+            self._deleted[i // 8] |= 1 << (i % 8)
+        set_numbers = self._set_numbers
+        for spec in setspec:
+            number = set_numbers.get(spec)
+            if number is None:
+                number = set_numbers[spec] = len(self._sets)
+                self._sets.append(spec)
+            self._set_members.append(number)
+        self._set_offsets.append(len(self._set_members))
+
+    def __len__(self):
+        return len(self._datestamps)
+
+    def identifier(self, i):
+        offsets = self._identifier_offsets
+        return self._identifiers[offsets[i]:offsets[i + 1]].decode('utf-8')
+
+    def datestamp(self, i):
+        return epoch_to_datetime(self._datestamps[i])
+
+    def epoch(self, i):
+        return self._datestamps[i]
+
+    def setSpec(self, i):
+        sets = self._sets
+        members = self._set_members
+        return [sets[members[j]] for j in
+                range(self._set_offsets[i], self._set_offsets[i + 1])]
+
+    def isDeleted(self, i):
+        return bool(self._deleted[i // 8] & (1 << (i % 8)))
+
+    def header(self, i):
+        """Create a Header for row i.
+        """
+        return Header(None, self.identifier(i), self.datestamp(i),
+                      self.setSpec(i), self.isDeleted(i))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield (self.identifier(i), self.datestamp(i), self.setSpec(i),
+                   self.isDeleted(i))
+
+    def epochs(self):
+        """The array with the datestamps as seconds since the epoch.
+
+        This is not a copy and should not be changed.
+        """
+        return self._datestamps
+
+    def sets(self):
+        """The distinct setSpecs of the headers in the batch.
+        """
+        return list(self._sets)
+
+    def withSet(self, spec):
+        """Return the row numbers of the headers in set spec.
+        """
+        number = self._set_numbers.get(spec)
+        if number is None:
+            return []
+        offsets = self._set_offsets
+        members = self._set_members
+        return [i for i in range(len(self))
+                if number in members[offsets[i]:offsets[i + 1]]]
+
+    def _appendRow(self, batch, i):
+        offsets = batch._identifier_offsets
+        self.appendEpoch(
+            batch._identifiers[offsets[i]:offsets[i + 1]].decode('utf-8'),
+            batch._datestamps[i], batch.setSpec(i), batch.isDeleted(i))
+
+    def sorted(self):
+        """Return a new batch with the rows ordered by datestamp, and
+        identifier for the same datestamp.
+        """
+        datestamps = self._datestamps
+        identifiers = self._identifiers
+        offsets = self._identifier_offsets
+        order = sorted(
+            range(len(self)),
+            key=lambda i: (datestamps[i],
+                           identifiers[offsets[i]:offsets[i + 1]]))
+        result = HeaderBatch(self.token)
+        for i in order:
+            result._appendRow(self, i)
+        return result
+
+def mergeHeaderBatches(batches, sort=False):
+    """Combine batches into a single HeaderBatch, optionally sorted like
+    HeaderBatch.sorted.
+    """
+    result = HeaderBatch()
+    for batch in batches:
+        result._datestamps.extend(batch._datestamps)
+        base = len(result._identifiers)
+        result._identifiers.extend(batch._identifiers)
+        result._identifier_offsets.extend(
+            [base + offset for offset in batch._identifier_offsets[1:]])
+        # renumber the sets to the numbers of the merged batch
+        start = len(result._set_members)
+        numbers = []
+        for spec in batch._sets:
+            number = result._set_numbers.get(spec)
+            if number is None:
+                number = result._set_numbers[spec] = len(result._sets)
+                result._sets.append(spec)
+            numbers.append(number)
+        result._set_members.extend(
+            [numbers[member] for member in batch._set_members])
+        result._set_offsets.extend(
+            [start + offset for offset in batch._set_offsets[1:]])
+        for j in range(len(batch)):
+            row = len(result._datestamps) - len(batch) + j
+            if row % 8 == 0:
+                result._deleted.append(0)
+            if batch.isDeleted(j):
+                result._deleted[row // 8] |= 1 << (row % 8)
+        result.token = batch.token
+    if sort:
+        return result.sorted()
+    return result
+
 class Identify(object):
     def __init__(self, repositoryName, baseURL, protocolVersion, adminEmails,
                  earliestDatestamp, deletedRecord, granularity, compression,
@@ -61,22 +308,7 @@ class Identify(object):
         self._descriptions = []
         
         if toolkit_description:
-            req = pkg_resources.Requirement.parse('pyoai')
-            egg = pkg_resources.working_set.find(req)
-            if egg:
-                version = '<version>%s</version>' % egg.version
-            else:
-                version = ''
-            self.add_description(
-                '<toolkit xsi:schemaLocation='
-                '"http://oai.dlib.vt.edu/OAI/metadata/toolkit '
-                'http://oai.dlib.vt.edu/OAI/metadata/toolkit.xsd" '
-                'xmlns="http://oai.dlib.vt.edu/OAI/metadata/toolkit" '
-                'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">'
-                '<title>pyoai</title>'
-                '%s'
-                '<URL>http://infrae.com/products/oaipack</URL>'
-                '</toolkit>' % version)
+            self.add_description(getToolkitDescription())
         
     def repositoryName(self):
         return self._repositoryName
@@ -107,7 +339,49 @@ class Identify(object):
 
     def descriptions(self):
         return self._descriptions
-    
+
+_toolkit_description = None
+
+def getToolkitDescription():
+    """Return the toolkit description of pyoai, as an XML string.
+
+    The installed version of pyoai is looked up only the first time.
+    """
+    global _toolkit_description
+    if _toolkit_description is None:
+        req = pkg_resources.Requirement.parse('pyoai')
+        egg = pkg_resources.working_set.find(req)
+        if egg:
+            version = '<version>%s</version>' % egg.version
+        else:
+            version = ''
+        _toolkit_description = (
+            '<toolkit xsi:schemaLocation='
+            '"http://oai.dlib.vt.edu/OAI/metadata/toolkit '
+            'http://oai.dlib.vt.edu/OAI/metadata/toolkit.xsd" '
+            'xmlns="http://oai.dlib.vt.edu/OAI/metadata/toolkit" '
+            'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">'
+            '<title>pyoai</title>'
+            '%s'
+            '<URL>http://infrae.com/products/oaipack</URL>'
+            '</toolkit>' % version)
+    return _toolkit_description
+
+class ResumptionToken(six.text_type):
+    """A resumption token, with the attributes the server sent along.
+
+    completeListSize - number of items in the complete list, or None
+    cursor - number of items returned before this batch, or None
+    expirationDate - datetime at which the token expires, or None
+    """
+    def __new__(cls, token, completeListSize=None, cursor=None,
+                expirationDate=None):
+        self = six.text_type.__new__(cls, token)
+        self.completeListSize = completeListSize
+        self.cursor = cursor
+        self.expirationDate = expirationDate
+        return self
+
 def ResumptionTokenSpec(dict):
     dict = dict.copy()
     dict['resumptionToken'] = 'exclusive'
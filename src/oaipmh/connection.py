@@ -0,0 +1,180 @@
+from __future__ import absolute_import
+
+import socket
+import threading
+import time
+from io import BytesIO
+
+from six.moves import http_client
+from six.moves.urllib.parse import urlsplit, urljoin
+from six.moves.urllib.response import addinfourl
+
+try:
+    import urllib.request as urllib2
+except ImportError:
+    import urllib2
+
+# errors on a reused connection that indicate the server has dropped it
+# while it was sitting idle in the pool
+RECONNECT_ERRORS = (socket.error, http_client.HTTPException)
+
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+MAX_REDIRECTS = 5
+
+class ConnectionPool(object):
+    """A pool of persistent HTTP/1.1 connections, kept per host.
+
+    A pool can be shared by several clients that talk to the same host,
+    also from several threads. At most `maxsize` connections are open to
+    a single host at any time; further requests wait until a connection
+    becomes available. To be polite to servers, requests to a single host
+    can be spaced at least `delay` seconds apart.
+
+    Connections that have been idle for longer than `idle_timeout`
+    seconds are not reused. A reused connection that turns out to be
+    dropped by the server is transparently replaced by a new one.
+    """
+    def __init__(self, maxsize=4, idle_timeout=60, timeout=None, delay=0):
+        self._maxsize = maxsize
+        self._delay = delay
+        self._idle_timeout = idle_timeout
+        self._timeout = timeout
+        self._lock = threading.Lock()
+        # (scheme, host, port) -> list of (connection, last used) tuples
+        self._idle = {}
+        # (scheme, host, port) -> semaphore bounding open connections
+        self._slots = {}
+        # (scheme, host, port) -> earliest time of the next request
+        self._next_request = {}
+
+    def urlopen(self, request):
+        """Perform a urllib2 Request over a pooled connection.
+
+        This can be used in place of urllib2.urlopen. The response body
+        is read completely, so that the connection can be reused
+        straight away. Raises urllib2.HTTPError on error responses.
+        """
+        method = request.get_method()
+        url = request.get_full_url()
+        data = request.data
+        headers = dict(request.header_items())
+        if data is not None and 'Content-type' not in headers:
+            headers['Content-type'] = 'application/x-www-form-urlencoded'
+        for i in range(MAX_REDIRECTS + 1):
+            status, reason, msg, body = self.request(
+                method, url, data, headers)
+            location = msg.get('Location')
+            if status not in REDIRECT_CODES or location is None:
+                break
+            url = urljoin(url, location)
+            if status not in (307, 308):
+                # like urllib2, turn the redirected request into a GET
+                method = 'GET'
+                data = None
+                headers.pop('Content-type', None)
+                headers.pop('Content-length', None)
+        if status >= 300:
+            raise urllib2.HTTPError(url, status, reason, msg, BytesIO(body))
+        return addinfourl(BytesIO(body), msg, url, status)
+
+    def request(self, method, url, body=None, headers=None):
+        """Perform a HTTP request over a pooled connection.
+
+        Returns a tuple of status code, reason, headers and body.
+        """
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.hostname,
+               parts.port or (parts.scheme == 'https' and 443 or 80))
+        selector = parts.path or '/'
+        if parts.query:
+            selector += '?' + parts.query
+        slot = self._getSlot(key)
+        slot.acquire()
+        try:
+            if self._delay:
+                self._waitForTurn(key)
+            connection = self._getIdleConnection(key)
+            if connection is not None:
+                try:
+                    response = self._request(
+                        connection, method, selector, body, headers)
+                except RECONNECT_ERRORS:
+                    connection.close()
+                    connection = None
+            if connection is None:
+                connection = self._newConnection(key)
+                response = self._request(
+                    connection, method, selector, body, headers)
+            try:
+                data = response.read()
+            except:
+                connection.close()
+                raise
+            if response.will_close:
+                connection.close()
+            else:
+                self._releaseConnection(key, connection)
+        finally:
+            slot.release()
+        return response.status, response.reason, response.msg, data
+
+    def clear(self):
+        """Close all idle connections.
+        """
+        with self._lock:
+            idle = self._idle
+            self._idle = {}
+        for connections in idle.values():
+            for connection, last_used in connections:
+                connection.close()
+
+    def _request(self, connection, method, selector, body, headers):
+        connection.request(method, selector, body, headers or {})
+        return connection.getresponse()
+
+    def _getSlot(self, key):
+        with self._lock:
+            slot = self._slots.get(key)
+            if slot is None:
+                slot = self._slots[key] = threading.BoundedSemaphore(
+                    self._maxsize)
+            return slot
+
+    def _waitForTurn(self, key):
+        with self._lock:
+            now = time.time()
+            start = max(now, self._next_request.get(key, now))
+            self._next_request[key] = start + self._delay
+        if start > now:
+            time.sleep(start - now)
+
+    def _getIdleConnection(self, key):
+        now = time.time()
+        expired = []
+        result = None
+        with self._lock:
+            connections = self._idle.get(key, [])
+            while connections:
+                connection, last_used = connections.pop()
+                if now - last_used > self._idle_timeout:
+                    expired.append(connection)
+                else:
+                    result = connection
+                    break
+        for connection in expired:
+            connection.close()
+        return result
+
+    def _releaseConnection(self, key, connection):
+        with self._lock:
+            self._idle.setdefault(key, []).append((connection, time.time()))
+
+    def _newConnection(self, key):
+        scheme, host, port = key
+        if scheme == 'https':
+            factory = http_client.HTTPSConnection
+        else:
+            factory = http_client.HTTPConnection
+        if self._timeout is None:
+            return factory(host, port)
+        return factory(host, port, timeout=self._timeout)
@@ -1,26 +1,95 @@
 import datetime
 from oaipmh.error import DatestampError
 
+# maximum number of conversions to remember; many datestamps are the
+# same, for instance because records were imported in bulk
+CACHE_SIZE = 10000
+
+_datetime_cache = {}
+_datestamp_cache = {}
+
 def datetime_to_datestamp(dt, day_granularity=False):
     assert dt.tzinfo is None # only accept timezone naive datetimes
-    # ignore microseconds
-    dt = dt.replace(microsecond=0)
-    result = dt.isoformat() + 'Z'
     if day_granularity:
-        result = result[:-10]
+        return '%04d-%02d-%02d' % (dt.year, dt.month, dt.day)
+    # ignore microseconds, also in the cache
+    if dt.microsecond:
+        dt = dt.replace(microsecond=0)
+    try:
+        return _datestamp_cache[dt]
+    except KeyError:
+        pass
+    result = dt.isoformat() + 'Z'
+    if len(_datestamp_cache) >= CACHE_SIZE:
+        _datestamp_cache.clear()
+    _datestamp_cache[dt] = result
     return result
 
+def datetimes_to_datestamps(dts, day_granularity=False):
+    """Convert a list of datetimes to datestamps.
+    """
+    return [datetime_to_datestamp(dt, day_granularity) for dt in dts]
+
 # handy utility function not used by pyoai itself yet
 def date_to_datestamp(d, day_granularity=False): 	 
     return datetime_to_datestamp( 	 
         datetime.datetime.combine(d, datetime.time(0)), day_granularity)
 
 def datestamp_to_datetime(datestamp, inclusive=False):
+    if inclusive:
+        return _checked_datestamp_to_datetime(datestamp, inclusive)
+    try:
+        return _datetime_cache[datestamp]
+    except KeyError:
+        pass
+    result = _checked_datestamp_to_datetime(datestamp, inclusive)
+    if len(_datetime_cache) >= CACHE_SIZE:
+        _datetime_cache.clear()
+    _datetime_cache[datestamp] = result
+    return result
+
+def datestamps_to_datetimes(datestamps, inclusive=False):
+    """Convert a list of datestamps to datetimes.
+    """
+    return [datestamp_to_datetime(datestamp, inclusive)
+            for datestamp in datestamps]
+
+try:
+    # Python 3.7 and later
+    _fromisoformat = datetime.datetime.fromisoformat
+except AttributeError:
+    _fromisoformat = None
+
+def _checked_datestamp_to_datetime(datestamp, inclusive):
+    # fast path for the two granularities of the protocol
+    length = len(datestamp)
+    if ((length == 20 and datestamp[10] == 'T' and datestamp[13] == ':'
+         and datestamp[16] == ':' and datestamp[19] == 'Z') or
+        length == 10) and datestamp[4] == '-' and datestamp[7] == '-':
+        try:
+            if _fromisoformat is not None:
+                result = _fromisoformat(datestamp[:19])
+            elif length == 10:
+                result = datetime.datetime(
+                    int(datestamp[0:4]), int(datestamp[5:7]),
+                    int(datestamp[8:10]))
+            else:
+                result = datetime.datetime(
+                    int(datestamp[0:4]), int(datestamp[5:7]),
+                    int(datestamp[8:10]), int(datestamp[11:13]),
+                    int(datestamp[14:16]), int(datestamp[17:19]))
+        except ValueError:
+            pass
+        else:
+            if length == 10 and inclusive:
+                # used when a date was specified as ?until parameter
+                result = result.replace(hour=23, minute=59, second=59)
+            return result
     try:
         return _datestamp_to_datetime(datestamp, inclusive)
     except ValueError:
         raise DatestampError(datestamp)
-    
+
 def _datestamp_to_datetime(datestamp, inclusive=False):
     splitted = datestamp.split('T')
     if len(splitted) == 2:
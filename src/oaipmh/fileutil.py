@@ -0,0 +1,25 @@
+"""Helpers to write files in a way that survives crashes.
+"""
+import json
+import os
+
+def writeJSON(path, data):
+    """Write data as JSON to path, in a way that survives crashes: the
+    file either has the old or the new content.
+    """
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    replaceFile(tmp_path, path)
+
+def replaceFile(src, dst):
+    """Atomically replace dst by src.
+    """
+    try:
+        replace = os.replace
+    except AttributeError:
+        # Python 2, where rename replaces atomically on POSIX only
+        replace = os.rename
+    replace(src, dst)
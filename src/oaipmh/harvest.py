@@ -0,0 +1,306 @@
+"""Harvesting of several repositories, or parts of them, at the same time.
+"""
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+from six.moves.queue import Queue
+
+from oaipmh import client, common, connection, error
+
+LIST_VERBS = ['ListIdentifiers', 'ListRecords', 'ListSets']
+
+class HarvestResult(object):
+    """The outcome of one harvesting job, such as a repository.
+    """
+    def __init__(self, job):
+        self.job = job
+        self.count = 0
+        self.duplicates = 0
+        self.error = None
+        self.exc_info = None
+        self.start = None
+        self.end = None
+
+    def succeeded(self):
+        return self.end is not None and self.error is None
+
+    def duration(self):
+        if self.start is None or self.end is None:
+            return None
+        return self.end - self.start
+
+class Harvester(object):
+    """Harvests several repositories at the same time.
+
+    Repositories are harvested by a bounded pool of worker threads. The
+    clients share a connection.ConnectionPool, which allows at most
+    `per_host` requests to a single host at the same time, spaced at
+    least `delay` seconds apart. If harvesting a repository fails, the
+    error is recorded and the other repositories are not affected.
+
+    client_factory - function that creates a client for a base URL, by
+                     default a client.Client that uses the shared pool.
+    """
+    def __init__(self, metadata_registry=None, workers=8, per_host=1,
+                 delay=0, client_factory=None):
+        self._metadata_registry = metadata_registry
+        self._workers = workers
+        self._pool = connection.ConnectionPool(maxsize=per_host, delay=delay)
+        self._client_factory = client_factory or self.createClient
+
+    def createClient(self, base_url):
+        return client.Client(base_url, self._metadata_registry,
+                             connection_pool=self._pool)
+
+    def harvest(self, base_urls, verb, callback=None, queue=None, **kw):
+        """Do an OAI-PMH request on each base URL, with arguments kw.
+
+        Each item harvested is passed along tagged with the base URL it
+        came from, as soon as it comes in: callback is called with the
+        base URL and the item, and (base URL, item) tuples are put on
+        queue. Both happen in the worker threads. For verbs that return
+        a single result instead of a list, that result is the item.
+
+        Returns a dictionary with a HarvestResult for each base URL.
+        """
+        def harvestOne(base_url, result):
+            oai_client = self._client_factory(base_url)
+            method = common.getMethodForVerb(oai_client, verb)
+            items = method(**kw.copy())
+            if verb not in LIST_VERBS:
+                items = [items]
+            for item in items:
+                result.count += 1
+                if callback is not None:
+                    callback(base_url, item)
+                if queue is not None:
+                    queue.put((base_url, item))
+        return runJobs(base_urls, harvestOne, self._workers)
+
+    def close(self):
+        """Close the connections kept open for the harvest.
+        """
+        self._pool.clear()
+
+class DateRangeHarvester(object):
+    """Harvests a single repository in date windows at the same time.
+
+    The date range of a harvest is split into `windows` windows that
+    don't overlap, and each window is harvested with its own chain of
+    resumption tokens by a pool of worker threads. If the first
+    response for a window reports (in completeListSize) that the window
+    holds more than `max_window_size` items, the window is split in two
+    and both halves are harvested instead. Windows are never made
+    smaller than the granularity of the repository.
+
+    The client is shared by the workers.
+    """
+    def __init__(self, oai_client, workers=4, windows=None,
+                 max_window_size=None):
+        self._client = oai_client
+        self._workers = workers
+        self._windows = windows or workers
+        self._max_window_size = max_window_size
+
+    def harvest(self, verb, from_=None, until=None, callback=None,
+                queue=None, **kw):
+        """Do a ListIdentifiers or ListRecords request with arguments kw
+        for the range from_ until until, both inclusive.
+
+        from_ defaults to the earliest datestamp of the repository, until
+        to the current time. Items are passed to callback and put on
+        queue like by Harvester.harvest, tagged with the (from_, until)
+        window they came from.
+
+        Returns a dictionary with a HarvestResult for each window that
+        was harvested, keyed by window. Together the windows cover the
+        whole range.
+        """
+        if verb not in ('ListIdentifiers', 'ListRecords'):
+            raise ValueError("Cannot harvest %s by date" % verb)
+        identify = self._client.identify()
+        self._client.setGranularity(identify.granularity())
+        day_granularity = self._client.getDayGranularity()
+        if from_ is None:
+            from_ = identify.earliestDatestamp()
+        if until is None:
+            until = datetime.utcnow()
+        max_window_size = self._max_window_size
+        split = []
+        def harvestWindow(window, result):
+            args = kw.copy()
+            args['from_'], args['until'] = window
+            batches = self._client.iterBatches(verb, **args)
+            try:
+                items, token = next(batches)
+            except error.NoRecordsMatchError:
+                return None
+            if (max_window_size is not None and token is not None and
+                token.completeListSize is not None and
+                token.completeListSize > max_window_size):
+                halves = splitDateRange(
+                    window[0], window[1], 2, day_granularity)
+                if len(halves) > 1:
+                    batches.close()
+                    split.append(window)
+                    return halves
+            while 1:
+                for item in items:
+                    result.count += 1
+                    if callback is not None:
+                        callback(window, item)
+                    if queue is not None:
+                        queue.put((window, item))
+                try:
+                    items, token = next(batches)
+                except StopIteration:
+                    break
+            return None
+        results = runJobs(
+            splitDateRange(from_, until, self._windows, day_granularity),
+            harvestWindow, self._workers)
+        for window in split:
+            del results[window]
+        return results
+
+class SetHarvester(object):
+    """Harvests a single repository set by set, at the same time.
+
+    The sets of the repository are retrieved with ListSets, and each set
+    is harvested with its own chain of resumption tokens by a pool of
+    worker threads. Items that belong to several sets are passed along
+    only once, for the set they were first seen in; they are recognized
+    by identifier and datestamp. Items that are not in any set are not
+    harvested.
+
+    The client is shared by the workers.
+    """
+    def __init__(self, oai_client, workers=4):
+        self._client = oai_client
+        self._workers = workers
+
+    def harvest(self, verb, sets=None, callback=None, queue=None,
+                progress=None, **kw):
+        """Do a ListIdentifiers or ListRecords request with arguments kw
+        for each set.
+
+        sets - setSpecs of the sets to harvest, all sets by default
+
+        Items are passed to callback and put on queue like by
+        Harvester.harvest, tagged with the setSpec of their set.
+        progress is called with the setSpec and its HarvestResult after
+        each response for the set has been handled.
+
+        Returns a dictionary with a HarvestResult for each set, keyed
+        by setSpec. The count of a result is the number of items passed
+        along, duplicates the number of items skipped because they had
+        already been seen in another set.
+        """
+        if verb not in ('ListIdentifiers', 'ListRecords'):
+            raise ValueError("Cannot harvest %s by set" % verb)
+        if sets is None:
+            sets = [setSpec for setSpec, setName, setDescription
+                    in self._client.listSets()]
+        seen = set()
+        lock = threading.Lock()
+        def harvestSet(setSpec, result):
+            args = kw.copy()
+            args['set'] = setSpec
+            try:
+                for items, token in self._client.iterBatches(verb, **args):
+                    for item in items:
+                        if verb == 'ListRecords':
+                            header = item[0]
+                        else:
+                            header = item
+                        key = (header.identifier(), header.datestamp())
+                        with lock:
+                            duplicate = key in seen
+                            seen.add(key)
+                        if duplicate:
+                            result.duplicates += 1
+                            continue
+                        result.count += 1
+                        if callback is not None:
+                            callback(setSpec, item)
+                        if queue is not None:
+                            queue.put((setSpec, item))
+                    if progress is not None:
+                        progress(setSpec, result)
+            except error.NoRecordsMatchError:
+                pass
+            return None
+        return runJobs(sets, harvestSet, self._workers)
+
+def splitDateRange(from_, until, count, day_granularity=False):
+    """Split the range from_ until until into at most count windows.
+
+    Windows are (from_, until) tuples with inclusive boundaries, at
+    day or second granularity, such that every datestamp in the range
+    falls in exactly one window.
+    """
+    if day_granularity:
+        step = timedelta(days=1)
+        from_ = datetime(from_.year, from_.month, from_.day)
+        until = datetime(until.year, until.month, until.day)
+    else:
+        step = timedelta(seconds=1)
+        from_ = from_.replace(microsecond=0)
+        until = until.replace(microsecond=0)
+    if until < from_:
+        return []
+    steps = int((until - from_).total_seconds() //
+                step.total_seconds()) + 1
+    windows = []
+    for i in range(count):
+        start = steps * i // count
+        end = steps * (i + 1) // count
+        if end > start:
+            windows.append((from_ + step * start, from_ + step * (end - 1)))
+    return windows
+
+def runJobs(jobs, func, workers):
+    """Call func for each job using a pool of worker threads.
+
+    func is called with the job and its HarvestResult, and may return a
+    list of new jobs to run as well. Any exception raised by func is
+    stored in the result of its job.
+
+    Returns a dictionary with a HarvestResult for each job.
+    """
+    results = {}
+    job_queue = Queue()
+    def add(job):
+        results[job] = HarvestResult(job)
+        job_queue.put(job)
+    for job in jobs:
+        add(job)
+    def worker():
+        while 1:
+            job = job_queue.get()
+            if job is _stop:
+                return
+            result = results[job]
+            result.start = time.time()
+            try:
+                for new_job in func(job, result) or []:
+                    add(new_job)
+            except Exception as e:
+                result.error = e
+                result.exc_info = sys.exc_info()
+            result.end = time.time()
+            job_queue.task_done()
+    threads = [threading.Thread(target=worker) for i in range(workers)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    job_queue.join()
+    for thread in threads:
+        job_queue.put(_stop)
+    for thread in threads:
+        thread.join()
+    return results
+
+_stop = object()
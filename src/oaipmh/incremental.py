@@ -0,0 +1,126 @@
+"""Incremental harvesting, which only asks for what changed since the
+last harvest.
+"""
+import json
+import os
+import sqlite3
+import threading
+from datetime import timedelta
+
+from oaipmh import client, error
+from oaipmh.checkpoint import encodeDatetime, decodeDatetime
+from oaipmh.fileutil import writeJSON
+
+class FileHighWaterMarkStore(object):
+    """Keeps high-water marks in a JSON file, which is replaced as a
+    whole when a mark is changed.
+    """
+    def __init__(self, path):
+        self._path = path
+        self._lock = threading.Lock()
+
+    def get(self, repository, metadataPrefix):
+        with self._lock:
+            marks = self._read()
+        return decodeDatetime(marks.get(repository, {}).get(metadataPrefix))
+
+    def set(self, repository, metadataPrefix, datestamp):
+        with self._lock:
+            marks = self._read()
+            marks.setdefault(repository, {})[metadataPrefix] = (
+                encodeDatetime(datestamp))
+            writeJSON(self._path, marks)
+
+    def _read(self):
+        if not os.path.exists(self._path):
+            return {}
+        with open(self._path) as f:
+            return json.load(f)
+
+class SQLiteHighWaterMarkStore(object):
+    """Keeps high-water marks in a SQLite database, which can be shared
+    by several processes.
+    """
+    def __init__(self, path):
+        self._path = path
+        connection = sqlite3.connect(self._path, timeout=30)
+        try:
+            with connection:
+                connection.execute(
+                    'CREATE TABLE IF NOT EXISTS high_water_mark ('
+                    'repository TEXT, metadata_prefix TEXT, datestamp TEXT, '
+                    'PRIMARY KEY (repository, metadata_prefix))')
+        finally:
+            connection.close()
+
+    def get(self, repository, metadataPrefix):
+        connection = sqlite3.connect(self._path, timeout=30)
+        try:
+            row = connection.execute(
+                'SELECT datestamp FROM high_water_mark '
+                'WHERE repository = ? AND metadata_prefix = ?',
+                (repository, metadataPrefix)).fetchone()
+        finally:
+            connection.close()
+        if row is None:
+            return None
+        return decodeDatetime(row[0])
+
+    def set(self, repository, metadataPrefix, datestamp):
+        connection = sqlite3.connect(self._path, timeout=30)
+        try:
+            with connection:
+                connection.execute(
+                    'INSERT OR REPLACE INTO high_water_mark '
+                    '(repository, metadata_prefix, datestamp) '
+                    'VALUES (?, ?, ?)',
+                    (repository, metadataPrefix, encodeDatetime(datestamp)))
+        finally:
+            connection.close()
+
+class IncrementalHarvester(object):
+    """Harvests the changes in a repository since the last harvest.
+
+    For each repository and metadata prefix the store keeps a high-water
+    mark: the responseDate the repository gave at the start of the last
+    harvest that completed. The next harvest asks for everything from
+    that date, minus `overlap` to allow for clock skew and late updates,
+    at the granularity the repository supports. The first harvest is a
+    full harvest.
+    """
+    def __init__(self, oai_client, store, overlap=timedelta(0)):
+        self._client = oai_client
+        self._store = store
+        self._overlap = overlap
+
+    def harvest(self, repository, metadataPrefix, callback,
+                verb='ListRecords'):
+        """Harvest the records (or headers, depending on verb) that
+        changed since the last harvest, passing each to callback.
+
+        repository - name of the repository in the store, such as its
+                     base URL
+
+        Returns the number of items harvested.
+        """
+        oai_client = self._client
+        # like updateGranularity, but keep the time of the repository
+        tree = oai_client.makeRequestErrorHandling(verb='Identify')
+        identify = oai_client.Identify_impl({}, tree)
+        oai_client.setGranularity(identify.granularity())
+        start = client.buildResponseDate(tree, oai_client.getNamespaces())
+        kw = {'metadataPrefix': metadataPrefix}
+        mark = self._store.get(repository, metadataPrefix)
+        if mark is not None:
+            kw['from_'] = max(mark - self._overlap,
+                              identify.earliestDatestamp())
+        count = 0
+        try:
+            for items, token in oai_client.iterBatches(verb, **kw):
+                for item in items:
+                    callback(item)
+                    count += 1
+        except error.NoRecordsMatchError:
+            pass
+        self._store.set(repository, metadataPrefix, start)
+        return count
@@ -82,6 +82,21 @@ class IOAI:
 
         Returns an iterable of setSpec, setName tuples (strings).
         """
+
+    def countIdentifiers(metadataPrefix, set=None, from_=None, until=None):
+        """Optional. Count the headers listIdentifiers would return.
+
+        If available, the count is passed along as the completeListSize
+        of resumption tokens.
+        """
+
+    def countRecords(metadataPrefix, set=None, from_=None, until=None):
+        """Optional. Count the records listRecords would return.
+        """
+
+    def countSets():
+        """Optional. Count the sets listSets would return.
+        """
         
 class IBatchingOAI:
     """Very similar to IOAI, but the implementation can be batch-aware.
@@ -99,17 +114,36 @@ class IBatchingOAI:
     
     def listIdentifiers(metadataPrefix, set=None, from_=None, until=None,
                         cursor=0, batch_size=10):
-        pass
+        """With keyset pagination (see server.BatchingResumption), an
+        argument after is passed instead of cursor. It is None for the
+        first batch, and otherwise the (datestamp, identifier) of the
+        last item of the previous batch, or the value getContinuation
+        returned for it. Items should then be listed in order of
+        datestamp and identifier, and the batch should start with the
+        first item after the given one.
+
+        A cursor can still be passed for tokens made without keyset
+        pagination.
+        """
     
     def listMetadataFormats(identifier=None):
         pass
     
     def listRecords(metadataPrefix, set=None, from_=None, until=None,
                     cursor=0, batch_size=10):
-        pass
+        """See listIdentifiers for keyset pagination.
+        """
     
     def listSets():
         pass
+
+    def getContinuation(verb, item):
+        """Optional, for keyset pagination. Return a string from which a
+        ListIdentifiers or ListRecords list can be continued after item,
+        for instance a database key.
+
+        The string is passed back as the after argument.
+        """
     
 class IIdentify:
     def repositoryName():
@@ -33,6 +33,9 @@ class MetadataRegistry(object):
     
     def hasWriter(self, metadata_prefix):
         return metadata_prefix in self._writers
+
+    def getWriter(self, metadata_prefix):
+        return self._writers[metadata_prefix]
     
     def readMetadata(self, metadata_prefix, element):
         """Turn XML into metadata object.
@@ -58,37 +61,68 @@ class Error(Exception):
 
 class MetadataReader(object):
     """A default implementation of a reader based on fields.
+
+    If lazy is true, the reader creates common.LazyMetadata objects that
+    only read a field from the XML when it is first asked for. If fields
+    are only ever read from part of the records, or the metadata of
+    some records is never looked at, this saves most of the work.
     """
-    def __init__(self, fields, namespaces=None):
+    def __init__(self, fields, namespaces=None, lazy=False):
         self._fields = fields
         self._namespaces = namespaces or {}
+        self._lazy = lazy
+        # compile the expressions once, instead of for every record
+        self._readers = {}
+        for field_name, (field_type, expr) in list(fields.items()):
+            if field_type not in ['bytes', 'bytesList', 'text', 'textList']:
+                raise Error("Unknown field type: %s" % field_type)
+            self._readers[field_name] = createFieldReader(
+                field_type, etree.XPath(expr, namespaces=self._namespaces))
 
     def __call__(self, element):
+        if self._lazy:
+            return common.LazyMetadata(element, self._readers)
         map = {}
-        # create XPathEvaluator for this element
-        xpath_evaluator = etree.XPathEvaluator(element, 
-                                               namespaces=self._namespaces)
-        
-        e = xpath_evaluator.evaluate
         # now extra field info according to xpath expr
-        for field_name, (field_type, expr) in list(self._fields.items()):
-            if field_type == 'bytes':
-                value = str(e(expr))
-            elif field_type == 'bytesList':
-                value = [str(item) for item in e(expr)]
-            elif field_type == 'text':
-                # make sure we get back unicode strings instead
-                # of lxml.etree._ElementUnicodeResult objects.
-                value = text_type(e(expr))
-            elif field_type == 'textList':
-                # make sure we get back unicode strings instead
-                # of lxml.etree._ElementUnicodeResult objects.
-                value = [text_type(v) for v in e(expr)]
-            else:
-                raise Error("Unknown field type: %s" % field_type)
-            map[field_name] = value
+        for field_name, read in self._readers.items():
+            map[field_name] = read(element)
         return common.Metadata(element, map)
 
+    def project(self, field_names, lazy=None):
+        """Create a reader that only reads the named fields.
+
+        The new reader is lazy if lazy is true, or if lazy is None and
+        this reader is lazy.
+        """
+        unknown = [name for name in field_names if name not in self._fields]
+        if unknown:
+            raise Error("Unknown fields: %s" % ', '.join(unknown))
+        if lazy is None:
+            lazy = self._lazy
+        return MetadataReader(
+            dict([(name, self._fields[name]) for name in field_names]),
+            self._namespaces, lazy)
+
+def createFieldReader(field_type, xpath):
+    """Create a function that reads a field of field_type from an
+    element, using a compiled XPath expression.
+    """
+    if field_type == 'bytes':
+        def read(element):
+            return str(xpath(element))
+    elif field_type == 'bytesList':
+        def read(element):
+            return [str(item) for item in xpath(element)]
+    elif field_type == 'text':
+        # make sure we get back unicode strings instead
+        # of lxml.etree._ElementUnicodeResult objects.
+        def read(element):
+            return text_type(xpath(element))
+    else:
+        def read(element):
+            return [text_type(v) for v in xpath(element)]
+    return read
+
 oai_dc_reader = MetadataReader(
     fields={
     'title':       ('textList', 'oai_dc:dc/dc:title/text()'),
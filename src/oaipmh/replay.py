@@ -0,0 +1,163 @@
+"""Recording of harvests to an archive file, and replaying them.
+
+An archive holds the responses to a number of requests. It starts with
+MAGIC, followed by the responses, compressed with zlib. After these
+comes an index of the requests, with for each request the length of its
+key, the offset and the length of its response and the key itself. The
+archive ends with the offset of the index and MAGIC again. Only the
+index is read when an archive is opened; responses are read when they
+are asked for.
+"""
+import struct
+import threading
+import time
+import zlib
+
+from oaipmh import client
+from oaipmh.cache import getRequestKey
+
+MAGIC = b'OAIPMH-ARCHIVE-1'
+ENTRY = struct.Struct('>IQQ')
+TRAILER = struct.Struct('>Q')
+
+class ArchiveError(Exception):
+    pass
+
+class ArchiveWriter(object):
+    """Writes responses to a new archive.
+    """
+    def __init__(self, path):
+        self._f = open(path, 'wb')
+        self._f.write(MAGIC)
+        self._index = {}
+        self._lock = threading.Lock()
+
+    def add(self, key, response):
+        data = zlib.compress(response)
+        with self._lock:
+            offset = self._f.tell()
+            self._f.write(data)
+            self._index[key] = (offset, len(data))
+
+    def close(self):
+        """Write the index and close the archive.
+        """
+        with self._lock:
+            if self._f is None:
+                return
+            index_offset = self._f.tell()
+            for key, (offset, length) in sorted(self._index.items()):
+                key = key.encode('utf-8')
+                self._f.write(ENTRY.pack(len(key), offset, length))
+                self._f.write(key)
+            self._f.write(TRAILER.pack(index_offset))
+            self._f.write(MAGIC)
+            self._f.close()
+            self._f = None
+
+class ArchiveReader(object):
+    """Reads responses from an archive.
+    """
+    def __init__(self, path):
+        self._f = open(path, 'rb')
+        self._lock = threading.Lock()
+        try:
+            self._index = self._readIndex()
+        except Exception:
+            self._f.close()
+            raise
+
+    def _readIndex(self):
+        f = self._f
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ArchiveError("Not an archive")
+        f.seek(0, 2)
+        if f.tell() < 2 * len(MAGIC) + TRAILER.size:
+            raise ArchiveError("Archive is incomplete")
+        f.seek(-(TRAILER.size + len(MAGIC)), 2)
+        end = f.tell()
+        trailer = f.read(TRAILER.size + len(MAGIC))
+        if trailer[TRAILER.size:] != MAGIC:
+            raise ArchiveError("Archive is incomplete")
+        index_offset, = TRAILER.unpack(trailer[:TRAILER.size])
+        f.seek(index_offset)
+        data = f.read(end - index_offset)
+        index = {}
+        position = 0
+        while position < len(data):
+            key_length, offset, length = ENTRY.unpack_from(data, position)
+            position += ENTRY.size
+            key = data[position:position + key_length].decode('utf-8')
+            position += key_length
+            index[key] = (offset, length)
+        return index
+
+    def keys(self):
+        return list(self._index.keys())
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def get(self, key):
+        """Return the response for key, raising KeyError if there's none.
+        """
+        offset, length = self._index[key]
+        with self._lock:
+            self._f.seek(offset)
+            data = self._f.read(length)
+        return zlib.decompress(data)
+
+    def close(self):
+        self._f.close()
+
+class RecordingClient(client.Client):
+    """A Client that writes the responses it retrieves to an archive.
+
+    Call close once the harvest is done to complete the archive.
+    """
+    def __init__(self, base_url, path, metadata_registry=None, **kw):
+        client.Client.__init__(self, base_url, metadata_registry, **kw)
+        self._writer = ArchiveWriter(path)
+
+    def makeRequest(self, **kw):
+        response = client.Client.makeRequest(self, **kw)
+        if not isinstance(response, bytes):
+            response = response.encode('utf-8')
+        self._writer.add(getRequestKey(kw), response)
+        return response
+
+    def makeRequestChunks(self, **kw):
+        # responses are recorded as a whole
+        return [self.makeRequest(**kw)]
+
+    def close(self):
+        self._writer.close()
+
+class ReplayClient(client.BaseClient):
+    """A client that takes its responses from an archive.
+
+    To simulate a network, each response can be delayed by `latency`
+    seconds, plus the time it takes to transfer it at `bandwidth` bytes
+    per second.
+    """
+    def __init__(self, path, metadata_registry=None, latency=0,
+                 bandwidth=None):
+        client.BaseClient.__init__(self, metadata_registry)
+        self._reader = ArchiveReader(path)
+        self._latency = latency
+        self._bandwidth = bandwidth
+
+    def makeRequest(self, **kw):
+        try:
+            response = self._reader.get(getRequestKey(kw))
+        except KeyError:
+            raise client.Error("Request not in archive: %s" % kw)
+        delay = self._latency
+        if self._bandwidth:
+            delay += float(len(response)) / self._bandwidth
+        if delay:
+            time.sleep(delay)
+        return response
+
+    def close(self):
+        self._reader.close()
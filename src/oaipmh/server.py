@@ -1,5 +1,6 @@
 from lxml.etree import ElementTree, Element, SubElement
 from lxml import etree
+from copy import deepcopy
 from datetime import datetime
 try:
     from urllib.parse import urlencode, quote, unquote
@@ -9,7 +10,14 @@ try:
     from urllib.parse import parse_qs
 except ImportError:
     from urlparse import parse_qs
+import re
 import sys
+from itertools import islice
+import threading
+import time
+from collections import OrderedDict
+
+import six
 
 from oaipmh import common, metadata, validation, error
 from oaipmh.datestamp import datestamp_to_datetime, datetime_to_datestamp, DatestampError
@@ -23,6 +31,22 @@ NSMAP = {
     None: NS_OAIPMH,
     }
 
+LIST_VERBS = ['ListIdentifiers', 'ListRecords', 'ListSets']
+
+# verbs handled by XMLTemplateServer
+TEMPLATE_VERBS = ['GetRecord', 'ListIdentifiers', 'ListRecords']
+
+OAI_DC_FIELDS = [
+    'title', 'creator', 'subject', 'description', 'publisher',
+    'contributor', 'date', 'type', 'format', 'identifier',
+    'source', 'language', 'relation', 'coverage', 'rights']
+
+# bytes rendered before a chunk is produced when streaming
+STREAM_CHUNK_SIZE = 16 * 1024
+
+# comment used to find where items go in a serialized response
+SPLIT_MARKER = 'oaipmh-split'
+
 class XMLTreeServer(object):
     """A server that responds to messages by returning XML trees.
 
@@ -39,7 +63,29 @@ class XMLTreeServer(object):
         self._server = server
         self._metadata_registry = (
             metadata_registry or metadata.global_metadata_registry)
-        
+        self._identify = None
+
+    def getIdentify(self):
+        """Return the Identify of the server, and its descriptions parsed
+        into elements.
+
+        These are only retrieved from the server the first time, until
+        invalidateIdentify is called.
+        """
+        identify = self._identify
+        if identify is None:
+            result = self._server.identify()
+            descriptions = [etree.fromstring(description)
+                            for description in result.descriptions()]
+            identify = self._identify = result, descriptions
+        return identify
+
+    def invalidateIdentify(self):
+        """Forget the Identify of the server, so that it is retrieved
+        again for the next response.
+        """
+        self._identify = None
+
     def getRecord(self, **kw):
         envelope, e_getRecord = self._outputEnvelope(
             verb='GetRecord', **kw)
@@ -60,7 +106,7 @@ class XMLTreeServer(object):
         
     def identify(self):
         envelope, e_identify = self._outputEnvelope(verb='Identify')
-        identify = self._server.identify()
+        identify, descriptions = self.getIdentify()
         e_repositoryName = SubElement(e_identify, nsoai('repositoryName'))
         e_repositoryName.text = identify.repositoryName()
         e_baseURL = SubElement(e_identify, nsoai('baseURL'))
@@ -85,9 +131,9 @@ class XMLTreeServer(object):
                 e_compression = SubElement(e_identify, nsoai('compression'))
                 e_compression.text = compression
 
-        for description in identify.descriptions():
+        for description in descriptions:
             e_description = SubElement(e_identify, nsoai('description'))
-            e_description.append(etree.fromstring(description))
+            e_description.append(deepcopy(description))
         return envelope
 
     def listMetadataFormats(self, **kw):
@@ -111,52 +157,95 @@ class XMLTreeServer(object):
     def listIdentifiers(self, **kw):
         envelope, e_listIdentifiers = self._outputEnvelope(
             verb='ListIdentifiers', **kw)
-        def outputFunc(element, headers, token_kw):
-            for header in headers:
-                self._outputHeader(element, header)
         self._outputResuming(
             e_listIdentifiers,
             self._server.listIdentifiers,
-            outputFunc,
+            self._outputHeaders,
             kw)
         return envelope
     
     def listRecords(self, **kw):
         envelope, e_listRecords = self._outputEnvelope(
             verb="ListRecords", **kw)
-        def outputFunc(element, records, token_kw):
-            metadataPrefix = token_kw['metadataPrefix']
-            for header, metadata, about in records:
-                e_record = SubElement(e_listRecords, nsoai('record'))
-                self._outputHeader(e_record, header)
-                if not header.isDeleted():
-                    self._outputMetadata(e_record, metadataPrefix, metadata)
-                # XXX about
         self._outputResuming(
             e_listRecords,
             self._server.listRecords,
-            outputFunc,
+            self._outputRecords,
             kw)
         return envelope
 
     def listSets(self, **kw):
         envelope, e_listSets = self._outputEnvelope(
             verb='ListSets', **kw)
-        def outputFunc(element, sets, token_kw):
-            for setSpec, setName, setDescription in sets:
-                e_set = SubElement(e_listSets, nsoai('set'))
-                e_setSpec = SubElement(e_set, nsoai('setSpec'))
-                e_setSpec.text = setSpec
-                e_setName = SubElement(e_set, nsoai('setName'))
-                e_setName.text = setName
-                # XXX ignore setDescription
         self._outputResuming(
             e_listSets,
             self._server.listSets,
-            outputFunc,
+            self._outputSets,
             kw)
         return envelope
 
+    def streamList(self, verb, chunk_size=STREAM_CHUNK_SIZE, **kw):
+        """Respond to a ListIdentifiers, ListRecords or ListSets request
+        with an iterator of UTF-8 encoded chunks of XML.
+
+        The items of the response are retrieved, and any error raised,
+        before the iterator is returned. The items are only rendered
+        while the iterator is consumed though, one at a time, and a
+        chunk is produced whenever chunk_size bytes have been rendered.
+        The first chunk holds just the start of the envelope.
+        """
+        input_func, output_func = {
+            'ListIdentifiers': (self._server.listIdentifiers,
+                                self._outputHeaders),
+            'ListRecords': (self._server.listRecords, self._outputRecords),
+            'ListSets': (self._server.listSets, self._outputSets),
+            }[verb]
+        result, token, token_kw = self._inputResuming(input_func, kw)
+        if verb == 'ListRecords':
+            # check up front, as errors can't be reported once the
+            # response has been started
+            self._checkMetadataPrefix(token_kw['metadataPrefix'])
+        return self._streamList(
+            verb, result, token, token_kw, output_func, kw, chunk_size)
+
+    def _streamList(self, verb, result, token, token_kw, output_func, kw,
+                    chunk_size):
+        e_tree, e_oaipmh = self._outputBasicEnvelope(verb=verb, **kw)
+        start, separator, end = serializeAround(
+            e_oaipmh, SubElement(e_oaipmh, nsoai(verb)))
+        yield start
+        # items are rendered one at a time into an empty response, and
+        # cut out of its serialization, so that they look exactly like
+        # in a complete response, without namespace declarations
+        e_skeleton = self._outputRoot()
+        e_element = SubElement(e_skeleton, nsoai(verb))
+        out = ChunkWriter()
+        first = True
+        for item in result:
+            output_func(e_element, [item], token_kw)
+            self._writeItems(e_skeleton, e_element, separator, first, out)
+            first = False
+            if out.size >= chunk_size:
+                yield out.take()
+        if token is not None:
+            e_resumptionToken = SubElement(e_element, nsoai('resumptionToken'))
+            outputResumptionToken(e_resumptionToken, token)
+            self._writeItems(e_skeleton, e_element, separator, first, out)
+        out.write(end)
+        yield out.take()
+
+    def _writeItems(self, e_skeleton, e_element, separator, first, out):
+        # write the children of e_element and remove them; the whole
+        # skeleton is serialized again for every item, which only adds
+        # the envelope around e_element (the xml declaration, the root
+        # start tag with its namespace declarations and the end tags),
+        # a few hundred bytes however large the list is
+        inside = serializeAround(e_skeleton, e_element)[1]
+        if not first:
+            out.write(separator)
+        out.write(inside[len(separator):-len(separator)])
+        del e_element[:]
+
     def handleException(self, exception):
         if isinstance(exception, error.ErrorBase):
             envelope = self._outputErrors(
@@ -165,11 +254,15 @@ class XMLTreeServer(object):
         # unhandled exception, so raise again
         raise
     
-    def _outputBasicEnvelope(self, **kw):
+    def _outputRoot(self):
         e_oaipmh = Element(nsoai('OAI-PMH'), nsmap=self._nsmap)
         e_oaipmh.set('{%s}schemaLocation' % NS_XSI,
                      ('http://www.openarchives.org/OAI/2.0/ '
                       'http://www.openarchives.org/OAI/2.0/OAI-PMH.xsd'))
+        return e_oaipmh
+
+    def _outputBasicEnvelope(self, **kw):
+        e_oaipmh = self._outputRoot()
         e_tree = ElementTree(element=e_oaipmh)
         e_responseDate = SubElement(e_oaipmh, nsoai('responseDate'))
         # date should be first possible moment
@@ -182,8 +275,7 @@ class XMLTreeServer(object):
             if key == 'from' or key == 'until':
                 value = datetime_to_datestamp(value)
             e_request.set(key, value)
-        # XXX this is potentially slow..
-        e_request.text = self._server.identify().baseURL()
+        e_request.text = self.getIdentify()[0].baseURL()
         return e_tree, e_oaipmh
     
     def _outputEnvelope(self, **kw):
@@ -201,11 +293,21 @@ class XMLTreeServer(object):
         return e_tree
     
     def _outputResuming(self, element, input_func, output_func, kw):
+        result, token, token_kw = self._inputResuming(input_func, kw)
+        output_func(element, result, token_kw)
+        if token is not None:
+            e_resumptionToken = SubElement(element, nsoai('resumptionToken'))
+            outputResumptionToken(e_resumptionToken, token)
+
+    def _inputResuming(self, input_func, kw):
         if 'resumptionToken' in kw:
             resumptionToken = kw['resumptionToken']
+            # unpack keywords from resumption token, which may only be
+            # understood by the server if it keeps a token store
+            decodeToken = getattr(
+                self._server, 'decodeToken', decodeResumptionToken)
+            token_kw, dummy = decodeToken(resumptionToken)
             result, token = input_func(resumptionToken=resumptionToken)
-            # unpack keywords from resumption token
-            token_kw, dummy = decodeResumptionToken(resumptionToken)
         else:
             result, token = input_func(**kw)
             # if we don't get results for the first request,
@@ -218,11 +320,30 @@ class XMLTreeServer(object):
                     "No records match for request.")
             # without resumption token keys are fine
             token_kw = kw
-        output_func(element, result, token_kw)
-        if token is not None:
-            e_resumptionToken = SubElement(element, nsoai('resumptionToken'))
-            e_resumptionToken.text = token
-            
+        return result, token, token_kw
+
+    def _outputHeaders(self, element, headers, token_kw):
+        for header in headers:
+            self._outputHeader(element, header)
+
+    def _outputRecords(self, element, records, token_kw):
+        metadataPrefix = token_kw['metadataPrefix']
+        for header, metadata, about in records:
+            e_record = SubElement(element, nsoai('record'))
+            self._outputHeader(e_record, header)
+            if not header.isDeleted():
+                self._outputMetadata(e_record, metadataPrefix, metadata)
+            # XXX about
+
+    def _outputSets(self, element, sets, token_kw):
+        for setSpec, setName, setDescription in sets:
+            e_set = SubElement(element, nsoai('set'))
+            e_setSpec = SubElement(e_set, nsoai('setSpec'))
+            e_setSpec.text = setSpec
+            e_setName = SubElement(e_set, nsoai('setName'))
+            e_setName.text = setName
+            # XXX ignore setDescription
+
     def _outputHeader(self, element, header):
         e_header = SubElement(element, nsoai('header'))
         if header.isDeleted():
@@ -237,11 +358,266 @@ class XMLTreeServer(object):
     
     def _outputMetadata(self, element, metadata_prefix, metadata):
         e_metadata = SubElement(element, nsoai('metadata'))
+        self._checkMetadataPrefix(metadata_prefix)
+        self._metadata_registry.writeMetadata(
+            metadata_prefix, e_metadata, metadata)
+
+    def _checkMetadataPrefix(self, metadata_prefix):
         if not self._metadata_registry.hasWriter(metadata_prefix):
             raise error.CannotDisseminateFormatError(
                   "Unknown metadata format: %s" % metadata_prefix)
-        self._metadata_registry.writeMetadata(
-            metadata_prefix, e_metadata, metadata)
+
+class XMLTemplateServer(object):
+    """A server that renders responses by filling in text templates,
+    instead of building a tree and serializing it.
+
+    Handles GetRecord, ListIdentifiers and ListRecords for an
+    XMLTreeServer, with exactly the same output. The envelope and
+    headers are rendered from templates, and so is metadata written by
+    oai_dc_writer. Metadata in other formats is written with its writer
+    as usual, and the element it produces is serialized.
+    """
+    def __init__(self, tree_server):
+        self._tree_server = tree_server
+        # serialize a sample response to find out what the envelope
+        # looks like with the namespaces of the server
+        e_oaipmh = tree_server._outputRoot()
+        self._start = (u"<?xml version='1.0' encoding='UTF-8'?>\n" +
+                       etree.tostring(e_oaipmh, encoding=six.text_type)[:-2] +
+                       u'>\n')
+        e_metadata = self._createMetadataElement()
+        oai_dc_writer(e_metadata, common.Metadata(None, {'title': ['x']}))
+        lines = [line.strip() for line in
+                 serializeMetadata(e_metadata).split(u'\n')]
+        self._dc_start = lines[1]
+        self._dc_end = lines[3]
+        # the prefix used for the dc namespace
+        self._dc_prefix = lines[2][1:lines[2].index(u'title>')]
+
+    def getRecord(self, **kw):
+        """Return an iterator of chunks of the response to GetRecord.
+        """
+        header, metadata, about = self._tree_server._server.getRecord(**kw)
+        writer = None
+        if not header.isDeleted():
+            writer = self._getWriter(kw['metadataPrefix'])
+        return self._render('GetRecord', self._renderRecords,
+                            [(header, metadata, about)], None, writer, kw,
+                            STREAM_CHUNK_SIZE)
+
+    def listIdentifiers(self, chunk_size=STREAM_CHUNK_SIZE, **kw):
+        """Return an iterator of chunks of the response to
+        ListIdentifiers.
+        """
+        result, token, token_kw = self._tree_server._inputResuming(
+            self._tree_server._server.listIdentifiers, kw)
+        return self._render('ListIdentifiers', self._renderHeaders,
+                            result, token, None, kw, chunk_size)
+
+    def listRecords(self, chunk_size=STREAM_CHUNK_SIZE, **kw):
+        """Return an iterator of chunks of the response to ListRecords.
+        """
+        result, token, token_kw = self._tree_server._inputResuming(
+            self._tree_server._server.listRecords, kw)
+        writer = self._getWriter(token_kw['metadataPrefix'])
+        return self._render('ListRecords', self._renderRecords, result,
+                            token, writer, kw, chunk_size)
+
+    def _getWriter(self, metadata_prefix):
+        self._tree_server._checkMetadataPrefix(metadata_prefix)
+        return self._tree_server._metadata_registry.getWriter(
+            metadata_prefix)
+
+    def _render(self, verb, render_func, result, token, writer, kw,
+                chunk_size):
+        out = [self._start, u'  <responseDate>',
+               datetime_to_datestamp(datetime.utcnow().replace(microsecond=0)),
+               u'</responseDate>\n  <request verb="', verb, u'"']
+        for key, value in kw.items():
+            if key == 'from_':
+                key = 'from'
+            if key == 'from' or key == 'until':
+                value = datetime_to_datestamp(value)
+            out.extend([u' ', key, u'="', escapeAttribute(value), u'"'])
+        out.extend([u'>', escapeText(
+            self._tree_server.getIdentify()[0].baseURL()), u'</request>\n'])
+        if not result and token is None:
+            out.extend([u'  <', verb, u'/>\n</OAI-PMH>\n'])
+            yield u''.join(out).encode('utf-8')
+            return
+        out.extend([u'  <', verb, u'>\n'])
+        e_metadata = None
+        if writer is not None and writer is not oai_dc_writer:
+            e_metadata = self._createMetadataElement()
+        size = 0
+        for item in result:
+            size += render_func(out, item, writer, e_metadata)
+            if size >= chunk_size:
+                yield u''.join(out).encode('utf-8')
+                out = []
+                size = 0
+        if token is not None:
+            out.append(u'    <resumptionToken')
+            for name, value in getResumptionTokenAttributes(token):
+                out.extend([u' ', name, u'="', escapeAttribute(value), u'"'])
+            out.extend([u'>', escapeText(token), u'</resumptionToken>\n'])
+        out.extend([u'  </', verb, u'>\n</OAI-PMH>\n'])
+        yield u''.join(out).encode('utf-8')
+
+    def _renderHeaders(self, out, header, writer, e_metadata):
+        start = len(out)
+        self._renderHeader(out, header, u'    ')
+        return sum([len(piece) for piece in out[start:]])
+
+    def _renderRecords(self, out, record, writer, e_metadata):
+        start = len(out)
+        header, metadata, about = record
+        out.append(u'    <record>\n')
+        self._renderHeader(out, header, u'      ')
+        if not header.isDeleted():
+            if writer is oai_dc_writer:
+                self._renderOaiDc(out, metadata)
+            else:
+                e_metadata.clear()
+                writer(e_metadata, metadata)
+                out.extend([u'      ', serializeMetadata(e_metadata), u'\n'])
+            # XXX about
+        out.append(u'    </record>\n')
+        return sum([len(piece) for piece in out[start:]])
+
+    def _renderHeader(self, out, header, indent):
+        if header.isDeleted():
+            out.extend([indent, u'<header status="deleted">\n'])
+        else:
+            out.extend([indent, u'<header>\n'])
+        renderElement(out, indent + u'  ', u'identifier', header.identifier())
+        renderElement(out, indent + u'  ', u'datestamp',
+                      datetime_to_datestamp(header.datestamp()))
+        for set in header.setSpec():
+            renderElement(out, indent + u'  ', u'setSpec', set)
+        out.extend([indent, u'</header>\n'])
+
+    def _renderOaiDc(self, out, metadata):
+        map = metadata.getMap()
+        fields = []
+        for name in OAI_DC_FIELDS:
+            for value in map.get(name, []):
+                renderElement(fields, u'          ', self._dc_prefix + name,
+                              value)
+        if not fields:
+            out.extend([u'      <metadata>\n        ', self._dc_start[:-1],
+                        u'/>\n      </metadata>\n'])
+            return
+        out.extend([u'      <metadata>\n        ', self._dc_start, u'\n'])
+        out.extend(fields)
+        out.extend([u'        ', self._dc_end, u'\n      </metadata>\n'])
+
+    def _createMetadataElement(self):
+        # a metadata element in an envelope like the one of the
+        # responses, to write metadata under
+        e_oaipmh = self._tree_server._outputRoot()
+        e_record = SubElement(SubElement(e_oaipmh, nsoai('GetRecord')),
+                              nsoai('record'))
+        return SubElement(e_record, nsoai('metadata'))
+
+def serializeAround(e_root, e_element):
+    """Serialize the response e_root like ServerBase.handleRequest does,
+    and return the bytes before, between and after the children of
+    e_element.
+
+    Without children the bytes between are the whitespace that
+    separates them.
+    """
+    e_start = etree.Comment(SPLIT_MARKER)
+    e_end = etree.Comment(SPLIT_MARKER)
+    e_element.insert(0, e_start)
+    e_element.append(e_end)
+    try:
+        data = etree.tostring(e_root, encoding='UTF-8', xml_declaration=True,
+                              pretty_print=True)
+    finally:
+        e_element.remove(e_start)
+        e_element.remove(e_end)
+    marker = ('<!--%s-->' % SPLIT_MARKER).encode('ascii')
+    before, rest = data.split(marker, 1)
+    between, after = rest.rsplit(marker, 1)
+    return before, between, after
+
+def serializeMetadata(e_metadata):
+    """Serialize a metadata element created by
+    XMLTemplateServer._createMetadataElement.
+    """
+    # the metadata element is serialized as part of its envelope, so
+    # that namespaces and indentation come out the same as in a response
+    xml = etree.tostring(e_metadata.getroottree(), encoding=six.text_type,
+                         pretty_print=True)
+    start = xml.index(u'<metadata')
+    end = xml.rfind(u'</metadata>')
+    if end == -1:
+        return xml[start:xml.index(u'/>', start) + 2]
+    return xml[start:end + len(u'</metadata>')]
+
+def renderElement(out, indent, tag, text):
+    if text is None:
+        out.extend([indent, u'<', tag, u'/>\n'])
+    else:
+        out.extend([indent, u'<', tag, u'>', escapeText(text), u'</', tag,
+                    u'>\n'])
+
+def escapeText(text):
+    """Escape text like lxml does in element content.
+    """
+    text = checkText(text)
+    if u'&' in text:
+        text = text.replace(u'&', u'&amp;')
+    if u'<' in text:
+        text = text.replace(u'<', u'&lt;')
+    if u'>' in text:
+        text = text.replace(u'>', u'&gt;')
+    if u'\r' in text:
+        text = text.replace(u'\r', u'&#13;')
+    return text
+
+def escapeAttribute(text):
+    """Escape text like lxml does in attribute values.
+    """
+    text = escapeText(text)
+    if u'"' in text:
+        text = text.replace(u'"', u'&quot;')
+    if u'\n' in text:
+        text = text.replace(u'\n', u'&#10;')
+    if u'\t' in text:
+        text = text.replace(u'\t', u'&#9;')
+    return text
+
+_invalid_xml = re.compile(u'[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+
+def checkText(text):
+    # refuse what lxml refuses
+    if isinstance(text, bytes):
+        text = text.decode('utf-8')
+    if _invalid_xml.search(text) is not None:
+        raise ValueError("All strings must be XML compatible: Unicode or "
+                         "ASCII, no NULL bytes or control characters")
+    return text
+
+class ChunkWriter(object):
+    """File-like object that collects what is written to it, until it is
+    taken out as a single chunk.
+    """
+    def __init__(self):
+        self._data = []
+        self.size = 0
+
+    def write(self, data):
+        self._data.append(data)
+        self.size += len(data)
+
+    def take(self):
+        chunk = b''.join(self._data)
+        self._data = []
+        self.size = 0
+        return chunk
 
 class ServerBase(common.ResumptionOAIPMH):
     """A server that responds to messages by returning OAI-PMH compliant XML.
@@ -250,6 +626,17 @@ class ServerBase(common.ResumptionOAIPMH):
     """
     def __init__(self, server, metadata_registry=None, nsmap=None):
         self._tree_server = XMLTreeServer(server, metadata_registry, nsmap)
+        self._template_server = None
+
+    def setTemplateRendering(self, true_or_false):
+        """Render the responses to GetRecord, ListIdentifiers and
+        ListRecords from templates, see XMLTemplateServer. The responses
+        stay the same, but are produced faster.
+        """
+        if true_or_false:
+            self._template_server = XMLTemplateServer(self._tree_server)
+        else:
+            self._template_server = None
 
     def handleRequest(self, request_kw):
         """Handles incoming OAI-PMH request.
@@ -257,72 +644,105 @@ class ServerBase(common.ResumptionOAIPMH):
         request_kw is a dictionary containing request parameters, including
         verb.
         """
-        # try to get verb, if not, we have an argument handling error
         try:
-            new_kw = {}
-            try:
-                for key, value in request_kw.items():
-                    new_kw[str(key)] = value
-            except UnicodeError:
-                raise error.BadVerbError(
-                      "Non-ascii keys in request.")
-            request_kw = new_kw
-            try:
-                verb = request_kw.pop('verb')
-            except KeyError:
-                verb = 'unknown'
-                raise error.BadVerbError(
-                      "Required verb argument not found.")
-            if verb not in ['GetRecord', 'Identify', 'ListIdentifiers',
-                            'GetMetadata', 'ListMetadataFormats',
-                            'ListRecords', 'ListSets']:
-                raise error.BadVerbError("Illegal verb: %s" % verb)
-            # replace from and until arguments if necessary
-            from_ = request_kw.get('from')
-            if from_ is not None:
-                # rename to from_ for internal use
-                try:
-                    request_kw['from_'] = datestamp_to_datetime(from_)
-                except DatestampError as err:
-                    raise error.BadArgumentError(
-                        "The value '%s' of the argument "
-                        "'%s' is not valid." %(from_, 'from'))
-                del request_kw['from']
-            until = request_kw.get('until')
-            if until is not None:
-                try:
-                    request_kw['until'] = datestamp_to_datetime(until,
-                                                                inclusive=True)
-                except DatestampError as err:
-                    raise error.BadArgumentError(
-                        "The value '%s' of the argument "
-                        "'%s' is not valid." %(until, 'until'))
-
-            if from_ is not None and until is not None:
-                if (('T' in from_ and not 'T' in until) or
-                    ('T' in until and not 'T' in from_)):
-                    raise error.BadArgumentError(
-                        "The request has different granularities for"
-                        " the from and until parameters")
-                
-            # now validate parameters
-            try:
-                validation.validateResumptionArguments(verb, request_kw)
-            except validation.BadArgumentError as e:
-                # have to raise this as a error.BadArgumentError
-                raise error.BadArgumentError(str(e))
-            # now handle verb
-            return self.handleVerb(verb, request_kw)            
+            verb, kw = self._parseRequest(request_kw)
+            return self.handleVerb(verb, kw)
         except:
             # in case of exception, call exception handler
             return self.handleException(request_kw, sys.exc_info())
-        
+
+    def handleRequestStreaming(self, request_kw):
+        """Handles incoming OAI-PMH request, like handleRequest, but
+        returns an iterator of chunks of the response.
+
+        The responses to ListIdentifiers, ListRecords and ListSets are
+        rendered while they are being consumed, see
+        XMLTreeServer.streamList. Errors are reported in the response as
+        usual, as they are found before the first chunk is produced.
+        """
+        try:
+            verb, kw = self._parseRequest(request_kw)
+            return self.handleVerbStreaming(verb, kw)
+        except:
+            return iter([self.handleException(request_kw, sys.exc_info())])
+
+    def _parseRequest(self, request_kw):
+        # try to get verb, if not, we have an argument handling error
+        new_kw = {}
+        try:
+            for key, value in request_kw.items():
+                new_kw[str(key)] = value
+        except UnicodeError:
+            raise error.BadVerbError(
+                  "Non-ascii keys in request.")
+        request_kw = new_kw
+        try:
+            verb = request_kw.pop('verb')
+        except KeyError:
+            verb = 'unknown'
+            raise error.BadVerbError(
+                  "Required verb argument not found.")
+        if verb not in ['GetRecord', 'Identify', 'ListIdentifiers',
+                        'GetMetadata', 'ListMetadataFormats',
+                        'ListRecords', 'ListSets']:
+            raise error.BadVerbError("Illegal verb: %s" % verb)
+        # replace from and until arguments if necessary
+        from_ = request_kw.get('from')
+        if from_ is not None:
+            # rename to from_ for internal use
+            try:
+                request_kw['from_'] = datestamp_to_datetime(from_)
+            except DatestampError as err:
+                raise error.BadArgumentError(
+                    "The value '%s' of the argument "
+                    "'%s' is not valid." %(from_, 'from'))
+            del request_kw['from']
+        until = request_kw.get('until')
+        if until is not None:
+            try:
+                request_kw['until'] = datestamp_to_datetime(until,
+                                                            inclusive=True)
+            except DatestampError as err:
+                raise error.BadArgumentError(
+                    "The value '%s' of the argument "
+                    "'%s' is not valid." %(until, 'until'))
+
+        if from_ is not None and until is not None:
+            if (('T' in from_ and not 'T' in until) or
+                ('T' in until and not 'T' in from_)):
+                raise error.BadArgumentError(
+                    "The request has different granularities for"
+                    " the from and until parameters")
+
+        # now validate parameters
+        try:
+            validation.validateResumptionArguments(verb, request_kw)
+        except validation.BadArgumentError as e:
+            # have to raise this as a error.BadArgumentError
+            raise error.BadArgumentError(str(e))
+        return verb, request_kw
+
+    def invalidateIdentify(self):
+        """Call when the Identify of the server changes, as it is cached.
+        """
+        self._tree_server.invalidateIdentify()
+
     def handleVerb(self, verb, kw):
+        if self._template_server is not None and verb in TEMPLATE_VERBS:
+            return b''.join(self.handleVerbStreaming(verb, kw))
         method = common.getMethodForVerb(self._tree_server, verb)
         return etree.tostring(method(**kw).getroot(), 
                               encoding='UTF-8',
                               xml_declaration=True,
                               pretty_print=True)
+
+    def handleVerbStreaming(self, verb, kw):
+        if self._template_server is not None and verb in TEMPLATE_VERBS:
+            method = common.getMethodForVerb(self._template_server, verb)
+            return method(**kw)
+        if verb in LIST_VERBS:
+            return self._tree_server.streamList(verb, **kw)
+        return iter([self.handleVerb(verb, kw)])
   
     def handleException(self, kw, exc_info):
         type, value, traceback = exc_info
@@ -334,86 +754,216 @@ class ServerBase(common.ResumptionOAIPMH):
 
 class Server(ServerBase):
     """Expects to be initialized with a IOAI server implementation.
+
+    Pass a ResultCache as result_cache to keep results between the
+    requests for their batches, and a token store from
+    oaipmh.tokenstore as token_store to hand out short resumption
+    tokens with an expirationDate.
     """
     def __init__(self, server, metadata_registry=None, nsmap=None,
-                 resumption_batch_size=10):
+                 resumption_batch_size=10, result_cache=None,
+                 token_store=None):
         super(Server, self).__init__(
-            Resumption(server, resumption_batch_size),
+            Resumption(server, resumption_batch_size, result_cache,
+                       token_store),
             metadata_registry,
             nsmap)
 
 class BatchingServer(ServerBase):
     """Expects to be initialized with a IBatchingOAI server implementation.
+
+    Pass keyset=True if the server supports keyset pagination, and a
+    token store as token_store to hand out short resumption tokens; see
+    BatchingResumption.
     """
     def __init__(self, server, metadata_registry=None, nsmap=None,
-                 resumption_batch_size=10):
+                 resumption_batch_size=10, keyset=False, token_store=None):
         super(BatchingServer, self).__init__(
-            BatchingResumption(server, resumption_batch_size),
+            BatchingResumption(server, resumption_batch_size, keyset,
+                               token_store),
             metadata_registry,
             nsmap)
 
+class ResultCache(object):
+    """Keeps the complete results of list requests, so that Resumption
+    doesn't have to query the server again for every batch.
+
+    At most max_results results are kept, holding at most max_items
+    items together, and a result is kept at most ttl seconds (None
+    means no limit). When there are too many, the least recently used
+    results are evicted first.
+
+    The number of hits, misses, evictions and expirations is kept, see
+    stats.
+    """
+    def __init__(self, max_results=100, max_items=None, ttl=600):
+        self._max_results = max_results
+        self._max_items = max_items
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        # key -> (time stored, result), least recently used first
+        self._results = OrderedDict()
+        self._items = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        """Return the result for key, or None if there is none.
+        """
+        with self._lock:
+            entry = self._results.pop(key, None)
+            if entry is not None and self._ttl is not None and (
+                entry[0] + self._ttl < time.time()):
+                self._items -= len(entry[1])
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._results[key] = entry
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, result):
+        with self._lock:
+            entry = self._results.pop(key, None)
+            if entry is not None:
+                self._items -= len(entry[1])
+            self._results[key] = time.time(), result
+            self._items += len(result)
+            while self._results and (
+                len(self._results) > self._max_results or
+                (self._max_items is not None and
+                 self._items > self._max_items)):
+                key, entry = self._results.popitem(last=False)
+                self._items -= len(entry[1])
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+            self._items = 0
+
+    def stats(self):
+        """Return a dictionary with the number of results and items kept,
+        and the number of hits, misses, evictions and expirations.
+        """
+        with self._lock:
+            return {
+                'results': len(self._results),
+                'items': self._items,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                }
+
 class Resumption(common.ResumptionOAIPMH):
     """
     The Resumption class can turn a plain IOAIPMH interface into
     a ResumptionOAIPMH interface
 
-    This implementation is not particularly efficient for large
-    result sets, as the complete result set needs to be reconstructed each
-    time.
+    The query is done again for each batch, and the items before the
+    batch are skipped, unless a ResultCache is passed in as
+    result_cache. Only the items of the batch are kept, so results that
+    are produced lazily by the server are never held completely.
+
+    Resumption tokens hold the arguments of the request and the cursor,
+    unless a token store (see oaipmh.tokenstore) is passed in as
+    token_store. The store then keeps these, and the tokens are short
+    keys that expire.
     """
-    def __init__(self, server, batch_size=10):
+    def __init__(self, server, batch_size=10, result_cache=None,
+                 token_store=None):
         self._server = server
         self._batch_size = batch_size
+        self._result_cache = result_cache
+        self._token_store = token_store
     
     def handleVerb(self, verb, kw):
-        # do original query
         method = common.getMethodForVerb(self._server, verb)
+        completeListSize = None
         # if we're handling a resumption token
         if 'resumptionToken' in kw:
-            kw, cursor = decodeResumptionToken(
-                kw['resumptionToken'])
-            end_batch = cursor + self._batch_size
-            # do query again with original parameters
+            kw, cursor, completeListSize = decodeStoredToken(
+                self._token_store, kw['resumptionToken'])
+        elif verb in LIST_VERBS:
+            cursor = 0
+        else:
+            return method(**kw)
+        end_batch = cursor + self._batch_size
+        if self._result_cache is not None:
+            result = self._getResult(verb, method, kw)
+            batch = result[cursor:end_batch]
+            more = end_batch < len(result)
+            completeListSize = len(result)
+        else:
+            # do query again with original parameters, reading one item
+            # beyond the batch to know whether there are more
             result = method(**kw)
-            # XXX defeat laziness of any generators..
-            result = list(result)
-            if end_batch < len(result):
-                resumptionToken = encodeResumptionToken(
-                    kw, end_batch)
+            if isinstance(result, (list, tuple)):
+                batch = list(result[cursor:end_batch + 1])
             else:
-                resumptionToken = None
-            return result[cursor:end_batch], resumptionToken
+                batch = list(islice(result, cursor, end_batch + 1))
+            more = len(batch) > self._batch_size
+            del batch[self._batch_size:]
+            if more and completeListSize is None:
+                completeListSize = countItems(self._server, verb, kw)
+        if not more:
+            return batch, None
+        return batch, createResumptionToken(
+            self._token_store, kw, end_batch, completeListSize, cursor)
 
-        # we're not handling resumption token, so do request
-        result = method(**kw)
+    def decodeToken(self, token):
+        """Return the arguments of the request and the cursor for token.
+        """
+        kw, cursor, completeListSize = decodeStoredToken(
+            self._token_store, token)
+        return kw, cursor
 
-        # now handle resumption system
-        if verb in ['ListSets', 'ListIdentifiers', 'ListRecords']:
-            # XXX defeat the laziness effect of any generators..
-            result = list(result)
-            end_batch = self._batch_size
-            if end_batch < len(result):
-                resumptionToken = encodeResumptionToken(
-                    kw, end_batch)
-            else:
-                resumptionToken = None
-            return result[0:end_batch], resumptionToken
+    def _getResult(self, verb, method, kw):
+        # the complete result, from the result cache if it is there
+        cache = self._result_cache
+        key = (verb,) + tuple(sorted(kw.items()))
+        result = cache.get(key)
+        if result is None:
+            result = list(method(**kw))
+            # only a result that continues is asked for again
+            if len(result) > self._batch_size:
+                cache.put(key, result)
         return result
 
 class BatchingResumption(common.ResumptionOAIPMH):
     """
     The BatchingResumption class can turn a IBatchingOAIPMH interface into
     a ResumptionOAIPMH interface.
+
+    By default the server is asked for the batch at a cursor. If keyset
+    is true, ListIdentifiers and ListRecords ask for the batch after
+    the last item of the previous batch instead, so that the server can
+    seek to it directly; see IBatchingOAI.listIdentifiers. Tokens that
+    have only a cursor are still accepted.
+
+    Pass a token store as token_store to keep the state of lists in it,
+    see Resumption.
     """
     
-    def __init__(self, server, batch_size=10):
+    def __init__(self, server, batch_size=10, keyset=False,
+                 token_store=None):
         self._server = server
         self._batch_size = batch_size
+        self._keyset = keyset
+        self._token_store = token_store
         
     def handleVerb(self, verb, kw):
+        after = None
+        completeListSize = None
         if 'resumptionToken' in kw:
-            kw, cursor = decodeResumptionToken(
-                kw['resumptionToken'])
+            kw, cursor, completeListSize = decodeStoredToken(
+                self._token_store, kw['resumptionToken'])
+            after = popContinuation(kw)
             kw['cursor'] = cursor
             
         method = common.getMethodForVerb(self._server, verb)
@@ -421,28 +971,95 @@ class BatchingResumption(common.ResumptionOAIPMH):
         # now handle resumption system
         if verb in ['ListSets', 'ListIdentifiers', 'ListRecords']:
             kw = kw.copy()
-            cursor = kw.get('cursor', None)
+            cursor = kw.pop('cursor', None)
             if cursor is None:
-                kw['cursor'] = cursor = 0
+                cursor = 0
+            kw.pop('batch_size', None)
+            args = kw.copy()
             # we request 1 beyond the batch size, so that
             # if we retrieve <= batch_size items, we know we
             # don't need to output another resumption token
-            kw['batch_size'] = self._batch_size + 1  
-            result = method(**kw)
+            args['batch_size'] = self._batch_size + 1
+            keyset = self._keyset and verb != 'ListSets'
+            if keyset and (after is not None or cursor == 0):
+                args['after'] = after
+            else:
+                args['cursor'] = cursor
+            result = method(**args)
             result = list(result)
             if len(result) > self._batch_size:
-                # more results are expected, so encode resumption token
-                resumptionToken = encodeResumptionToken(
-                    kw, cursor + self._batch_size)
                 # we also want to result only the batch_size, so pop the
                 # last one
                 result.pop()
+                # more results are expected, so encode resumption token
+                token_kw = kw.copy()
+                if keyset:
+                    token_kw.update(encodeContinuation(
+                        self._getContinuation(verb, result[-1])))
+                if completeListSize is None:
+                    completeListSize = countItems(self._server, verb, kw)
+                resumptionToken = createResumptionToken(
+                    self._token_store, token_kw, cursor + self._batch_size,
+                    completeListSize, cursor)
             else:
                 # no more results are expected
                 resumptionToken = None
             return result, resumptionToken
         return method(**kw)
-    
+
+    def _getContinuation(self, verb, item):
+        # the server can continue lists in its own way, see
+        # IBatchingOAI.getContinuation
+        getContinuation = getattr(self._server, 'getContinuation', None)
+        if getContinuation is not None:
+            return getContinuation(verb, item)
+        if verb == 'ListRecords':
+            header = item[0]
+        else:
+            header = item
+        return header.datestamp(), header.identifier()
+
+    def decodeToken(self, token):
+        """Return the arguments of the request and the cursor for token.
+        """
+        kw, cursor, completeListSize = decodeStoredToken(
+            self._token_store, token)
+        return kw, cursor
+
+def countItems(server, verb, kw):
+    """Count the items of a list with the optional count method of
+    server (such as IOAI.countRecords), or return None if it has none.
+    """
+    count = getattr(server, 'count' + verb[len('List'):], None)
+    if count is None:
+        return None
+    return count(**kw)
+
+def encodeContinuation(after):
+    """Return the token arguments for the point to continue a list
+    after, a (datestamp, identifier) tuple or a string.
+    """
+    if isinstance(after, tuple):
+        datestamp, identifier = after
+        return {'after_datestamp': datetime_to_datestamp(datestamp),
+                'after_identifier': identifier}
+    return {'after': after}
+
+def popContinuation(kw):
+    """Remove the point to continue a list after from the arguments of
+    a decoded token, and return it (or None).
+    """
+    if 'after' in kw:
+        return kw.pop('after')
+    if 'after_datestamp' not in kw and 'after_identifier' not in kw:
+        return None
+    try:
+        return (datestamp_to_datetime(kw.pop('after_datestamp')),
+                kw.pop('after_identifier'))
+    except (KeyError, DatestampError):
+        raise error.BadResumptionTokenError(
+            "Unable to decode resumption token (bad continuation)")
+
 def encodeResumptionToken(kw, cursor):
     kw = kw.copy()
     kw['cursor'] = str(cursor)
@@ -454,6 +1071,49 @@ def encodeResumptionToken(kw, cursor):
         kw['until'] = datetime_to_datestamp(until)
     return quote(urlencode(kw))
 
+def createResumptionToken(token_store, kw, next_cursor, completeListSize,
+                          cursor):
+    """Return a common.ResumptionToken to continue a list at next_cursor.
+
+    Without a token store the token holds the arguments of the request,
+    next_cursor and completeListSize, so that the list isn't counted
+    again for every batch. With one these are stored and the token is
+    the key the store returns.
+    """
+    if token_store is None:
+        if completeListSize is not None:
+            kw = kw.copy()
+            kw['completeListSize'] = str(completeListSize)
+        return common.ResumptionToken(
+            encodeResumptionToken(kw, next_cursor), completeListSize, cursor)
+    state = encodeResumptionToken(kw, next_cursor)
+    token, expirationDate = token_store.put(state, completeListSize)
+    return common.ResumptionToken(
+        token, completeListSize, cursor, expirationDate)
+
+def decodeStoredToken(token_store, token):
+    """Return the arguments of the request, the cursor and the
+    completeListSize (or None) for a resumption token.
+    """
+    if token_store is None:
+        kw, cursor = decodeResumptionToken(token)
+        completeListSize = kw.pop('completeListSize', None)
+        if completeListSize is not None:
+            try:
+                completeListSize = int(completeListSize)
+            except ValueError:
+                raise error.BadResumptionTokenError(
+                    "Unable to decode resumption token "
+                    "(bad completeListSize): %s" % token)
+        return kw, cursor, completeListSize
+    entry = token_store.get(token)
+    if entry is None:
+        raise error.BadResumptionTokenError(
+            "Unknown or expired resumption token: %s" % token)
+    state, completeListSize = entry
+    kw, cursor = decodeResumptionToken(state)
+    return kw, cursor, completeListSize
+
 def decodeResumptionToken(token):
     token = str(unquote(token))
     
@@ -477,16 +1137,38 @@ def decodeResumptionToken(token):
     # for this, and somewhat more flexible verb validation support
     return result, cursor
     
+def getResumptionTokenAttributes(token):
+    """Return the attributes of the resumptionToken element for token, as
+    (name, value) tuples.
+
+    A common.ResumptionToken can carry an expirationDate,
+    completeListSize and cursor; a plain string has none.
+    """
+    attributes = []
+    expirationDate = getattr(token, 'expirationDate', None)
+    if expirationDate is not None:
+        attributes.append(
+            ('expirationDate', datetime_to_datestamp(expirationDate)))
+    completeListSize = getattr(token, 'completeListSize', None)
+    if completeListSize is not None:
+        attributes.append(('completeListSize', str(completeListSize)))
+    cursor = getattr(token, 'cursor', None)
+    if cursor is not None:
+        attributes.append(('cursor', str(cursor)))
+    return attributes
+
+def outputResumptionToken(element, token):
+    for name, value in getResumptionTokenAttributes(token):
+        element.set(name, value)
+    element.text = token
+
 def oai_dc_writer(element, metadata):
     e_dc = SubElement(element, nsoaidc('dc'),
                       nsmap={'oai_dc': NS_OAIDC, 'dc': NS_DC, 'xsi': NS_XSI})
     e_dc.set('{%s}schemaLocation' % NS_XSI,
              '%s http://www.openarchives.org/OAI/2.0/oai_dc.xsd' % NS_DC)
     map = metadata.getMap()
-    for name in [
-        'title', 'creator', 'subject', 'description', 'publisher',
-        'contributor', 'date', 'type', 'format', 'identifier',
-        'source', 'language', 'relation', 'coverage', 'rights']:
+    for name in OAI_DC_FIELDS:
         for value in map.get(name, []):
             e = SubElement(e_dc, nsdc(name))
             e.text = value
@@ -0,0 +1,446 @@
+"""Benchmarks for the client.
+
+Run with:
+
+  $ python benchmark.py
+
+To benchmark a harvest recorded with replay.RecordingClient instead:
+
+  $ python benchmark.py archive metadataPrefix [latency] [bandwidth]
+
+To measure the memory taken by the headers of a ListIdentifiers harvest
+(on Unix):
+
+  $ python benchmark.py memory [size] [attached|detached|serialized|batches]
+
+To measure time to first byte and memory of the server, for a page of
+ListRecords rendered as a whole or streamed:
+
+  $ python benchmark.py server [size] [tree|stream]
+"""
+from __future__ import print_function
+
+import os
+import resource
+import subprocess
+import sys
+import time
+from bisect import bisect_right
+from datetime import datetime, timedelta
+from itertools import islice
+
+from oaipmh import client, common, datestamp, metadata, replay, server
+from oaipmh import tokenstore
+
+FIELDS = [
+    'title', 'creator', 'subject', 'description', 'publisher',
+    'contributor', 'date', 'type', 'format', 'identifier',
+    'source', 'language', 'relation', 'coverage', 'rights']
+
+class BenchmarkServer(object):
+    """A repository with oai_dc records that have all fields filled in.
+    """
+    def __init__(self, size):
+        self._data = []
+        for i in range(size):
+            map = dict([(name, ['%s %s' % (name, i)]) for name in FIELDS])
+            header = common.Header(
+                None, 'oai:bench:%s' % i, datetime(2004, 1, 1, 12, 0, i % 60),
+                ['set%s' % (i % 10)], False)
+            self._data.append((header, common.Metadata(None, map), None))
+
+    def identify(self):
+        return common.Identify(
+            'Benchmark', 'http://localhost/oai', '2.0', ['bench@localhost'],
+            datetime(2004, 1, 1), 'no', 'YYYY-MM-DDThh:mm:ssZ', ['identity'])
+
+    def listRecords(self, metadataPrefix, set=None, from_=None, until=None):
+        return self._data
+
+    def listIdentifiers(self, metadataPrefix, set=None, from_=None,
+                        until=None):
+        return [header for header, metadata, about in self._data]
+
+class PageClient(client.BaseClient):
+    """Client that serves the same single page over and over.
+    """
+    def __init__(self, pages, metadata_registry=None):
+        client.BaseClient.__init__(self, metadata_registry)
+        self._pages = pages
+
+    def makeRequest(self, **kw):
+        return self._pages[kw['verb']]
+
+def createPages(size):
+    registry = metadata.MetadataRegistry()
+    registry.registerWriter('oai_dc', server.oai_dc_writer)
+    oai_server = server.Server(
+        BenchmarkServer(size), registry, resumption_batch_size=size)
+    pages = {}
+    for verb in ['ListRecords', 'ListIdentifiers']:
+        pages[verb] = oai_server.handleRequest(
+            {'verb': verb, 'metadataPrefix': 'oai_dc'})
+    return pages
+
+def timeit(func, repeat):
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        count = func()
+        duration = time.time() - start
+        if best is None or duration < best:
+            best = duration
+    return count / best
+
+def benchmarkParsing(size=1000, repeat=5):
+    """Records (and headers) per second parsed by the client.
+    """
+    oai_client = PageClient(createPages(size))
+    oai_client.getMetadataRegistry().registerReader(
+        'oai_dc', metadata.oai_dc_reader)
+    def listRecords():
+        return len(list(oai_client.listRecords(metadataPrefix='oai_dc')))
+    def listIdentifiers():
+        return len(list(oai_client.listIdentifiers(metadataPrefix='oai_dc')))
+    print('ListRecords: %.0f records/sec' % timeit(listRecords, repeat))
+    def listIdentifierBatches():
+        return sum([len(batch) for batch in
+                    oai_client.listIdentifierBatches(metadataPrefix='oai_dc')])
+    print('ListIdentifiers: %.0f headers/sec' % timeit(listIdentifiers, repeat))
+    print('ListIdentifiers in batches: %.0f headers/sec' % timeit(
+        listIdentifierBatches, repeat))
+
+def benchmarkReaders(size=1000, repeat=5):
+    """Records per second parsed by the client, when only the title and
+    identifier of each record are used.
+    """
+    pages = createPages(size)
+    fields = ['title', 'identifier']
+    readers = [
+        ('eager', metadata.oai_dc_reader),
+        ('lazy', metadata.oai_dc_reader.project(FIELDS, lazy=True)),
+        ('projected', metadata.oai_dc_reader.project(fields)),
+        ]
+    for name, reader in readers:
+        registry = metadata.MetadataRegistry()
+        registry.registerReader('oai_dc', reader)
+        oai_client = PageClient(pages, registry)
+        def listRecords():
+            count = 0
+            for header, md, about in oai_client.listRecords(
+                metadataPrefix='oai_dc'):
+                for field in fields:
+                    md.getField(field)
+                count += 1
+            return count
+        print('ListRecords with %s reader: %.0f records/sec' % (
+            name, timeit(listRecords, repeat)))
+
+class PagesClient(client.BaseClient):
+    """Client that serves the same page for each resumption token, until
+    `count` pages have been served.
+    """
+    def __init__(self, page, count):
+        client.BaseClient.__init__(self)
+        self._page = page
+        self._count = count
+
+    def makeRequest(self, **kw):
+        self._count -= 1
+        if self._count:
+            return self._page
+        return self._page.replace(b'<resumptionToken', b'<foo').replace(
+            b'</resumptionToken>', b'</foo>')
+
+def measureMemory(size=100000, mode='attached'):
+    """Kilobytes of memory taken by holding on to the headers of a
+    ListIdentifiers harvest of size records, in pages of 1000.
+    """
+    page_size = 1000
+    registry = metadata.MetadataRegistry()
+    oai_server = server.Server(
+        BenchmarkServer(2 * page_size), registry,
+        resumption_batch_size=page_size)
+    page = oai_server.handleRequest(
+        {'verb': 'ListIdentifiers', 'metadataPrefix': 'oai_dc'})
+    oai_client = PagesClient(page, size // page_size)
+    if mode == 'batches':
+        before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        batches = list(oai_client.listIdentifierBatches(
+            metadataPrefix='oai_dc'))
+        after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return sum([len(batch) for batch in batches]), after - before
+    if mode != 'attached':
+        oai_client.setDetached(True, serialize=(mode == 'serialized'))
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    headers = list(oai_client.listIdentifiers(metadataPrefix='oai_dc'))
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return len(headers), after - before
+
+def benchmarkMemory(size=100000):
+    """Memory taken by the headers of a ListIdentifiers harvest, measured
+    in a separate process for each mode.
+    """
+    for mode in ['attached', 'detached', 'serialized', 'batches']:
+        output = subprocess.check_output(
+            [sys.executable, __file__, 'memory', str(size), mode])
+        print('%s headers: %s' % (mode, output.decode('ascii').strip()))
+
+def createServer(size):
+    registry = metadata.MetadataRegistry()
+    registry.registerWriter('oai_dc', server.oai_dc_writer)
+    return server.Server(
+        BenchmarkServer(size), registry, resumption_batch_size=size)
+
+def measureServer(size=10000, mode='tree'):
+    """Seconds until the first chunk of a page of size records is
+    produced, seconds until the whole page is produced and kilobytes
+    of memory taken while doing so.
+    """
+    oai_server = createServer(size)
+    request = {'verb': 'ListRecords', 'metadataPrefix': 'oai_dc'}
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    if mode == 'stream':
+        chunks = oai_server.handleRequestStreaming(request)
+    else:
+        chunks = iter([oai_server.handleRequest(request)])
+    first = None
+    for chunk in chunks:
+        if first is None:
+            first = time.time() - start
+    total = time.time() - start
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return first, total, after - before
+
+def benchmarkResponses(repeat=5, count=2000):
+    """Small responses per second produced by the server, which shows
+    the fixed cost of a response.
+    """
+    oai_server = createServer(1)
+    for verb in ['ListIdentifiers', 'Identify']:
+        request = {'verb': verb}
+        if verb == 'ListIdentifiers':
+            request['metadataPrefix'] = 'oai_dc'
+        def respond():
+            for i in range(count):
+                oai_server.handleRequest(request)
+            return count
+        print('%s: %.0f responses/sec' % (
+            verb, timeit(respond, repeat)))
+
+def benchmarkRendering(size=1000, repeat=5):
+    """Records (and headers) per second rendered by the server, from
+    trees and from templates.
+    """
+    oai_server = createServer(size)
+    for templates in [False, True]:
+        oai_server.setTemplateRendering(templates)
+        for verb in ['ListRecords', 'ListIdentifiers']:
+            request = {'verb': verb, 'metadataPrefix': 'oai_dc'}
+            def render():
+                oai_server.handleRequest(request)
+                return size
+            print('%s from %s: %.0f items/sec' % (
+                verb, templates and 'templates' or 'trees',
+                timeit(render, repeat)))
+
+def benchmarkResumption(size=10000, batch_size=100, repeat=3):
+    """Items per second harvested from a Resumption, which queries the
+    server again for each batch unless it has a ResultCache.
+    """
+    oai_server = BenchmarkServer(size)
+    for name, cache in [('without', None), ('with', server.ResultCache())]:
+        resumption = server.Resumption(oai_server, batch_size, cache)
+        def harvest():
+            count = 0
+            result, token = resumption.listIdentifiers(
+                metadataPrefix='oai_dc')
+            count += len(result)
+            while token is not None:
+                result, token = resumption.listIdentifiers(
+                    resumptionToken=token)
+                count += len(result)
+            if cache is not None:
+                cache.clear()
+            return count
+        print('Resumption %s result cache: %.0f headers/sec' % (
+            name, timeit(harvest, repeat)))
+
+class GeneratingServer(object):
+    """A repository that creates its headers while they are listed.
+    """
+    def __init__(self, size):
+        self._size = size
+
+    def listIdentifiers(self, metadataPrefix, set=None, from_=None,
+                        until=None):
+        for i in range(self._size):
+            yield common.Header(
+                None, 'oai:bench:%s' % i, datetime(2004, 1, 1, 12, 0, i % 60),
+                ['set%s' % (i % 10)], False)
+
+def benchmarkLazyResumption(size=100000, batch_size=100):
+    """Peak memory of Python objects while a Resumption serves the first
+    batch of a result that its server produces lazily.
+    """
+    import tracemalloc
+    resumption = server.Resumption(GeneratingServer(size), batch_size)
+    tracemalloc.start()
+    resumption.listIdentifiers(metadataPrefix='oai_dc')
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print('First batch of %s lazily produced headers: %.0f KB peak' % (
+        size, peak / 1024.0))
+
+def benchmarkTokenStore(size=10000, batch_size=10, repeat=3):
+    """Headers per second harvested from a Resumption with resumption
+    tokens that hold the request or are kept in a token store, and the
+    length of the tokens.
+    """
+    import shutil
+    import tempfile
+    directory = tempfile.mkdtemp()
+    try:
+        oai_server = BenchmarkServer(size)
+        for name, store in [
+            ('none', None),
+            ('memory', tokenstore.MemoryTokenStore()),
+            ('SQLite', tokenstore.SQLiteTokenStore(
+                os.path.join(directory, 'tokens.db')))]:
+            resumption = server.Resumption(
+                oai_server, batch_size, server.ResultCache(), store)
+            tokens = []
+            def harvest():
+                count = 0
+                result, token = resumption.listIdentifiers(
+                    metadataPrefix='oai_dc', from_=datetime(2004, 1, 1))
+                count += len(result)
+                while token is not None:
+                    tokens.append(token)
+                    result, token = resumption.listIdentifiers(
+                        resumptionToken=token)
+                    count += len(result)
+                return count
+            print('Token store %s: %.0f headers/sec, tokens of %s '
+                  'characters' % (name, timeit(harvest, repeat),
+                                  len(tokens[-1])))
+    finally:
+        shutil.rmtree(directory)
+
+class SortedServer(object):
+    """A repository with its headers in an index sorted by datestamp and
+    identifier, where like in a database a cursor costs a scan of the
+    index up to it and a continuation costs a seek.
+    """
+    def __init__(self, size):
+        self._headers = [common.Header(
+            None, 'oai:bench:%08d' % i, datetime(2004, 1, 1) +
+            timedelta(seconds=i), [], False) for i in range(size)]
+        self._keys = [(header.datestamp(), header.identifier())
+                      for header in self._headers]
+
+    def listIdentifiers(self, metadataPrefix, set=None, from_=None,
+                        until=None, cursor=None, batch_size=10, after=None):
+        if cursor is not None:
+            index = iter(self._headers)
+            for i in range(cursor):
+                next(index)
+            return list(islice(index, batch_size))
+        start = 0
+        if after is not None:
+            start = bisect_right(self._keys, after)
+        return self._headers[start:start + batch_size]
+
+def benchmarkKeyset(size=20000, batch_size=100, repeat=3):
+    """Headers per second harvested from a BatchingResumption, asking
+    for batches at a cursor or after a continuation.
+    """
+    oai_server = SortedServer(size)
+    for keyset in [False, True]:
+        resumption = server.BatchingResumption(
+            oai_server, batch_size, keyset)
+        def harvest():
+            count = 0
+            result, token = resumption.listIdentifiers(
+                metadataPrefix='oai_dc')
+            count += len(result)
+            while token is not None:
+                result, token = resumption.listIdentifiers(
+                    resumptionToken=token)
+                count += len(result)
+            return count
+        print('Batches %s: %.0f headers/sec' % (
+            keyset and 'after continuation' or 'at cursor',
+            timeit(harvest, repeat)))
+
+def benchmarkServer(sizes=(1000, 10000)):
+    """Time to first byte and memory of the server, measured in a
+    separate process for each page size and mode.
+    """
+    for size in sizes:
+        for mode in ['tree', 'stream']:
+            output = subprocess.check_output(
+                [sys.executable, __file__, 'server', str(size), mode])
+            print('%s records, %s: %s' % (
+                size, mode, output.decode('ascii').strip()))
+
+def benchmarkDatestamps(size=100000, distinct=100, repeat=5):
+    """Datestamps per second converted, all different or mostly the same.
+    """
+    dts = [datetime(2004, 1, 1) + timedelta(seconds=i * 37)
+           for i in range(size)]
+    shared = dts[:distinct] * (size // distinct)
+    for name, values in [('unique', dts), ('shared', shared)]:
+        datestamps = datestamp.datetimes_to_datestamps(values)
+        def parse():
+            return len(datestamp.datestamps_to_datetimes(datestamps))
+        def format():
+            return len(datestamp.datetimes_to_datestamps(values))
+        print('Parse %s datestamps: %.0f/sec' % (name, timeit(parse, repeat)))
+        print('Format %s datestamps: %.0f/sec' % (
+            name, timeit(format, repeat)))
+
+def benchmarkReplay(path, metadataPrefix, latency=0, bandwidth=None,
+                    repeat=3):
+    """Records per second harvested from a recorded harvest.
+    """
+    registry = metadata.MetadataRegistry()
+    registry.registerReader('oai_dc', metadata.oai_dc_reader)
+    oai_client = replay.ReplayClient(path, registry, latency, bandwidth)
+    def listRecords():
+        return len(list(oai_client.listRecords(
+            metadataPrefix=metadataPrefix)))
+    print('Replayed ListRecords: %.0f records/sec' % timeit(
+        listRecords, repeat))
+    oai_client.close()
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['memory']:
+        if len(sys.argv) > 3:
+            count, kilobytes = measureMemory(int(sys.argv[2]), sys.argv[3])
+            print('%s headers, %.0f bytes/header' % (
+                count, kilobytes * 1024.0 / count))
+        else:
+            benchmarkMemory(*[int(arg) for arg in sys.argv[2:3]])
+    elif sys.argv[1:2] == ['server']:
+        if len(sys.argv) > 3:
+            first, total, kilobytes = measureServer(
+                int(sys.argv[2]), sys.argv[3])
+            print('first chunk %.3fs, complete %.3fs, %.0f KB' % (
+                first, total, kilobytes))
+        else:
+            benchmarkServer(*[(int(arg),) for arg in sys.argv[2:3]])
+    elif len(sys.argv) > 2:
+        benchmarkReplay(*([sys.argv[1], sys.argv[2]] +
+                          [float(arg) for arg in sys.argv[3:5]]))
+    else:
+        benchmarkParsing()
+        benchmarkReaders()
+        benchmarkDatestamps()
+        benchmarkResponses()
+        benchmarkRendering()
+        benchmarkResumption()
+        benchmarkLazyResumption()
+        benchmarkKeyset()
+        benchmarkTokenStore()
@@ -39,6 +39,17 @@ class GranularityFakeClient(client.BaseClient):
             datetime(2005, 1, 1), 'no', self._granularity,
             None)
 
+class RecordingServerClient(client.ServerClient):
+    """A ServerClient that records the arguments of its requests.
+    """
+    def __init__(self, server, metadata_registry):
+        client.ServerClient.__init__(self, server, metadata_registry)
+        self.requests = []
+
+    def makeRequest(self, **kw):
+        self.requests.append(kw)
+        return client.ServerClient.makeRequest(self, **kw)
+
 def getRequestKey(kw):
     """Create stable key for request dictionary to use in file.
     """
@@ -73,6 +84,10 @@ class FakeCreaterClient(client.Client):
         self._mapping[getRequestKey(kw)] = text
         return text
 
+    def makeRequestChunks(self, **kw):
+        # responses are saved as a whole
+        return [self.makeRequest(**kw)]
+
     def save(self):
         mapping_path = self._mapping_path
         f = open(os.path.join(mapping_path, 'mapping.txt'), 'w')
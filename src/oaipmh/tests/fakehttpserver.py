@@ -0,0 +1,143 @@
+import os
+import threading
+import zlib
+
+from six.moves import BaseHTTPServer, socketserver
+from six.moves.urllib.parse import parse_qs, urlsplit
+
+from fakeclient import createMapping, getRequestKey
+
+IDENTIFY = b'''<?xml version="1.0" encoding="UTF-8"?>
+<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/">
+  <responseDate>2005-01-01T00:00:00Z</responseDate>
+  <request verb="Identify">http://localhost/oai</request>
+  <Identify>
+    <repositoryName>Test</repositoryName>
+    <baseURL>http://localhost/oai</baseURL>
+    <protocolVersion>2.0</protocolVersion>
+    <adminEmail>test@example.com</adminEmail>
+    <earliestDatestamp>2005-01-01T00:00:00Z</earliestDatestamp>
+    <deletedRecord>no</deletedRecord>
+    <granularity>YYYY-MM-DDThh:mm:ssZ</granularity>
+  </Identify>
+</OAI-PMH>'''
+
+ERROR = b'''<?xml version="1.0" encoding="UTF-8"?>
+<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/">
+  <responseDate>2005-01-01T00:00:00Z</responseDate>
+  <request>http://localhost/oai</request>
+  <error code="badArgument">Try again later</error>
+</OAI-PMH>'''
+
+HTML = b'<html><body><h1>Service unavailable</h1>'
+
+class OAIHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Serves IDENTIFY, or the responses of a fake mapping if the request
+    has arguments.
+
+    Some paths trigger special behaviour:
+
+    /drop - drop the connection after the response without telling
+    /error - respond with HTTP 500
+    /busy - respond with HTTP 503, retry after 0 seconds
+    /chunked - use chunked transfer encoding
+    /html - respond with a broken HTML page
+    /oai-error - respond with an OAI-PMH error
+    /redirect - redirect to /oai with HTTP 302, keeping the query
+    /see-other - redirect to /oai with HTTP 303, keeping the query
+    /loop - redirect to itself
+    /gzip - gzip compress the response if the client accepts it
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.handle_oai(urlsplit(self.path).query)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length'))
+        query = self.rfile.read(length).decode('ascii')
+        self.server.posted.append(parse_qs(query))
+        self.handle_oai(query)
+
+    def handle_oai(self, query):
+        self.server.connections.add(self.client_address)
+        self.server.requests.append(self.path)
+        path = urlsplit(self.path).path
+        if path == '/drop':
+            self.close_connection = True
+        if path in ('/error', '/busy'):
+            self.send_response(path == '/error' and 500 or 503)
+            self.send_header('Retry-After', '0')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if path in ('/redirect', '/see-other', '/loop'):
+            location = path == '/loop' and '/loop' or '/oai'
+            if urlsplit(self.path).query:
+                location += '?' + urlsplit(self.path).query
+            self.send_response(path == '/see-other' and 303 or 302)
+            self.send_header('Location', location)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if path == '/html':
+            body = HTML
+        elif path == '/oai-error':
+            body = ERROR
+        elif query:
+            kw = dict([(key, value[0]) for key, value in
+                       parse_qs(query).items()])
+            body = self.server.mapping[getRequestKey(kw)].encode('utf-8')
+        else:
+            body = IDENTIFY
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/xml')
+        if (path == '/gzip' and
+            'gzip' in self.headers.get('Accept-Encoding', '')):
+            compressor = zlib.compressobj(
+                6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            body = compressor.compress(body) + compressor.flush()
+            self.server.compressed += 1
+            self.send_header('Content-Encoding', 'gzip')
+        if path == '/chunked':
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for i in range(0, len(body), 100):
+                chunk = body[i:i + 100]
+                self.wfile.write(('%x\r\n' % len(chunk)).encode('ascii'))
+                self.wfile.write(chunk + b'\r\n')
+            self.wfile.write(b'0\r\n\r\n')
+            return
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+class OAIHTTPServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, mapping_path=None):
+        BaseHTTPServer.HTTPServer.__init__(
+            self, ('127.0.0.1', 0), OAIHandler)
+        if mapping_path is None:
+            mapping_path = os.path.join(os.path.dirname(__file__), 'fake1')
+        self.mapping = createMapping(mapping_path)
+        self.connections = set()
+        self.posted = []
+        self.requests = []
+        self.compressed = 0
+
+    def url(self, path='/oai'):
+        return 'http://127.0.0.1:%s%s' % (self.server_address[1], path)
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever,
+                                  kwargs={'poll_interval': 0.05})
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
@@ -120,3 +120,37 @@ class FakeServerWithDeletions(FakeServerBase):
                          None))
         # replace first half with deleted records
         self._data = data + self._data[6:]
+
+class SetFakeServer(FakeServerCommon):
+    """Records 0 to 29, in the sets 'even' or 'odd', and in 'three' if
+    they are a multiple of three. The set 'empty' has no records.
+    """
+    def __init__(self):
+        self._data = []
+        for i in range(30):
+            setspec = [i % 2 and 'odd' or 'even']
+            if i % 3 == 0:
+                setspec.append('three')
+            header = common.Header(
+                None, str(i), datetime(2004, 1, 1, 0, 0, i), setspec, False)
+            self._data.append(
+                (header, common.Metadata(None, {'title': ['Title %s' % i]}),
+                 None))
+
+    def listSets(self):
+        return [('even', 'Even', None), ('odd', 'Odd', None),
+                ('three', 'Three', None), ('empty', 'Empty', None)]
+
+    def listIdentifiers(self, metadataPrefix=None, from_=None, until=None,
+                        set=None):
+        return [header for header, metadata, about in
+                self.listRecords(metadataPrefix, from_, until, set)]
+
+    def listRecords(self, metadataPrefix=None, from_=None, until=None,
+                    set=None):
+        result = []
+        for header, metadata, about in self._data:
+            if (datestampInRange(header, from_, until) and
+                (set is None or set in header.setSpec())):
+                result.append((header, metadata, about))
+        return result
@@ -1,3 +1,3 @@
 #!/bin/bash
 
-python -m unittest test_broken test_client test_datestamp test_deleted_records test_server test_validation
\ No newline at end of file
+python -m unittest test_asyncclient test_broken test_cache test_checkpoint test_client test_connection test_datestamp test_deleted_records test_harvest test_incremental test_replay test_server test_tokenstore test_validation test_wsgi
\ No newline at end of file
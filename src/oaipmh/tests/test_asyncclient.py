@@ -0,0 +1,182 @@
+import os
+import unittest
+from datetime import datetime
+
+from fakeclient import FakeClient
+from fakehttpserver import OAIHTTPServer
+from oaipmh import client, metadata, validation
+
+try:
+    import asyncio
+    from oaipmh import asyncclient
+except (ImportError, SyntaxError):
+    asyncclient = None
+
+directory = os.path.dirname(__file__)
+fake1 = os.path.join(directory, 'fake1')
+fakeclient = FakeClient(fake1)
+fakeclient.getMetadataRegistry().registerReader(
+    'oai_dc', metadata.oai_dc_reader)
+
+def run(awaitable):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(awaitable)
+    finally:
+        loop.close()
+
+def collect(generator):
+    """Collect the items of an asynchronous generator in a list.
+    """
+    loop = asyncio.new_event_loop()
+    result = []
+    try:
+        while 1:
+            try:
+                result.append(loop.run_until_complete(generator.__anext__()))
+            except StopAsyncIteration:
+                break
+    finally:
+        loop.close()
+    return result
+
+if asyncclient is not None:
+    class AsyncFakeClient(asyncclient.AsyncBaseClient):
+        def __init__(self, mapping_path):
+            asyncclient.AsyncBaseClient.__init__(self)
+            self._fake = FakeClient(mapping_path)
+
+        def makeRequest(self, **kw):
+            future = asyncio.get_event_loop().create_future()
+            future.set_result(self._fake.makeRequest(**kw))
+            return future
+
+@unittest.skipIf(asyncclient is None, "asyncio client requires Python 3.6")
+class AsyncClientTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.client = AsyncFakeClient(fake1)
+        self.client.getMetadataRegistry().registerReader(
+            'oai_dc', metadata.oai_dc_reader)
+
+    def test_identify(self):
+        identify = run(self.client.identify())
+        self.assertEqual('http://dspace.ubib.eur.nl/oai/', identify.baseURL())
+
+    def test_getRecord(self):
+        header, metadata, about = run(self.client.getRecord(
+            metadataPrefix='oai_dc', identifier='hdl:1765/315'))
+        self.assertEqual('hdl:1765/315', header.identifier())
+
+    def test_listRecords(self):
+        records = collect(self.client.listRecords(
+            from_=datetime(2003, 4, 10), metadataPrefix='oai_dc'))
+        expected = list(fakeclient.listRecords(
+            from_=datetime(2003, 4, 10), metadataPrefix='oai_dc'))
+        self.assertEqual(
+            [(header.identifier(), header.datestamp(), metadata.getMap())
+             for header, metadata, about in expected],
+            [(header.identifier(), header.datestamp(), metadata.getMap())
+             for header, metadata, about in records])
+
+    def test_listIdentifiers(self):
+        headers = collect(self.client.listIdentifiers(
+            from_=datetime(2003, 4, 10), metadataPrefix='oai_dc'))
+        self.assertEqual(16, len(headers))
+
+    def test_listSets(self):
+        self.assertEqual(list(fakeclient.listSets()),
+                         collect(self.client.listSets()))
+
+    def test_listMetadataFormats(self):
+        self.assertEqual(fakeclient.listMetadataFormats(),
+                         run(self.client.listMetadataFormats()))
+
+    def test_updateGranularity(self):
+        run(self.client.updateGranularity())
+        self.assertFalse(self.client.getDayGranularity())
+
+    def test_argument_error(self):
+        self.assertRaises(validation.BadArgumentError,
+                          self.client.listIdentifiers, foo='bar')
+
+@unittest.skipIf(asyncclient is None, "asyncio client requires Python 3.6")
+class AsyncHTTPClientTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.server = OAIHTTPServer()
+        self.server.start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_post(self):
+        oaiclient = asyncclient.AsyncClient(self.server.url())
+        oaiclient.getMetadataRegistry().registerReader(
+            'oai_dc', metadata.oai_dc_reader)
+        records = collect(oaiclient.listRecords(
+            from_=datetime(2003, 4, 10), metadataPrefix='oai_dc'))
+        self.assertEqual(16, len(records))
+        self.assertEqual(
+            [{'verb': ['ListRecords'], 'metadataPrefix': ['oai_dc'],
+              'from': ['2003-04-10T00:00:00Z']}], self.server.posted)
+
+    def test_get_chunked(self):
+        oaiclient = asyncclient.AsyncClient(
+            self.server.url('/chunked'), force_http_get=True)
+        identify = run(oaiclient.identify())
+        self.assertEqual('http://dspace.ubib.eur.nl/oai/', identify.baseURL())
+
+    def test_retry(self):
+        oaiclient = asyncclient.AsyncClient(
+            self.server.url('/busy'), custom_retry_policy={'retry': 3})
+        self.assertRaises(client.Error, run, oaiclient.identify())
+        self.assertEqual(3, len(self.server.requests))
+
+    def test_http_error(self):
+        import urllib.error
+        oaiclient = asyncclient.AsyncClient(self.server.url('/error'))
+        self.assertRaises(urllib.error.HTTPError, run, oaiclient.identify())
+        self.assertEqual(1, len(self.server.requests))
+
+    def test_redirect(self):
+        oaiclient = asyncclient.AsyncClient(self.server.url('/redirect'))
+        identify = run(oaiclient.identify())
+        self.assertEqual('http://dspace.ubib.eur.nl/oai/', identify.baseURL())
+        # the request is repeated as it was
+        self.assertEqual(['/redirect', '/oai'], self.server.requests)
+        self.assertEqual(2, len(self.server.posted))
+
+    def test_redirect_get(self):
+        oaiclient = asyncclient.AsyncClient(
+            self.server.url('/redirect'), force_http_get=True)
+        run(oaiclient.identify())
+        self.assertEqual('/oai?verb=Identify', self.server.requests[-1])
+
+    def test_see_other(self):
+        oaiclient = asyncclient.AsyncClient(self.server.url('/see-other'))
+        run(oaiclient.identify())
+        # followed with GET, without the arguments
+        self.assertEqual(['/see-other', '/oai'], self.server.requests)
+        self.assertEqual(1, len(self.server.posted))
+
+    def test_redirect_loop(self):
+        oaiclient = asyncclient.AsyncClient(self.server.url('/loop'))
+        self.assertRaises(client.Error, run, oaiclient.identify())
+        self.assertEqual(asyncclient.MAX_REDIRECTS + 1,
+                         len(self.server.requests))
+
+    def test_compression(self):
+        oaiclient = asyncclient.AsyncClient(
+            self.server.url('/gzip'), use_compression=True)
+        identify = run(oaiclient.identify())
+        self.assertEqual('http://dspace.ubib.eur.nl/oai/', identify.baseURL())
+        self.assertEqual(1, self.server.compressed)
+
+def test_suite():
+    return unittest.TestSuite([
+        unittest.makeSuite(AsyncClientTestCase),
+        unittest.makeSuite(AsyncHTTPClientTestCase)])
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
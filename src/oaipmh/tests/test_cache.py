@@ -0,0 +1,148 @@
+import os
+import shutil
+import tempfile
+import time
+from datetime import datetime
+from unittest import TestCase, TestSuite, makeSuite, main
+
+from fakehttpserver import OAIHTTPServer
+from oaipmh import cache, error, metadata
+
+class ResponseCacheTestCase(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_ttl(self):
+        responses = cache.ResponseCache(
+            self.directory, ttls={'ListRecords': 60})
+        responses.put('a', 'ListRecords', b'<a/>')
+        responses.put('b', 'ListIdentifiers', b'<b/>')
+        self.assertEqual(b'<a/>', responses.get('a', 'ListRecords'))
+        self.assertEqual(None, responses.get('b', 'ListIdentifiers'))
+        self.assertEqual(['.xml'], [os.path.splitext(name)[1]
+                                    for name in os.listdir(self.directory)])
+        # make it older than the TTL
+        path = os.path.join(self.directory, os.listdir(self.directory)[0])
+        past = time.time() - 120
+        os.utime(path, (past, past))
+        self.assertEqual(None, responses.get('a', 'ListRecords'))
+
+    def test_forever(self):
+        responses = cache.ResponseCache(
+            self.directory, ttls={'ListRecords': None})
+        responses.put('a', 'ListRecords', b'<a/>')
+        path = os.path.join(self.directory, os.listdir(self.directory)[0])
+        os.utime(path, (0, 0))
+        self.assertEqual(b'<a/>', responses.get('a', 'ListRecords'))
+
+    def test_eviction(self):
+        responses = cache.ResponseCache(self.directory, max_size=10)
+        responses.put('a', 'Identify', b'aaaa')
+        responses.put('b', 'Identify', b'bbbb')
+        # a is now used more recently than b
+        self.assertEqual(b'aaaa', responses.get('a', 'Identify'))
+        responses.put('c', 'Identify', b'cccc')
+        self.assertEqual(8, responses.size())
+        self.assertEqual(2, len(os.listdir(self.directory)))
+        self.assertEqual(None, responses.get('b', 'Identify'))
+        self.assertEqual(b'aaaa', responses.get('a', 'Identify'))
+        self.assertEqual(b'cccc', responses.get('c', 'Identify'))
+
+    def test_stale_tmp_files(self):
+        for name, age in [('old.tmp', 2 * 60 * 60), ('new.tmp', 0)]:
+            path = os.path.join(self.directory, name)
+            with open(path, 'wb') as f:
+                f.write(b'<a')
+            past = time.time() - age
+            os.utime(path, (past, past))
+        cache.ResponseCache(self.directory)
+        # files that may still be written by another process are kept
+        self.assertEqual(['new.tmp'], os.listdir(self.directory))
+
+    def test_reopen(self):
+        responses = cache.ResponseCache(self.directory)
+        responses.put('a', 'Identify', b'aaaa')
+        responses.put('a', 'Identify', b'aaaaaa')
+        responses = cache.ResponseCache(self.directory)
+        self.assertEqual(6, responses.size())
+        self.assertEqual(b'aaaaaa', responses.get('a', 'Identify'))
+        responses.clear()
+        self.assertEqual(0, responses.size())
+        self.assertEqual([], os.listdir(self.directory))
+
+class CachingClientTestCase(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.server = OAIHTTPServer()
+        self.server.start()
+        self.registry = metadata.MetadataRegistry()
+        self.registry.registerReader('oai_dc', metadata.oai_dc_reader)
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.directory)
+
+    def createClient(self, **ttls):
+        return cache.CachingClient(
+            self.server.url(), cache.ResponseCache(self.directory, ttls),
+            self.registry)
+
+    def test_identify(self):
+        oai_client = self.createClient()
+        self.assertEqual('http://dspace.ubib.eur.nl/oai/',
+                         oai_client.identify().baseURL())
+        self.assertEqual('http://dspace.ubib.eur.nl/oai/',
+                         oai_client.identify().baseURL())
+        self.assertEqual(1, len(self.server.requests))
+
+    def test_listRecords(self):
+        def harvest(oai_client):
+            return [header.identifier() for header, metadata, about in
+                    oai_client.listRecords(from_=datetime(2003, 4, 10),
+                                           metadataPrefix='oai_dc')]
+        expected = harvest(self.createClient())
+        self.assertEqual(16, len(expected))
+        requests = len(self.server.requests)
+        # not cached by default
+        self.assertEqual(expected, harvest(self.createClient()))
+        self.assertEqual(2 * requests, len(self.server.requests))
+        self.assertEqual(expected, harvest(self.createClient(
+            ListRecords=None)))
+        self.assertEqual(3 * requests, len(self.server.requests))
+        self.assertEqual(expected, harvest(self.createClient(
+            ListRecords=None)))
+        self.assertEqual(3 * requests, len(self.server.requests))
+
+    def test_not_cached(self):
+        for path, exception in [('/html', error.XMLSyntaxError),
+                                ('/oai-error', error.BadArgumentError)]:
+            oai_client = cache.CachingClient(
+                self.server.url(path), cache.ResponseCache(self.directory))
+            for i in range(2):
+                self.assertRaises(exception, oai_client.identify)
+            self.assertEqual([], os.listdir(self.directory))
+        self.assertEqual(4, len(self.server.requests))
+
+    def test_shared(self):
+        responses = cache.ResponseCache(self.directory)
+        other = OAIHTTPServer()
+        other.start()
+        try:
+            for url in [self.server.url(), other.url()]:
+                cache.CachingClient(url, responses).identify()
+        finally:
+            other.stop()
+        self.assertEqual(1, len(self.server.requests))
+        self.assertEqual(1, len(other.requests))
+
+def test_suite():
+    return TestSuite((makeSuite(ResponseCacheTestCase),
+                      makeSuite(CachingClientTestCase)))
+
+if __name__ == '__main__':
+    main()
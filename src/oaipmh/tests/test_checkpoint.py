@@ -0,0 +1,118 @@
+import os
+import shutil
+import tempfile
+from datetime import datetime
+from unittest import TestCase, TestSuite, makeSuite, main
+
+import fakeserver
+from fakeclient import RecordingServerClient
+from oaipmh import checkpoint, metadata, server
+
+class TestError(Exception):
+    pass
+
+class FileCheckpointTestCase(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.fake_server = fakeserver.FakeServer()
+        registry = metadata.MetadataRegistry()
+        registry.registerWriter('oai_dc', server.oai_dc_writer)
+        registry.registerReader('oai_dc', metadata.oai_dc_reader)
+        self.client = RecordingServerClient(
+            server.Server(self.fake_server, registry,
+                          resumption_batch_size=7),
+            registry)
+        self.store = self.createStore()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def createStore(self):
+        return checkpoint.FileCheckpointStore(
+            os.path.join(self.directory, 'checkpoints.json'))
+
+    def harvest(self, fail_after=None, **kw):
+        handled = []
+        def callback(record):
+            if fail_after is not None and len(handled) == fail_after:
+                raise TestError
+            handled.append(record[0].identifier())
+        harvest = checkpoint.CheckpointedHarvest(self.client, self.store)
+        count = harvest.harvest(
+            'repo', 'ListRecords', callback, metadataPrefix='oai_dc', **kw)
+        return count, handled
+
+    def test_harvest(self):
+        count, handled = self.harvest()
+        self.assertEqual(100, count)
+        self.assertEqual([str(i) for i in range(100)], handled)
+        self.assertEqual(None, self.store.load('repo'))
+
+    def test_resume(self):
+        self.assertRaises(TestError, self.harvest, fail_after=10)
+        saved = self.store.load('repo')
+        self.assertEqual(7, saved.count)
+        self.assertTrue(saved.token is not None)
+        self.assertEqual(datetime(2004, 7, 7, 6, 6, 6), saved.datestamp)
+        self.client.requests = []
+        count, handled = self.harvest()
+        self.assertEqual(100, count)
+        self.assertEqual([str(i) for i in range(7, 100)], handled)
+        self.assertEqual(saved.token,
+                         self.client.requests[0]['resumptionToken'])
+        self.assertEqual(None, self.store.load('repo'))
+
+    def test_bad_token(self):
+        self.store.save('repo', checkpoint.Checkpoint(
+            'foobar', None, datetime(2004, 6, 1), 50))
+        count, handled = self.harvest()
+        # the list is not ordered by datestamp, so all of it is handled
+        # again
+        self.assertEqual([str(i) for i in range(100)], handled)
+        self.assertEqual(100, count)
+
+    def test_resume_bad_token(self):
+        self.assertRaises(TestError, self.harvest, fail_after=7)
+        saved = self.store.load('repo')
+        saved.token = 'foobar'
+        self.store.save('repo', saved)
+        count, handled = self.harvest()
+        # none of the records after the checkpoint are skipped
+        self.assertEqual([str(i) for i in range(100)], handled)
+        self.assertEqual(100, count)
+
+    def test_expired_token(self):
+        self.store.save('repo', checkpoint.Checkpoint(
+            'foobar', datetime(2004, 1, 1), datetime(2004, 6, 1), 50))
+        count, handled = self.harvest(from_=datetime(2004, 3, 1))
+        self.assertEqual('2004-03-01T00:00:00Z',
+                         self.client.requests[0]['from'])
+        self.assertFalse('resumptionToken' in self.client.requests[0])
+        expected = [header.identifier() for header in
+                    self.fake_server.listIdentifiers(
+                        from_=datetime(2004, 3, 1))]
+        self.assertEqual(expected, handled)
+        self.assertEqual(len(expected), count)
+
+class SQLiteCheckpointTestCase(FileCheckpointTestCase):
+
+    def createStore(self):
+        return checkpoint.SQLiteCheckpointStore(
+            os.path.join(self.directory, 'checkpoints.db'))
+
+    def test_shared(self):
+        self.store.save('repo', checkpoint.Checkpoint(
+            'foo', datetime(2005, 1, 1), None, 7))
+        saved = self.createStore().load('repo')
+        self.assertEqual('foo', saved.token)
+        self.assertEqual(datetime(2005, 1, 1), saved.expirationDate)
+        self.assertEqual(None, saved.datestamp)
+        self.assertEqual(7, saved.count)
+
+def test_suite():
+    return TestSuite((makeSuite(FileCheckpointTestCase),
+                      makeSuite(SQLiteCheckpointTestCase)))
+
+if __name__ == '__main__':
+    main()
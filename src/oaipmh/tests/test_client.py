@@ -6,6 +6,7 @@ except ImportError:  # python < 3.3
 
 from fakeclient import FakeClient, GranularityFakeClient, TestError
 import os
+import time
 from datetime import datetime
 try:
     import urllib.request as urllib2
@@ -14,7 +15,15 @@ except ImportError:
     import urllib2
     URLOPEN_PATH = 'urllib2.urlopen'
 
-from oaipmh import common, metadata, validation, client
+from oaipmh import common, metadata, validation, client, error
+
+import gzip
+import re
+import zlib
+from io import BytesIO
+from six.moves.urllib.parse import parse_qs
+from six.moves.urllib.response import addinfourl
+from lxml import etree
 
 directory = os.path.dirname(__file__)
 fake1 = os.path.join(directory, 'fake1')
@@ -28,6 +37,48 @@ def http_error(code):
     return urllib2.HTTPError('mock-url', code, 'error', {}, None)
 
 
+def gzip_compress(data):
+    f = BytesIO()
+    gzip_f = gzip.GzipFile(fileobj=f, mode='wb')
+    gzip_f.write(data)
+    gzip_f.close()
+    return f.getvalue()
+
+
+class CompressingServer(object):
+    """Fake urlopen that serves the fake1 responses compressed.
+    """
+    def __init__(self, compressions, broken_identifies=0):
+        self.compressions = compressions
+        # number of Identify requests answered with a broken response
+        self.broken_identifies = broken_identifies
+        self.requests = []
+
+    def __call__(self, request):
+        self.requests.append(request)
+        kw = dict((key, value[0]) for key, value in
+                  parse_qs(request.data.decode('ascii')).items())
+        body = fakeclient.makeRequest(**kw).encode('utf-8')
+        if kw['verb'] == 'Identify' and self.broken_identifies:
+            self.broken_identifies -= 1
+            return addinfourl(BytesIO(b'<html>'), {}, request.get_full_url())
+        if kw['verb'] == 'Identify':
+            advertised = ''.join(['<compression>%s</compression>' % c
+                                  for c in self.compressions])
+            body = re.sub(b'(<compression>[^<]*</compression>)+',
+                          advertised.encode('ascii'), body)
+            return addinfourl(BytesIO(body), {}, request.get_full_url())
+        accepted = request.get_header('Accept-encoding') or ''
+        headers = {}
+        if 'gzip' in accepted:
+            body = gzip_compress(body)
+            headers['Content-Encoding'] = 'gzip'
+        elif 'deflate' in accepted:
+            body = zlib.compress(body)
+            headers['Content-Encoding'] = 'deflate'
+        return addinfourl(BytesIO(body), headers, request.get_full_url())
+
+
 class ClientTestCase(TestCase):
 
     def test_getRecord(self):
@@ -168,6 +219,7 @@ class ClientTestCase(TestCase):
     def test_day_granularity(self):
         fakeclient = GranularityFakeClient(granularity='YYYY-MM-DDThh:mm:ssZ')
         fakeclient.updateGranularity()
+        self.assertFalse(fakeclient.getDayGranularity())
         try:
             fakeclient.listRecords(from_=datetime(2003, 4, 10, 14, 0),
                                    metadataPrefix='oai_dc')
@@ -175,6 +227,7 @@ class ClientTestCase(TestCase):
             self.assertEquals('2003-04-10T14:00:00Z', e.kw['from'])
         fakeclient = GranularityFakeClient(granularity='YYYY-MM-DD')
         fakeclient.updateGranularity()
+        self.assertTrue(fakeclient.getDayGranularity())
         try:
             fakeclient.listRecords(from_=datetime(2003, 4, 10, 14, 0),
                                    until=datetime(2004, 6, 17, 15, 30),
@@ -220,8 +273,493 @@ class ClientTestCase(TestCase):
                 sleep.assert_has_calls([mock.call(5)] * 5)
 
 
+class XPathTestCase(TestCase):
+
+    def test_compileXPath(self):
+        namespaces = {'oai': 'http://www.openarchives.org/OAI/2.0/'}
+        xpath = client.compileXPath('oai:header', namespaces)
+        self.assertTrue(
+            xpath is client.compileXPath('oai:header', dict(namespaces)))
+        other = client.compileXPath('oai:header', {'oai': 'urn:other'})
+        self.assertTrue(xpath is not other)
+
+    def test_xpathEvaluator(self):
+        tree = etree.XML('<a xmlns="urn:a"><b>foo</b><b>bar</b></a>')
+        e = client.xpathEvaluator(tree, {'a': 'urn:a'})
+        self.assertEqual('foo', e('string(a:b/text())'))
+        self.assertEqual(['foo', 'bar'], e('a:b/text()'))
+
+    def test_unknown_field_type(self):
+        self.assertRaises(metadata.Error, metadata.MetadataReader,
+                          {'title': ('foo', 'title/text()')})
+
+
+class MetadataReaderTestCase(TestCase):
+
+    def setUp(self):
+        self.element = etree.XML(
+            '<metadata xmlns:oai_dc="http://www.openarchives.org/OAI/2.0/'
+            'oai_dc/" xmlns:dc="http://purl.org/dc/elements/1.1/">'
+            '<oai_dc:dc><dc:title>Foo</dc:title><dc:creator>Bar</dc:creator>'
+            '<dc:identifier>foo:1</dc:identifier></oai_dc:dc></metadata>')
+
+    def test_lazy(self):
+        eager = metadata.oai_dc_reader(self.element)
+        reader = metadata.MetadataReader(
+            metadata.oai_dc_reader._fields, metadata.oai_dc_reader._namespaces,
+            lazy=True)
+        lazy = reader(self.element)
+        self.assertTrue(isinstance(lazy, common.LazyMetadata))
+        self.assertTrue(lazy.element() is self.element)
+        self.assertEqual(['Foo'], lazy['title'])
+        self.assertEqual(['title'], list(lazy._map))
+        self.assertEqual(['Bar'], lazy.getField('creator'))
+        self.assertEqual(eager.getMap(), lazy.getMap())
+        self.assertRaises(KeyError, lazy.getField, 'foo')
+
+    def test_memoized(self):
+        calls = []
+        def read(element):
+            calls.append(element)
+            return ['Foo']
+        lazy = common.LazyMetadata(self.element, {'title': read})
+        self.assertEqual(['Foo'], lazy['title'])
+        self.assertEqual(['Foo'], lazy['title'])
+        self.assertEqual({'title': ['Foo']}, lazy.getMap())
+        self.assertEqual(1, len(calls))
+
+    def test_project(self):
+        reader = metadata.oai_dc_reader.project(['title', 'identifier'])
+        projected = reader(self.element)
+        self.assertEqual({'title': ['Foo'], 'identifier': ['foo:1']},
+                         projected.getMap())
+        self.assertFalse(isinstance(projected, common.LazyMetadata))
+        lazy = metadata.oai_dc_reader.project(['title'], lazy=True)
+        self.assertEqual({'title': ['Foo']}, lazy(self.element).getMap())
+        self.assertRaises(metadata.Error, metadata.oai_dc_reader.project,
+                          ['title', 'foo'])
+
+    def test_listRecords(self):
+        fakeclient = FakeClient(fake1)
+        registry = fakeclient.getMetadataRegistry()
+        registry.registerReader(
+            'oai_dc', metadata.oai_dc_reader.project(['title'], lazy=True))
+        try:
+            records = list(fakeclient.listRecords(
+                from_=datetime(2003, 4, 10), metadataPrefix='oai_dc'))
+        finally:
+            registry.registerReader('oai_dc', metadata.oai_dc_reader)
+        self.assertEqual(16, len(records))
+        header, md, about = records[0]
+        self.assertEqual(['title'], list(md.getMap()))
+        self.assertTrue(md['title'])
+
+
+class DetachTestCase(TestCase):
+
+    def setUp(self):
+        self.client = FakeClient(fake1)
+        self.client.getMetadataRegistry().registerReader(
+            'oai_dc', metadata.oai_dc_reader)
+
+    def listIdentifiers(self):
+        return list(self.client.listIdentifiers(
+            from_=datetime(2003, 4, 10), metadataPrefix='oai_dc'))
+
+    def test_slots(self):
+        header = self.listIdentifiers()[0]
+        self.assertFalse(hasattr(header, '__dict__'))
+        self.assertRaises(AttributeError, setattr, header, 'foo', 1)
+
+    def test_interned_setSpec(self):
+        headers = self.listIdentifiers()
+        self.assertEqual(['1:2'], headers[0].setSpec())
+        self.assertTrue(headers[0].setSpec()[0] is headers[1].setSpec()[0])
+
+    def test_attached(self):
+        header = self.listIdentifiers()[0]
+        self.assertTrue(header.element().getparent() is not None)
+
+    def test_detached(self):
+        self.client.setDetached(True)
+        headers = self.listIdentifiers()
+        self.assertEqual(16, len(headers))
+        self.assertEqual(None, headers[0].element())
+        self.assertEqual('hdl:1765/308', headers[0].identifier())
+        records = list(self.client.listRecords(
+            from_=datetime(2003, 4, 10), metadataPrefix='oai_dc'))
+        header, md, about = records[0]
+        self.assertEqual(None, header.element())
+        self.assertEqual(None, md.element())
+        self.assertTrue(md['title'])
+
+    def test_serialized(self):
+        self.client.setDetached(True, serialize=True)
+        header = self.listIdentifiers()[0]
+        element = header.element()
+        self.assertEqual('{http://www.openarchives.org/OAI/2.0/}header',
+                         element.tag)
+        self.assertEqual(None, element.getparent())
+        self.client.setDetached(False)
+        header = self.listIdentifiers()[0]
+        self.assertTrue(header.element().getparent() is not None)
+
+    def test_lazy(self):
+        self.client.setDetached(True)
+        registry = self.client.getMetadataRegistry()
+        registry.registerReader(
+            'oai_dc', metadata.oai_dc_reader.project(['title'], lazy=True))
+        try:
+            header, md, about = self.client.getRecord(
+                identifier='hdl:1765/315', metadataPrefix='oai_dc')
+        finally:
+            registry.registerReader('oai_dc', metadata.oai_dc_reader)
+        self.assertEqual(None, md.element())
+        self.assertTrue(md['title'])
+
+
+class HeaderBatchTestCase(TestCase):
+
+    def createBatch(self, rows, token=None):
+        batch = common.HeaderBatch(token)
+        for row in rows:
+            batch.append(*row)
+        return batch
+
+    def test_batch(self):
+        rows = [('b', datetime(2004, 1, 2), ['x', 'y'], False),
+                (u'\xe9', datetime(1969, 12, 31), [], True),
+                ('a', datetime(2004, 1, 2), ['y'], False)]
+        for i in range(10):
+            rows.append(('c%s' % i, datetime(2005, 1, 1), [], i == 9))
+        batch = self.createBatch(rows, 'token')
+        self.assertEqual(13, len(batch))
+        self.assertEqual('token', batch.token)
+        self.assertEqual(rows, list(batch))
+        self.assertEqual(-86400, batch.epoch(1))
+        self.assertEqual(-86400, batch.epochs()[1])
+        self.assertEqual(['x', 'y'], batch.sets())
+        self.assertEqual([0, 2], batch.withSet('y'))
+        self.assertEqual([], batch.withSet('z'))
+        header = batch.header(0)
+        self.assertEqual('b', header.identifier())
+        self.assertEqual(['x', 'y'], header.setSpec())
+        self.assertFalse(header.isDeleted())
+
+    def test_sorted(self):
+        batch = self.createBatch([
+            ('b', datetime(2004, 1, 2), ['x'], True),
+            ('c', datetime(2004, 1, 1), [], False),
+            ('a', datetime(2004, 1, 2), ['y', 'x'], False)])
+        self.assertEqual(
+            [('c', datetime(2004, 1, 1), [], False),
+             ('a', datetime(2004, 1, 2), ['y', 'x'], False),
+             ('b', datetime(2004, 1, 2), ['x'], True)],
+            list(batch.sorted()))
+
+    def test_merge(self):
+        first = self.createBatch(
+            [('b%s' % i, datetime(2004, 1, i + 1), ['x'], i % 3 == 0)
+             for i in range(9)], 'token')
+        second = self.createBatch(
+            [('a', datetime(2004, 1, 1), ['y', 'x'], True)])
+        merged = common.mergeHeaderBatches([first, second])
+        self.assertEqual(list(first) + list(second), list(merged))
+        self.assertEqual(None, merged.token)
+        self.assertEqual(['x', 'y'], merged.sets())
+        self.assertEqual([9], merged.withSet('y'))
+        merged = common.mergeHeaderBatches([first, second], sort=True)
+        self.assertEqual(sorted(list(first) + list(second),
+                                key=lambda row: (row[1], row[0])),
+                         list(merged))
+
+    def test_listIdentifierBatches(self):
+        fakeclient = FakeClient(fake1)
+        batches = list(fakeclient.listIdentifierBatches(
+            from_=datetime(2003, 4, 10), metadataPrefix='oai_dc'))
+        headers = list(fakeclient.listIdentifiers(
+            from_=datetime(2003, 4, 10), metadataPrefix='oai_dc'))
+        self.assertEqual(
+            [(header.identifier(), header.datestamp(), header.setSpec(),
+              header.isDeleted()) for header in headers],
+            list(common.mergeHeaderBatches(batches)))
+        self.assertEqual(None, batches[-1].token)
+
+
+class ResumptionTokenTestCase(TestCase):
+
+    def test_attributes(self):
+        node = etree.XML(
+            '<resumptionToken completeListSize="100" cursor="10" '
+            'expirationDate="2005-01-01T12:00:00Z"> foo </resumptionToken>')
+        token = client.buildResumptionToken([node])
+        self.assertEqual('foo', token)
+        self.assertEqual(100, token.completeListSize)
+        self.assertEqual(10, token.cursor)
+        self.assertEqual(datetime(2005, 1, 1, 12), token.expirationDate)
+
+    def test_bad_attributes(self):
+        node = etree.XML(
+            '<resumptionToken completeListSize="many" '
+            'expirationDate="tomorrow">foo</resumptionToken>')
+        token = client.buildResumptionToken([node])
+        self.assertEqual('foo', token)
+        self.assertEqual(None, token.completeListSize)
+        self.assertEqual(None, token.cursor)
+        self.assertEqual(None, token.expirationDate)
+
+    def test_empty(self):
+        self.assertEqual(None, client.buildResumptionToken([]))
+        node = etree.XML('<resumptionToken completeListSize="10"/>')
+        self.assertEqual(None, client.buildResumptionToken([node]))
+
+    def test_iterBatches(self):
+        fakeclient = FakeClient(fake1)
+        batches = list(fakeclient.iterBatches(
+            'ListIdentifiers', from_=datetime(2003, 4, 10),
+            metadataPrefix='oai_dc'))
+        self.assertEqual(16, sum([len(headers) for headers, token in batches]))
+        self.assertEqual(None, batches[-1][1])
+        for headers, token in batches[:-1]:
+            self.assertTrue(isinstance(token, common.ResumptionToken))
+
+
+class CompressionTestCase(TestCase):
+
+    def harvest(self, compressions, broken_identifies=0):
+        server = CompressingServer(compressions, broken_identifies)
+        with mock.patch(URLOPEN_PATH, side_effect=server):
+            urlclient = client.Client('http://mock.me', use_compression=True)
+            urlclient.getMetadataRegistry().registerReader(
+                'oai_dc', metadata.oai_dc_reader)
+            records = list(urlclient.listRecords(from_=datetime(2003, 4, 10),
+                                                 metadataPrefix='oai_dc'))
+        self.assertEqual(16, len(records))
+        return server, urlclient.transferStatistics()
+
+    def test_gzip(self):
+        server, statistics = self.harvest(['compress', 'deflate', 'gzip'])
+        # Identify is requested first to negotiate the compression
+        self.assertEqual(None, server.requests[0].get_header('Accept-encoding'))
+        for request in server.requests[1:]:
+            self.assertEqual('gzip, deflate',
+                             request.get_header('Accept-encoding'))
+        self.assertEqual(len(server.requests), statistics.requests)
+        self.assertTrue(statistics.compressed_bytes <
+                        statistics.uncompressed_bytes)
+        self.assertTrue(statistics.ratio() > 1.0)
+
+    def test_deflate(self):
+        server, statistics = self.harvest(['identity', 'deflate'])
+        for request in server.requests[1:]:
+            self.assertEqual('deflate', request.get_header('Accept-encoding'))
+        self.assertTrue(statistics.ratio() > 1.0)
+
+    def test_identify_fails(self):
+        server = CompressingServer(['gzip'], broken_identifies=1)
+        with mock.patch(URLOPEN_PATH, side_effect=server):
+            urlclient = client.Client('http://mock.me', use_compression=True)
+            urlclient.getMetadataRegistry().registerReader(
+                'oai_dc', metadata.oai_dc_reader)
+            for i in range(2):
+                records = list(urlclient.listRecords(
+                    from_=datetime(2003, 4, 10), metadataPrefix='oai_dc'))
+                self.assertEqual(16, len(records))
+        verbs = [parse_qs(request.data.decode('ascii'))['verb'][0]
+                 for request in server.requests]
+        # the first request is done uncompressed, and the compression
+        # negotiated again for the next one
+        self.assertEqual(['Identify', 'ListRecords', 'Identify',
+                          'ListRecords'], verbs)
+        self.assertEqual(None, server.requests[1].get_header('Accept-encoding'))
+        self.assertEqual('gzip', server.requests[3].get_header('Accept-encoding'))
+
+    def test_raw_deflate(self):
+        compressor = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+        data = compressor.compress(b'<foo/>' * 100) + compressor.flush()
+        f = addinfourl(BytesIO(data), {'Content-Encoding': 'deflate'}, '')
+        self.assertEqual((len(data), b'<foo/>' * 100),
+                         client.readResponse(f, chunk_size=10))
+
+    def test_not_advertised(self):
+        server = CompressingServer(['compress', 'deflate'])
+        with mock.patch(URLOPEN_PATH, side_effect=server):
+            urlclient = client.Client('http://mock.me', use_compression=True)
+            urlclient.updateCompression()
+            self.assertEqual(['deflate'], urlclient._compressions)
+
+
+class StreamingTestCase(TestCase):
+
+    def setUp(self):
+        self.client = FakeClient(fake1)
+        self.client.getMetadataRegistry().registerReader(
+            'oai_dc', metadata.oai_dc_reader)
+        self.client.setStreaming(True)
+
+    def test_listRecords(self):
+        records = list(self.client.listRecords(from_=datetime(2003, 4, 10),
+                                               metadataPrefix='oai_dc'))
+        expected = list(fakeclient.listRecords(from_=datetime(2003, 4, 10),
+                                               metadataPrefix='oai_dc'))
+        self.assertEqual(len(expected), len(records))
+        for (header, metadata, about), (e_header, e_metadata, e_about) in zip(
+            records, expected):
+            self.assertEqual(e_header.identifier(), header.identifier())
+            self.assertEqual(e_header.datestamp(), header.datestamp())
+            self.assertEqual(e_header.setSpec(), header.setSpec())
+            self.assertEqual(e_metadata.getMap(), metadata.getMap())
+
+    def test_listIdentifiers(self):
+        headers = list(self.client.listIdentifiers(
+            from_=datetime(2003, 4, 10), metadataPrefix='oai_dc'))
+        self.assertEqual(16, len(headers))
+        self.assertEqual('hdl:1765/308', headers[0].identifier())
+        self.assertEqual(['1:2'], headers[0].setSpec())
+
+    def test_elements_freed(self):
+        records = self.client.listRecords(from_=datetime(2003, 4, 10),
+                                          metadataPrefix='oai_dc')
+        first_header, first_metadata, about = next(records)
+        e_record = first_header.element().getparent()
+        self.assertTrue(e_record.getparent() is not None)
+        next(records)
+        # the first record element has been removed from the page tree,
+        # but stays usable through the header
+        self.assertTrue(e_record.getparent() is None)
+        self.assertEqual('hdl:1765/308',
+                         first_header.element()[0].text)
+
+    def test_resumptionToken(self):
+        def build(element):
+            return element.text
+        batch = client.StreamingBatch(
+            b'<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/">'
+            b'<ListSets><setSpec>a</setSpec><setSpec>b</setSpec>'
+            b'<resumptionToken>foo</resumptionToken></ListSets></OAI-PMH>',
+            '{http://www.openarchives.org/OAI/2.0/}', 'setSpec', build, {})
+        self.assertEqual(None, batch.token)
+        self.assertEqual(['a', 'b'], list(batch))
+        self.assertEqual('foo', batch.token)
+
+    def test_error(self):
+        self.assertRaises(
+            error.NoRecordsMatchError, client.StreamingBatch,
+            b'<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/">'
+            b'<error code="noRecordsMatch">No records</error></OAI-PMH>',
+            '{http://www.openarchives.org/OAI/2.0/}', 'record', None, {})
+
+    def test_syntax_error(self):
+        batch = client.StreamingBatch(
+            b'<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/">'
+            b'<ListSets><set/><set/><set>',
+            '{http://www.openarchives.org/OAI/2.0/}', 'set', len, {})
+        self.assertRaises(error.XMLSyntaxError, list, batch)
+
+    def test_http(self):
+        # a page of headers far larger than the chunks it is read in
+        page = [b'<?xml version="1.0" encoding="UTF-8"?>\n'
+                b'<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/">'
+                b'<responseDate>2005-01-01T00:00:00Z</responseDate>'
+                b'<request verb="ListIdentifiers">http://mock.me</request>'
+                b'<ListIdentifiers>']
+        for i in range(5000):
+            page.append(('<header><identifier>oai:mock:%s</identifier>'
+                         '<datestamp>2005-01-01</datestamp></header>'
+                         % i).encode('ascii'))
+        page.append(b'</ListIdentifiers></OAI-PMH>')
+        body = b''.join(page)
+        responses = []
+        def urlopen(request):
+            response = addinfourl(BytesIO(body), {}, request.get_full_url())
+            responses.append(response)
+            return response
+        with mock.patch(URLOPEN_PATH, side_effect=urlopen):
+            urlclient = client.Client('http://mock.me')
+            urlclient.setStreaming(True)
+            headers = urlclient.listIdentifiers(metadataPrefix='oai_dc')
+            self.assertEqual('oai:mock:0', next(headers).identifier())
+            # only the start of the page has been read
+            self.assertEqual(client.CHUNK_SIZE, responses[0].fp.tell())
+            self.assertTrue(5 * client.CHUNK_SIZE < len(body))
+            self.assertEqual(4999, len(list(headers)))
+        self.assertTrue(responses[0].fp.closed)
+        statistics = urlclient.transferStatistics()
+        self.assertEqual(1, statistics.requests)
+        self.assertEqual(len(body), statistics.compressed_bytes)
+        self.assertEqual(len(body), statistics.uncompressed_bytes)
+
+
+class PrefetchTestCase(TestCase):
+
+    def setUp(self):
+        self.client = FakeClient(fake1)
+        self.client.getMetadataRegistry().registerReader(
+            'oai_dc', metadata.oai_dc_reader)
+        self.client.setPrefetchDepth(2)
+
+    def test_listRecords(self):
+        records = self.client.listRecords(from_=datetime(2003, 4, 10),
+                                          metadataPrefix='oai_dc')
+        expected = fakeclient.listRecords(from_=datetime(2003, 4, 10),
+                                          metadataPrefix='oai_dc')
+        self.assertEqual(
+            [header.identifier() for header, metadata, about in expected],
+            [header.identifier() for header, metadata, about in records])
+
+    def test_listIdentifiers(self):
+        headers = list(self.client.listIdentifiers(
+            from_=datetime(2003, 4, 10), metadataPrefix='oai_dc'))
+        self.assertEqual(16, len(headers))
+        self.assertEqual('hdl:1765/308', headers[0].identifier())
+
+    def test_listSets(self):
+        sets = list(self.client.listSets())
+        self.assertEqual(list(fakeclient.listSets()), sets)
+
+    def test_error_propagation(self):
+        def firstBatch():
+            return [1, 2], 'token'
+        def nextBatch(token):
+            raise TestError({'resumptionToken': token})
+        result = client.PrefetchingResumptionListGenerator(
+            firstBatch, nextBatch, 1)
+        self.assertEqual(1, next(result))
+        self.assertEqual(2, next(result))
+        with self.assertRaises(TestError) as cm:
+            next(result)
+        self.assertEqual({'resumptionToken': 'token'}, cm.exception.kw)
+
+    def test_close(self):
+        requested = []
+        def firstBatch():
+            return [0], 'token'
+        def nextBatch(token):
+            requested.append(token)
+            return [len(requested)], 'token'
+        result = client.PrefetchingResumptionListGenerator(
+            firstBatch, nextBatch, 1)
+        self.assertEqual(0, next(result))
+        result.close()
+        count = len(requested)
+        time.sleep(0.3)
+        # the worker stops after the request it was busy with
+        self.assertTrue(len(requested) <= count + 1)
+
+    def test_negative_depth(self):
+        self.assertRaises(ValueError, self.client.setPrefetchDepth, -1)
+
+
 def test_suite():
-    return TestSuite((makeSuite(ClientTestCase), ))
+    return TestSuite((makeSuite(ClientTestCase),
+                      makeSuite(XPathTestCase),
+                      makeSuite(MetadataReaderTestCase),
+                      makeSuite(DetachTestCase),
+                      makeSuite(HeaderBatchTestCase),
+                      makeSuite(ResumptionTokenTestCase),
+                      makeSuite(CompressionTestCase),
+                      makeSuite(StreamingTestCase),
+                      makeSuite(PrefetchTestCase)))
 
 if __name__=='__main__':
     main(defaultTest='test_suite')
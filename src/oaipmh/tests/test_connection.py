@@ -0,0 +1,93 @@
+import threading
+import time
+from unittest import TestCase, TestSuite, makeSuite, main
+
+try:
+    import urllib.request as urllib2
+except ImportError:
+    import urllib2
+
+from oaipmh import client, connection
+from fakehttpserver import OAIHTTPServer, IDENTIFY
+
+class ConnectionPoolTestCase(TestCase):
+
+    def setUp(self):
+        self.server = OAIHTTPServer()
+        self.server.start()
+        self.url = self.server.url('')
+        self.pool = connection.ConnectionPool(maxsize=2)
+
+    def tearDown(self):
+        self.pool.clear()
+        self.server.stop()
+
+    def test_reuse(self):
+        for i in range(5):
+            response = self.pool.urlopen(urllib2.Request(self.url + '/oai'))
+            self.assertEqual(IDENTIFY, response.read())
+        self.assertEqual(1, len(self.server.connections))
+
+    def test_shared_by_clients(self):
+        for i in range(3):
+            oaiclient = client.Client(self.url + '/oai', force_http_get=True,
+                                      connection_pool=self.pool)
+            self.assertEqual('http://dspace.ubib.eur.nl/oai/',
+                             oaiclient.identify().baseURL())
+        self.assertEqual(1, len(self.server.connections))
+
+    def test_post(self):
+        oaiclient = client.Client(self.url + '/oai',
+                                  connection_pool=self.pool)
+        oaiclient.identify()
+        self.assertEqual([{'verb': ['Identify']}], self.server.posted)
+
+    def test_reconnect(self):
+        self.pool.urlopen(urllib2.Request(self.url + '/drop'))
+        # the server closed the connection on us, a new one is opened
+        response = self.pool.urlopen(urllib2.Request(self.url + '/oai'))
+        self.assertEqual(IDENTIFY, response.read())
+        self.assertEqual(2, len(self.server.connections))
+
+    def test_idle_timeout(self):
+        pool = connection.ConnectionPool(idle_timeout=-1)
+        pool.urlopen(urllib2.Request(self.url + '/oai'))
+        pool.urlopen(urllib2.Request(self.url + '/oai'))
+        pool.clear()
+        self.assertEqual(2, len(self.server.connections))
+
+    def test_delay(self):
+        pool = connection.ConnectionPool(delay=0.1)
+        start = time.time()
+        for i in range(3):
+            pool.urlopen(urllib2.Request(self.url + '/oai'))
+        pool.clear()
+        self.assertTrue(time.time() - start >= 0.2)
+
+    def test_http_error(self):
+        with self.assertRaises(urllib2.HTTPError) as cm:
+            self.pool.urlopen(urllib2.Request(self.url + '/error'))
+        self.assertEqual(500, cm.exception.code)
+        # the connection is still usable after an error
+        self.pool.urlopen(urllib2.Request(self.url + '/oai'))
+        self.assertEqual(1, len(self.server.connections))
+
+    def test_concurrent(self):
+        results = []
+        def harvest():
+            response = self.pool.urlopen(urllib2.Request(self.url + '/oai'))
+            results.append(response.read())
+        threads = [threading.Thread(target=harvest) for i in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([IDENTIFY] * 10, results)
+        # never more connections than the pool allows
+        self.assertTrue(len(self.server.connections) <= 2)
+
+def test_suite():
+    return TestSuite((makeSuite(ConnectionPoolTestCase), ))
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,9 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 from unittest import TestCase, TestSuite, makeSuite
+from oaipmh import datestamp
 from oaipmh.datestamp import datestamp_to_datetime,\
-     tolerant_datestamp_to_datetime
+     tolerant_datestamp_to_datetime, datetime_to_datestamp,\
+     datestamps_to_datetimes, datetimes_to_datestamps
 from oaipmh.error import DatestampError
 
 class DatestampTestCase(TestCase):
@@ -63,5 +65,64 @@ class DatestampTestCase(TestCase):
             datetime(2005, 2, 1),
             f('2005-02'))
         
+class FastDatestampTestCase(TestCase):
+
+    def test_fallback(self):
+        # not in one of the granularities of the protocol
+        self.assertEqual(
+            datetime(2005, 7, 4, 14, 35, 10),
+            datestamp_to_datetime('2005-07-04T14:35:10.123Z'))
+        self.assertRaises(DatestampError,
+                          datestamp_to_datetime, '2005-07-04T14:35:1xZ')
+        self.assertRaises(DatestampError,
+                          datestamp_to_datetime, '2005-13-04T14:35:10Z')
+        self.assertRaises(DatestampError,
+                          datestamp_to_datetime, '2005-07-0x')
+
+    def test_inclusive(self):
+        self.assertEqual(datetime(2009, 11, 16, 23, 59, 59),
+                         datestamp_to_datetime('2009-11-16', inclusive=True))
+        self.assertEqual(datetime(2009, 11, 16),
+                         datestamp_to_datetime('2009-11-16'))
+        self.assertEqual(datetime(2009, 11, 16, 12),
+                         datestamp_to_datetime('2009-11-16T12:00:00Z',
+                                               inclusive=True))
+
+    def test_datetime_to_datestamp(self):
+        self.assertEqual('2005-07-04T14:35:10Z', datetime_to_datestamp(
+            datetime(2005, 7, 4, 14, 35, 10, 500)))
+        self.assertEqual('2005-07-04', datetime_to_datestamp(
+            datetime(2005, 7, 4, 14, 35, 10), day_granularity=True))
+        self.assertEqual('0900-01-01T00:00:00Z', datetime_to_datestamp(
+            datetime(900, 1, 1)))
+
+    def test_cache(self):
+        for i in range(datestamp.CACHE_SIZE + 10):
+            dt = datetime(2000, 1, 1) + timedelta(seconds=i)
+            self.assertEqual(dt, datestamp_to_datetime(
+                datetime_to_datestamp(dt)))
+        self.assertTrue(len(datestamp._datetime_cache) <=
+                        datestamp.CACHE_SIZE)
+        self.assertTrue(len(datestamp._datestamp_cache) <=
+                        datestamp.CACHE_SIZE)
+
+    def test_cache_microseconds(self):
+        datestamp._datestamp_cache.clear()
+        for i in range(100):
+            self.assertEqual('2005-07-04T14:35:10Z', datetime_to_datestamp(
+                datetime(2005, 7, 4, 14, 35, 10, i)))
+        # all share the entry of the datetime without microseconds
+        self.assertEqual(1, len(datestamp._datestamp_cache))
+
+    def test_batch(self):
+        dts = [datetime(2005, 7, 4), datetime(2005, 7, 4, 14, 35, 10)]
+        self.assertEqual(['2005-07-04T00:00:00Z', '2005-07-04T14:35:10Z'],
+                         datetimes_to_datestamps(dts))
+        self.assertEqual(['2005-07-04', '2005-07-04'],
+                         datetimes_to_datestamps(dts, day_granularity=True))
+        self.assertEqual(dts, datestamps_to_datetimes(
+            ['2005-07-04', '2005-07-04T14:35:10Z']))
+
 def test_suite():
-    return TestSuite((makeSuite(DatestampTestCase), ))
+    return TestSuite((makeSuite(DatestampTestCase),
+                      makeSuite(FastDatestampTestCase)))
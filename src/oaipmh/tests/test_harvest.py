@@ -0,0 +1,299 @@
+import os
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+from unittest import TestCase, TestSuite, makeSuite, main
+
+from six.moves.queue import Queue
+
+from fakeclient import FakeClient
+from fakehttpserver import OAIHTTPServer
+import fakeserver
+from oaipmh import client, common, harvest, metadata, server
+from oaipmh.datestamp import datestamp_to_datetime
+
+directory = os.path.dirname(__file__)
+fake1 = os.path.join(directory, 'fake1')
+
+class SlowFakeClient(FakeClient):
+    def __init__(self, mapping_path, delay, log):
+        FakeClient.__init__(self, mapping_path)
+        self._delay = delay
+        self._log = log
+
+    def makeRequest(self, **kw):
+        self._log.append(threading.current_thread())
+        time.sleep(self._delay)
+        return FakeClient.makeRequest(self, **kw)
+
+class HarvesterTestCase(TestCase):
+
+    def setUp(self):
+        self.registry = metadata.MetadataRegistry()
+        self.registry.registerReader('oai_dc', metadata.oai_dc_reader)
+        self.servers = [OAIHTTPServer() for i in range(2)]
+        for server in self.servers:
+            server.start()
+
+    def tearDown(self):
+        for server in self.servers:
+            server.stop()
+
+    def test_harvest(self):
+        harvester = harvest.Harvester(self.registry, workers=4)
+        urls = [server.url() for server in self.servers]
+        harvested = []
+        def callback(base_url, record):
+            harvested.append((base_url, record[0].identifier()))
+        results = harvester.harvest(
+            urls, 'ListRecords', callback=callback,
+            metadataPrefix='oai_dc', from_=datetime(2003, 4, 10))
+        harvester.close()
+        for url in urls:
+            self.assertTrue(results[url].succeeded())
+            self.assertEqual(16, results[url].count)
+            self.assertEqual(
+                16, len([1 for base_url, identifier in harvested
+                         if base_url == url]))
+
+    def test_queue(self):
+        harvester = harvest.Harvester(self.registry)
+        items = Queue()
+        results = harvester.harvest(
+            [self.servers[0].url()], 'Identify', queue=items)
+        harvester.close()
+        base_url, identify = items.get_nowait()
+        self.assertEqual(self.servers[0].url(), base_url)
+        self.assertEqual('http://dspace.ubib.eur.nl/oai/', identify.baseURL())
+        self.assertEqual(1, results[base_url].count)
+
+    def test_failure_isolation(self):
+        harvester = harvest.Harvester(self.registry)
+        good = self.servers[0].url()
+        bad = self.servers[1].url('/error')
+        results = harvester.harvest([bad, good], 'Identify')
+        harvester.close()
+        self.assertTrue(results[good].succeeded())
+        self.assertFalse(results[bad].succeeded())
+        self.assertEqual(500, results[bad].error.code)
+
+    def test_concurrent(self):
+        log = []
+        def factory(base_url):
+            return SlowFakeClient(fake1, 0.2, log)
+        harvester = harvest.Harvester(
+            self.registry, workers=4, client_factory=factory)
+        start = time.time()
+        results = harvester.harvest(
+            ['repo%s' % i for i in range(4)], 'Identify')
+        duration = time.time() - start
+        self.assertEqual(4, len(set(log)))
+        self.assertTrue(duration < 0.6)
+        for result in results.values():
+            self.assertTrue(result.duration() >= 0.2)
+
+    def test_politeness(self):
+        harvester = harvest.Harvester(
+            self.registry, workers=4, per_host=1, delay=0.1)
+        url = self.servers[0].url()
+        start = time.time()
+        # the same host, under different names
+        results = harvester.harvest(
+            [url, url + '?', url + '#'], 'Identify')
+        duration = time.time() - start
+        harvester.close()
+        for result in results.values():
+            self.assertTrue(result.succeeded())
+        self.assertTrue(duration >= 0.2)
+        self.assertEqual(1, len(self.servers[0].connections))
+
+class SizeReportingServerClient(client.ServerClient):
+    """Adds completeListSize to the first resumption token of a list.
+    """
+    def __init__(self, fake_server, server, metadata_registry):
+        client.ServerClient.__init__(self, server, metadata_registry)
+        self._fake_server = fake_server
+        self.requests = []
+
+    def makeRequest(self, **kw):
+        self.requests.append(kw)
+        xml = client.ServerClient.makeRequest(self, **kw)
+        if 'resumptionToken' in kw or kw['verb'] == 'Identify':
+            return xml
+        size = len(self._fake_server.listIdentifiers(
+            from_=datestamp_to_datetime(kw['from']),
+            until=datestamp_to_datetime(kw['until'])))
+        return re.sub(b'<resumptionToken',
+                      b'<resumptionToken completeListSize="%d"' % size, xml)
+
+class DateRangeHarvesterTestCase(TestCase):
+
+    def setUp(self):
+        self.fake_server = fakeserver.FakeServer()
+        self.registry = metadata.MetadataRegistry()
+        self.registry.registerWriter('oai_dc', server.oai_dc_writer)
+        self.registry.registerReader('oai_dc', metadata.oai_dc_reader)
+        self.client = SizeReportingServerClient(
+            self.fake_server,
+            server.Server(self.fake_server, self.registry,
+                          resumption_batch_size=7),
+            self.registry)
+
+    def harvest(self, harvester, **kw):
+        harvested = []
+        def callback(window, header):
+            harvested.append(header.identifier())
+        results = harvester.harvest(
+            'ListIdentifiers', callback=callback, metadataPrefix='oai_dc',
+            **kw)
+        return results, harvested
+
+    def assertCovers(self, from_, until, windows):
+        windows = sorted(windows)
+        self.assertEqual(from_, windows[0][0])
+        self.assertEqual(until, windows[-1][1])
+        for (start, end), (next_start, next_end) in zip(windows, windows[1:]):
+            self.assertTrue(start <= end)
+            self.assertEqual(end + timedelta(seconds=1), next_start)
+
+    def test_harvest(self):
+        harvester = harvest.DateRangeHarvester(self.client, windows=5)
+        results, harvested = self.harvest(
+            harvester, until=datetime(2005, 1, 1))
+        self.assertEqual(5, len(results))
+        self.assertCovers(datetime(2004, 1, 1), datetime(2005, 1, 1), results)
+        self.assertEqual(sorted([str(i) for i in range(100)]),
+                         sorted(harvested))
+        for result in results.values():
+            self.assertTrue(result.succeeded())
+        self.assertEqual(100, sum([result.count
+                                   for result in results.values()]))
+
+    def test_empty_window(self):
+        harvester = harvest.DateRangeHarvester(self.client, windows=2)
+        results, harvested = self.harvest(
+            harvester, from_=datetime(2004, 6, 1), until=datetime(2006, 1, 1))
+        for result in results.values():
+            self.assertTrue(result.succeeded())
+        self.assertEqual(
+            len(self.fake_server.listIdentifiers(from_=datetime(2004, 6, 1))),
+            len(harvested))
+
+    def test_adaptive(self):
+        harvester = harvest.DateRangeHarvester(
+            self.client, windows=2, max_window_size=20)
+        results, harvested = self.harvest(
+            harvester, from_=datetime(2004, 1, 1),
+            until=datetime(2004, 12, 31, 23, 59, 59))
+        self.assertTrue(len(results) > 2)
+        self.assertCovers(datetime(2004, 1, 1),
+                          datetime(2004, 12, 31, 23, 59, 59), results)
+        self.assertEqual(sorted([str(i) for i in range(100)]),
+                         sorted(harvested))
+        for window in results:
+            size = len(self.fake_server.listIdentifiers(
+                from_=window[0], until=window[1]))
+            self.assertTrue(size <= 20)
+
+    def test_day_granularity(self):
+        self.fake_server.identify = lambda: common.Identify(
+            'Fake', 'http://localhost/oai', '2.0', [], datetime(2004, 1, 1),
+            'no', 'YYYY-MM-DD', ['identity'])
+        harvester = harvest.DateRangeHarvester(self.client, windows=3)
+        results, harvested = self.harvest(
+            harvester, until=datetime(2004, 1, 5, 12))
+        self.assertEqual(
+            [(datetime(2004, 1, 1), datetime(2004, 1, 1)),
+             (datetime(2004, 1, 2), datetime(2004, 1, 3)),
+             (datetime(2004, 1, 4), datetime(2004, 1, 5))],
+            sorted(results))
+        self.assertEqual(['2004-01-04'], [
+            kw['from'] for kw in self.client.requests
+            if kw.get('until') == '2004-01-05'])
+
+    def test_wrong_verb(self):
+        harvester = harvest.DateRangeHarvester(self.client)
+        self.assertRaises(ValueError, harvester.harvest, 'ListSets')
+
+class SetHarvesterTestCase(TestCase):
+
+    def setUp(self):
+        self.registry = metadata.MetadataRegistry()
+        self.registry.registerWriter('oai_dc', server.oai_dc_writer)
+        self.registry.registerReader('oai_dc', metadata.oai_dc_reader)
+        self.client = client.ServerClient(
+            server.Server(fakeserver.SetFakeServer(), self.registry,
+                          resumption_batch_size=4),
+            self.registry)
+
+    def test_harvest(self):
+        harvester = harvest.SetHarvester(self.client, workers=3)
+        harvested = []
+        progress = []
+        def callback(setSpec, record):
+            harvested.append(record[0].identifier())
+        def report(setSpec, result):
+            progress.append((setSpec, result.count + result.duplicates))
+        results = harvester.harvest(
+            'ListRecords', callback=callback, progress=report,
+            metadataPrefix='oai_dc')
+        self.assertEqual(['empty', 'even', 'odd', 'three'], sorted(results))
+        for result in results.values():
+            self.assertTrue(result.succeeded())
+        self.assertEqual(sorted([str(i) for i in range(30)]),
+                         sorted(harvested))
+        self.assertEqual(30, sum([result.count
+                                  for result in results.values()]))
+        self.assertEqual(10, sum([result.duplicates
+                                  for result in results.values()]))
+        self.assertEqual(0, results['empty'].count)
+        # progress is reported after each response: 15 records in pages of 4
+        self.assertEqual([4, 8, 12, 15],
+                         [count for setSpec, count in progress
+                          if setSpec == 'even'])
+
+    def test_sets(self):
+        harvester = harvest.SetHarvester(self.client)
+        items = Queue()
+        results = harvester.harvest(
+            'ListIdentifiers', sets=['three'], queue=items,
+            metadataPrefix='oai_dc')
+        self.assertEqual(['three'], list(results))
+        self.assertEqual(10, items.qsize())
+        setSpec, header = items.get_nowait()
+        self.assertEqual('three', setSpec)
+        self.assertEqual('0', header.identifier())
+
+    def test_wrong_verb(self):
+        harvester = harvest.SetHarvester(self.client)
+        self.assertRaises(ValueError, harvester.harvest, 'Identify')
+
+class SplitDateRangeTestCase(TestCase):
+
+    def test_seconds(self):
+        self.assertEqual(
+            [(datetime(2004, 1, 1, 0, 0, 0), datetime(2004, 1, 1, 0, 0, 1)),
+             (datetime(2004, 1, 1, 0, 0, 2), datetime(2004, 1, 1, 0, 0, 4))],
+            harvest.splitDateRange(datetime(2004, 1, 1),
+                                   datetime(2004, 1, 1, 0, 0, 4, 500), 2))
+
+    def test_too_many(self):
+        self.assertEqual(
+            [(datetime(2004, 1, 1), datetime(2004, 1, 1)),
+             (datetime(2004, 1, 2), datetime(2004, 1, 2))],
+            harvest.splitDateRange(datetime(2004, 1, 1, 12),
+                                   datetime(2004, 1, 2), 4, True))
+
+    def test_empty(self):
+        self.assertEqual([], harvest.splitDateRange(
+            datetime(2004, 1, 2), datetime(2004, 1, 1), 2))
+
+def test_suite():
+    return TestSuite((makeSuite(HarvesterTestCase),
+                      makeSuite(DateRangeHarvesterTestCase),
+                      makeSuite(SetHarvesterTestCase),
+                      makeSuite(SplitDateRangeTestCase)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+import os
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+from unittest import TestCase, TestSuite, makeSuite, main
+
+import fakeserver
+from fakeclient import RecordingServerClient
+from oaipmh import common, incremental, metadata, server
+
+class IncrementalHarvesterTestCase(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.fake_server = fakeserver.FakeServer()
+        registry = metadata.MetadataRegistry()
+        registry.registerWriter('oai_dc', server.oai_dc_writer)
+        registry.registerReader('oai_dc', metadata.oai_dc_reader)
+        self.client = RecordingServerClient(
+            server.Server(self.fake_server, registry,
+                          resumption_batch_size=30),
+            registry)
+        self.store = self.createStore()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def createStore(self):
+        return incremental.FileHighWaterMarkStore(
+            os.path.join(self.directory, 'marks.json'))
+
+    def harvest(self, overlap=timedelta(0)):
+        harvested = []
+        harvester = incremental.IncrementalHarvester(
+            self.client, self.store, overlap)
+        count = harvester.harvest(
+            'repo', 'oai_dc', lambda record: harvested.append(record))
+        self.assertEqual(len(harvested), count)
+        return harvested
+
+    def test_harvest(self):
+        start = datetime.utcnow().replace(microsecond=0)
+        self.assertEqual(100, len(self.harvest()))
+        mark = self.store.get('repo', 'oai_dc')
+        self.assertTrue(mark >= start)
+        self.assertEqual(None, self.store.get('repo', 'other'))
+        self.assertEqual(None, self.store.get('other', 'oai_dc'))
+        # nothing changed
+        self.assertEqual([], self.harvest())
+        self.assertEqual(
+            '%sZ' % mark.isoformat(), self.client.requests[-1]['from'])
+        # a record changed
+        header, metadata, about = self.fake_server._data[3]
+        self.fake_server._data[3] = (
+            common.Header(None, '3', datetime.utcnow() + timedelta(seconds=1),
+                          [], False),
+            metadata, about)
+        self.assertEqual(['3'], [header.identifier() for
+                                 header, metadata, about in self.harvest()])
+
+    def test_overlap(self):
+        self.store.set('repo', 'oai_dc', datetime(2004, 12, 1))
+        self.harvest(overlap=timedelta(days=30))
+        self.assertEqual('2004-11-01T00:00:00Z',
+                         self.client.requests[-1]['from'])
+
+    def test_day_granularity(self):
+        self.fake_server.identify = lambda: common.Identify(
+            'Fake', 'http://localhost/oai', '2.0', [], datetime(2004, 1, 1),
+            'no', 'YYYY-MM-DD', ['identity'])
+        self.store.set('repo', 'oai_dc', datetime(2004, 12, 1, 12))
+        self.harvest()
+        self.assertEqual('2004-12-01', self.client.requests[-1]['from'])
+
+    def test_failure(self):
+        self.store.set('repo', 'oai_dc', datetime(2004, 12, 1))
+        def fail(record):
+            raise ValueError
+        harvester = incremental.IncrementalHarvester(self.client, self.store)
+        self.assertRaises(ValueError, harvester.harvest, 'repo', 'oai_dc',
+                          fail)
+        self.assertEqual(datetime(2004, 12, 1),
+                         self.store.get('repo', 'oai_dc'))
+
+class SQLiteIncrementalHarvesterTestCase(IncrementalHarvesterTestCase):
+
+    def createStore(self):
+        return incremental.SQLiteHighWaterMarkStore(
+            os.path.join(self.directory, 'marks.db'))
+
+def test_suite():
+    return TestSuite((makeSuite(IncrementalHarvesterTestCase),
+                      makeSuite(SQLiteIncrementalHarvesterTestCase)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+import os
+import shutil
+import tempfile
+import time
+from datetime import datetime
+from unittest import TestCase, TestSuite, makeSuite, main
+
+from fakehttpserver import OAIHTTPServer
+from oaipmh import client, metadata, replay
+
+class ArchiveTestCase(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'archive')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_archive(self):
+        writer = replay.ArchiveWriter(self.path)
+        writer.add('verb=Identify', b'<identify/>')
+        writer.add('verb=ListSets', b'<sets/>' * 100)
+        writer.close()
+        reader = replay.ArchiveReader(self.path)
+        self.assertEqual(['verb=Identify', 'verb=ListSets'],
+                         sorted(reader.keys()))
+        self.assertTrue('verb=Identify' in reader)
+        self.assertEqual(b'<sets/>' * 100, reader.get('verb=ListSets'))
+        self.assertEqual(b'<identify/>', reader.get('verb=Identify'))
+        self.assertRaises(KeyError, reader.get, 'verb=ListRecords')
+        reader.close()
+        # responses are compressed
+        self.assertTrue(os.path.getsize(self.path) < 300)
+
+    def test_incomplete(self):
+        writer = replay.ArchiveWriter(self.path)
+        writer.add('verb=Identify', b'<identify/>')
+        writer._f.flush()
+        self.assertRaises(replay.ArchiveError, replay.ArchiveReader,
+                          self.path)
+        writer.close()
+
+    def test_not_an_archive(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'<OAI-PMH/>')
+        self.assertRaises(replay.ArchiveError, replay.ArchiveReader,
+                          self.path)
+
+class RecordReplayTestCase(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'archive')
+        self.registry = metadata.MetadataRegistry()
+        self.registry.registerReader('oai_dc', metadata.oai_dc_reader)
+        server = OAIHTTPServer()
+        server.start()
+        try:
+            recorder = replay.RecordingClient(
+                server.url(), self.path, self.registry)
+            self.identify = recorder.identify()
+            self.records = self.harvest(recorder)
+            recorder.close()
+        finally:
+            server.stop()
+        self.requests = len(server.requests)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def harvest(self, oai_client):
+        return [(header.identifier(), header.datestamp(), metadata.getMap())
+                for header, metadata, about in oai_client.listRecords(
+                    from_=datetime(2003, 4, 10), metadataPrefix='oai_dc')]
+
+    def test_replay(self):
+        oai_client = replay.ReplayClient(self.path, self.registry)
+        self.assertEqual(self.identify.baseURL(),
+                         oai_client.identify().baseURL())
+        self.assertEqual(16, len(self.records))
+        self.assertEqual(self.records, self.harvest(oai_client))
+        self.assertRaises(client.Error, oai_client.listSets)
+        oai_client.close()
+
+    def test_latency(self):
+        oai_client = replay.ReplayClient(
+            self.path, self.registry, latency=0.05)
+        start = time.time()
+        self.harvest(oai_client)
+        duration = time.time() - start
+        oai_client.close()
+        self.assertTrue(duration >= 0.05 * (self.requests - 1))
+
+    def test_bandwidth(self):
+        oai_client = replay.ReplayClient(
+            self.path, self.registry, bandwidth=100000)
+        start = time.time()
+        oai_client.identify()
+        duration = time.time() - start
+        oai_client.close()
+        self.assertTrue(duration >= 0.005)
+
+def test_suite():
+    return TestSuite((makeSuite(ArchiveTestCase),
+                      makeSuite(RecordReplayTestCase)))
+
+if __name__ == '__main__':
+    main()
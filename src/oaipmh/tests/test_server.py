@@ -1,12 +1,15 @@
 import unittest
 import os
+import re
 import six
 try:
     from StringIO import StringIO
 except ImportError:
-    from io import StringIO, BytesIO
+    from io import StringIO
+from io import BytesIO
 from oaipmh import server, client, common, metadata, error
 from lxml import etree
+from lxml.etree import SubElement
 from datetime import datetime
 import fakeclient
 import fakeserver
@@ -156,6 +159,159 @@ class ResumptionTestCase(unittest.TestCase):
             tree.xpath('//oai:resumptionToken/text()', 
                        namespaces={'oai': NS_OAIPMH} ))
         
+class CountingFakeServer(fakeserver.FakeServer):
+    def __init__(self):
+        fakeserver.FakeServer.__init__(self)
+        self.queries = 0
+
+    def listIdentifiers(self, **kw):
+        self.queries += 1
+        return fakeserver.FakeServer.listIdentifiers(self, **kw)
+
+class LazyFakeServer(fakeserver.FakeServer):
+    """Returns headers from a generator, and keeps track of how many
+    were produced.
+    """
+    def __init__(self):
+        fakeserver.FakeServer.__init__(self)
+        self.produced = 0
+        self.counts = 0
+
+    def listIdentifiers(self, **kw):
+        for header in fakeserver.FakeServer.listIdentifiers(self, **kw):
+            self.produced += 1
+            yield header
+
+    def countIdentifiers(self, **kw):
+        self.counts += 1
+        return len(fakeserver.FakeServer.listIdentifiers(self, **kw))
+
+class LazyResumptionTestCase(unittest.TestCase):
+    def setUp(self):
+        self._fakeserver = LazyFakeServer()
+        self._server = server.Resumption(self._fakeserver, 10)
+
+    def test_resumption(self):
+        result, token = self._server.listIdentifiers(metadataPrefix='oai_dc')
+        # one more than the batch is read, to know a token is needed
+        self.assertEquals(11, self._fakeserver.produced)
+        self.assertEquals(10, len(result))
+        self.assertEquals(100, token.completeListSize)
+        self.assertEquals(0, token.cursor)
+        self._fakeserver.produced = 0
+        result, token = self._server.listIdentifiers(resumptionToken=token)
+        self.assertEquals(21, self._fakeserver.produced)
+        self.assertEquals([str(i) for i in range(10, 20)],
+                          [header.identifier() for header in result])
+        self.assertEquals(10, token.cursor)
+
+    def test_last_batch(self):
+        myserver = server.Resumption(self._fakeserver, 50)
+        result, token = myserver.listIdentifiers(metadataPrefix='oai_dc')
+        result, token = myserver.listIdentifiers(resumptionToken=token)
+        self.assertEquals(50, len(result))
+        self.assertEquals(None, token)
+
+    def test_no_count(self):
+        myserver = server.Resumption(fakeserver.FakeServer(), 10)
+        result, token = myserver.listIdentifiers(metadataPrefix='oai_dc')
+        self.assertEquals(None, token.completeListSize)
+        self.assertEquals(0, token.cursor)
+
+    def test_client(self):
+        myserver = server.Server(self._fakeserver, metadata.MetadataRegistry(),
+                                 resumption_batch_size=30)
+        myclient = client.ServerClient(myserver)
+        batches = list(myclient.iterBatches('ListIdentifiers',
+                                            metadataPrefix='oai_dc'))
+        self.assertEquals([30, 30, 30, 10],
+                          [len(headers) for headers, token in batches])
+        self.assertEquals([100, 100, 100],
+                          [token.completeListSize for headers, token
+                           in batches[:-1]])
+        self.assertEquals([0, 30, 60],
+                          [token.cursor for headers, token in batches[:-1]])
+        # the list is counted once, its size is kept in the tokens
+        self.assertEquals(1, self._fakeserver.counts)
+
+class ResultCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self._fakeserver = CountingFakeServer()
+
+    def harvest(self, resumption_server, **kw):
+        headers = []
+        result, token = resumption_server.listIdentifiers(
+            metadataPrefix='oai_dc', **kw)
+        headers.extend(result)
+        while token is not None:
+            result, token = resumption_server.listIdentifiers(
+                resumptionToken=token)
+            headers.extend(result)
+        return [header.identifier() for header in headers]
+
+    def test_resumption(self):
+        cache = server.ResultCache()
+        myserver = server.Resumption(self._fakeserver, 10, cache)
+        self.assertEquals([str(i) for i in range(100)], self.harvest(myserver))
+        self.assertEquals(1, self._fakeserver.queries)
+        self.assertEquals(52, len(self.harvest(
+            myserver, from_=datetime(2004, 1, 1),
+            until=datetime(2004, 7, 1))))
+        self.assertEquals(2, self._fakeserver.queries)
+        stats = cache.stats()
+        self.assertEquals(2, stats['results'])
+        self.assertEquals(152, stats['items'])
+        self.assertEquals(9 + 5, stats['hits'])
+        self.assertEquals(2, stats['misses'])
+
+    def test_small_result(self):
+        cache = server.ResultCache()
+        myserver = server.Resumption(self._fakeserver, 300, cache)
+        self.harvest(myserver)
+        # a result that fits in one batch is not kept
+        self.assertEquals(0, cache.stats()['results'])
+
+    def test_evictions(self):
+        cache = server.ResultCache(max_results=2, max_items=120)
+        for i in range(3):
+            cache.put(i, list(range(50)))
+        self.assertEquals(None, cache.get(0))
+        self.assertEquals(list(range(50)), cache.get(1))
+        cache.put(3, list(range(100)))
+        # 2 was used least recently
+        self.assertEquals(None, cache.get(2))
+        self.assertEquals(None, cache.get(1))
+        stats = cache.stats()
+        self.assertEquals(3, stats['evictions'])
+        self.assertEquals(100, stats['items'])
+        self.assertEquals(1, stats['results'])
+
+    def test_ttl(self):
+        cache = server.ResultCache(ttl=-1)
+        myserver = server.Resumption(self._fakeserver, 10, cache)
+        self.assertEquals([str(i) for i in range(100)], self.harvest(myserver))
+        self.assertEquals(10, self._fakeserver.queries)
+        self.assertEquals(9, cache.stats()['expirations'])
+
+    def test_server(self):
+        cache = server.ResultCache()
+        metadata_registry = metadata.MetadataRegistry()
+        metadata_registry.registerReader('oai_dc', metadata.oai_dc_reader)
+        myserver = server.Server(self._fakeserver, metadata_registry,
+                                 resumption_batch_size=7, result_cache=cache)
+        myclient = client.ServerClient(myserver, metadata_registry)
+        headers = list(myclient.listIdentifiers(metadataPrefix='oai_dc'))
+        self.assertEquals(100, len(headers))
+        self.assertEquals(1, self._fakeserver.queries)
+
+    def test_completeListSize(self):
+        myserver = server.Resumption(self._fakeserver, 10,
+                                     server.ResultCache())
+        result, token = myserver.listIdentifiers(metadataPrefix='oai_dc')
+        result, token = myserver.listIdentifiers(resumptionToken=token)
+        self.assertEquals(100, token.completeListSize)
+        self.assertEquals(10, token.cursor)
+
 class BatchingResumptionTestCase(unittest.TestCase):
     def setUp(self):
         self._fakeserver = fakeserver.BatchingFakeServer()
@@ -202,6 +358,131 @@ class BatchingResumptionTestCase(unittest.TestCase):
             tree.xpath('//oai:resumptionToken/text()', 
                        namespaces={'oai': NS_OAIPMH} ))
         
+class KeysetFakeServer(fakeserver.BatchingFakeServer):
+    """Supports keyset pagination, recording the cursors and
+    continuations it is asked for.
+    """
+    def __init__(self, opaque=False):
+        fakeserver.BatchingFakeServer.__init__(self)
+        self._data.sort(key=lambda record: (record[0].datestamp(),
+                                            record[0].identifier()))
+        self.opaque = opaque
+        self.calls = []
+        self.counts = 0
+
+    def listIdentifiers(self, metadataPrefix=None, from_=None, until=None,
+                        set=None, cursor=None, batch_size=10, after=None):
+        self.calls.append((cursor, after))
+        headers = [header for header, metadata, about in self._data
+                   if fakeserver.datestampInRange(header, from_, until)]
+        if cursor is not None:
+            return headers[cursor:cursor + batch_size]
+        if self.opaque and after is not None:
+            after = (self._data[int(after)][0].datestamp(),
+                     self._data[int(after)][0].identifier())
+        result = []
+        for header in headers:
+            if after is None or (
+                (header.datestamp(), header.identifier()) > after):
+                result.append(header)
+                if len(result) == batch_size:
+                    break
+        return result
+
+    def countIdentifiers(self, **kw):
+        self.counts += 1
+        return len(self._data)
+
+    def getContinuation(self, verb, header):
+        if not self.opaque:
+            return header.datestamp(), header.identifier()
+        for i, record in enumerate(self._data):
+            if record[0] is header:
+                return str(i)
+
+class KeysetResumptionTestCase(unittest.TestCase):
+    def harvest(self, resumption_server):
+        headers = []
+        result, token = resumption_server.listIdentifiers(
+            metadataPrefix='oai_dc')
+        headers.extend(result)
+        while token is not None:
+            result, token = resumption_server.listIdentifiers(
+                resumptionToken=token)
+            headers.extend(result)
+        return [header.identifier() for header in headers]
+
+    def expected(self, fake_server):
+        return [header.identifier() for header, metadata, about
+                in fake_server._data]
+
+    def test_keyset(self):
+        fake_server = KeysetFakeServer()
+        myserver = server.BatchingResumption(fake_server, 13, keyset=True)
+        self.assertEquals(self.expected(fake_server), self.harvest(myserver))
+        self.assertEquals(8, len(fake_server.calls))
+        self.assertEquals(1, fake_server.counts)
+        # never a cursor, always the last item of the previous batch
+        self.assertEquals([None] * 8,
+                          [cursor for cursor, after in fake_server.calls])
+        self.assertEquals(None, fake_server.calls[0][1])
+        header = fake_server._data[12][0]
+        self.assertEquals((header.datestamp(), header.identifier()),
+                          fake_server.calls[1][1])
+
+    def test_opaque(self):
+        fake_server = KeysetFakeServer(opaque=True)
+        myserver = server.BatchingResumption(fake_server, 13, keyset=True)
+        self.assertEquals(self.expected(fake_server), self.harvest(myserver))
+        self.assertEquals([None, '12', '25'],
+                          [after for cursor, after in fake_server.calls[:3]])
+
+    def test_token(self):
+        fake_server = KeysetFakeServer()
+        myserver = server.BatchingResumption(fake_server, 10, keyset=True)
+        result, token = myserver.listIdentifiers(metadataPrefix='oai_dc')
+        result, token = myserver.listIdentifiers(resumptionToken=token)
+        self.assertEquals(100, token.completeListSize)
+        self.assertEquals(10, token.cursor)
+        self.assertRaises(error.BadResumptionTokenError,
+                          myserver.listIdentifiers,
+                          resumptionToken=token.replace('after_datestamp',
+                                                        'after_foo'))
+        self.assertTrue('completeListSize%3D100' in token)
+        self.assertRaises(error.BadResumptionTokenError,
+                          myserver.listIdentifiers,
+                          resumptionToken=token.replace(
+                              'completeListSize%3D100',
+                              'completeListSize%3Dfoo'))
+
+    def test_offset_token(self):
+        fake_server = KeysetFakeServer()
+        offset_server = server.BatchingResumption(fake_server, 10)
+        result, token = offset_server.listIdentifiers(metadataPrefix='oai_dc')
+        self.assertEquals((0, None), fake_server.calls[-1])
+        # a token from before keyset pagination was switched on
+        myserver = server.BatchingResumption(fake_server, 10, keyset=True)
+        result, token = myserver.listIdentifiers(resumptionToken=token)
+        self.assertEquals((10, None), fake_server.calls[-1])
+        self.assertEquals(self.expected(fake_server)[10:20],
+                          [header.identifier() for header in result])
+        # which continues with keyset pagination
+        result, token = myserver.listIdentifiers(resumptionToken=token)
+        self.assertEquals(None, fake_server.calls[-1][0])
+        self.assertEquals(self.expected(fake_server)[20:30],
+                          [header.identifier() for header in result])
+
+    def test_server(self):
+        fake_server = KeysetFakeServer()
+        metadata_registry = metadata.MetadataRegistry()
+        myserver = server.BatchingServer(fake_server, metadata_registry,
+                                         resumption_batch_size=7, keyset=True)
+        myclient = client.ServerClient(myserver, metadata_registry)
+        self.assertEquals(
+            self.expected(fake_server),
+            [header.identifier() for header in
+             myclient.listIdentifiers(metadataPrefix='oai_dc')])
+
 class ClientServerTestCase(unittest.TestCase):
     def setUp(self):
         self._fakeserver = fakeserver.FakeServer()
@@ -243,6 +524,21 @@ class ClientServerTestCase(unittest.TestCase):
                           self._client.listIdentifiers,
                           metadataPrefix='oai_dc', from_=datetime(2003, 1, 1),
                           until=datetime(2003, 7, 1))        
+
+    def test_listRecords_streaming(self):
+        self._client.setStreaming(True)
+        records = self._client.listRecords(metadataPrefix='oai_dc')
+        result = [metadata.getField('title')[0]
+                  for (header, metadata, about) in records]
+        expected = ['Title %s' % i for i in range(100)]
+        self.assertEqual(expected, result)
+
+    def test_listIdentifiersFromUntil_nothing_streaming(self):
+        self._client.setStreaming(True)
+        self.assertRaises(error.NoRecordsMatchError,
+                          self._client.listIdentifiers,
+                          metadataPrefix='oai_dc', from_=datetime(2003, 1, 1),
+                          until=datetime(2003, 7, 1))
         
         
 class ErrorTestCase(unittest.TestCase):
@@ -389,6 +685,264 @@ class DeletionTestCase(unittest.TestCase):
         self.assert_(header.isDeleted())
         self.assertEquals(None, metadata)
 
+class StreamingTestCase(unittest.TestCase):
+    def setUp(self):
+        self._fakeserver = fakeserver.FakeServer()
+        self._metadata_registry = metadata.MetadataRegistry()
+        self._metadata_registry.registerWriter('oai_dc', server.oai_dc_writer)
+        self._server = server.Server(self._fakeserver,
+                                     self._metadata_registry,
+                                     resumption_batch_size=7)
+
+    def canonical(self, xml):
+        parser = etree.XMLParser(remove_blank_text=True)
+        tree = etree.parse(BytesIO(xml), parser)
+        for e in tree.xpath('//oai:responseDate',
+                            namespaces={'oai': NS_OAIPMH}):
+            e.text = None
+        return etree.tostring(tree, method='c14n')
+
+    def assertSameResponse(self, request):
+        xml = b''.join(self._server.handleRequestStreaming(request))
+        self.assert_(oaischema.validate(etree_parse(xml)))
+        self.assertEquals(
+            self.canonical(self._server.handleRequest(request)),
+            self.canonical(xml))
+        return xml
+
+    def test_listRecords(self):
+        self.assertSameResponse({'verb': 'ListRecords',
+                                 'metadataPrefix': 'oai_dc'})
+
+    def test_listIdentifiers(self):
+        self.assertSameResponse({'verb': 'ListIdentifiers',
+                                 'metadataPrefix': 'oai_dc',
+                                 'from': '2004-01-01',
+                                 'until': '2004-07-01'})
+
+    def test_resumption(self):
+        xml = self._server.handleRequest({'verb': 'ListIdentifiers',
+                                          'metadataPrefix': 'oai_dc'})
+        token = etree_parse(xml).xpath(
+            '//oai:resumptionToken/text()', namespaces={'oai': NS_OAIPMH})[0]
+        self.assertSameResponse({'verb': 'ListIdentifiers',
+                                 'resumptionToken': token})
+
+    def test_size(self):
+        for verb in ['ListIdentifiers', 'ListRecords']:
+            request = {'verb': verb, 'metadataPrefix': 'oai_dc'}
+            xml = self.assertSameResponse(request)
+            # the namespaces are only declared once, like in a complete
+            # response
+            self.assertEquals(len(self._server.handleRequest(request)),
+                              len(xml))
+            self.assertEquals(1, xml.count(b'xmlns='))
+            self.assertEquals(1, xml.count(b'xmlns:xsi='))
+
+    def test_identify(self):
+        self.assertSameResponse({'verb': 'Identify'})
+
+    def test_errors(self):
+        for request in [
+            {'verb': 'Frotz'},
+            {'verb': 'ListRecords', 'metadataPrefix': 'nonexistent'},
+            {'verb': 'ListRecords', 'metadataPrefix': 'oai_dc',
+             'from': '2003-01-01', 'until': '2003-07-01'},
+            {'verb': 'ListRecords', 'resumptionToken': 'foobar'}]:
+            chunks = list(self._server.handleRequestStreaming(request))
+            self.assertEquals(1, len(chunks))
+            self.assertEquals(self.canonical(
+                self._server.handleRequest(request)),
+                self.canonical(chunks[0]))
+
+    def test_chunks(self):
+        rendered = []
+        def writer(element, metadata):
+            rendered.append(metadata)
+            server.oai_dc_writer(element, metadata)
+        self._metadata_registry.registerWriter('oai_dc', writer)
+        chunks = self._server.handleRequestStreaming(
+            {'verb': 'ListRecords', 'metadataPrefix': 'oai_dc'})
+        # the envelope comes before any record is rendered
+        first = next(chunks)
+        self.assert_(first.startswith(b'<?xml'))
+        self.assertEquals([], rendered)
+        list(chunks)
+        self.assertEquals(7, len(rendered))
+
+    def test_chunk_size(self):
+        tree_server = server.XMLTreeServer(
+            server.Resumption(self._fakeserver, 100),
+            self._metadata_registry)
+        chunks = list(tree_server.streamList(
+            'ListRecords', chunk_size=1024, metadataPrefix='oai_dc'))
+        self.assert_(len(chunks) > 10)
+        for chunk in chunks[1:-1]:
+            self.assert_(len(chunk) >= 1024)
+        tree = etree_parse(b''.join(chunks))
+        self.assertEquals(100, len(tree.xpath(
+            '//oai:record', namespaces={'oai': NS_OAIPMH})))
+
+class CountingIdentifyServer(fakeserver.FakeServer):
+    def __init__(self):
+        fakeserver.FakeServer.__init__(self)
+        self.identified = 0
+        self.baseURL = 'http://www.infrae.com/oai/'
+
+    def identify(self):
+        self.identified += 1
+        identify = fakeserver.FakeServer.identify(self)
+        identify._baseURL = self.baseURL
+        return identify
+
+class IdentifyCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self._fakeserver = CountingIdentifyServer()
+        metadata_registry = metadata.MetadataRegistry()
+        metadata_registry.registerWriter('oai_dc', server.oai_dc_writer)
+        self._server = server.Server(self._fakeserver, metadata_registry)
+
+    def findText(self, xml, path):
+        return etree_parse(xml).xpath(path, namespaces={'oai': NS_OAIPMH})
+
+    def test_cached(self):
+        for i in range(3):
+            xml = self._server.handleRequest({'verb': 'ListIdentifiers',
+                                              'metadataPrefix': 'oai_dc'})
+            self.assertEquals(['http://www.infrae.com/oai/'],
+                              self.findText(xml, '//oai:request/text()'))
+            xml = self._server.handleRequest({'verb': 'Identify'})
+            self.assert_(oaischema.validate(etree_parse(xml)))
+            # the description elements are copied into each response
+            self.assertEquals(1, len(self.findText(xml, '//oai:description')))
+        self.assertEquals(1, self._fakeserver.identified)
+
+    def test_invalidate(self):
+        self._server.handleRequest({'verb': 'Identify'})
+        self._fakeserver.baseURL = 'http://example.com/oai'
+        self._server.invalidateIdentify()
+        xml = self._server.handleRequest({'verb': 'Identify'})
+        self.assertEquals(['http://example.com/oai'],
+                          self.findText(xml, '//oai:baseURL/text()'))
+        self.assertEquals(['http://example.com/oai'],
+                          self.findText(xml, '//oai:request/text()'))
+        self.assertEquals(2, self._fakeserver.identified)
+
+    def test_toolkitDescription(self):
+        self.assert_(common.getToolkitDescription() is
+                     common.getToolkitDescription())
+        self.assertEquals([common.getToolkitDescription()],
+                          self._fakeserver.identify().descriptions())
+
+class SpecialCharactersServer(fakeserver.FakeServer):
+    def __init__(self):
+        fakeserver.FakeServer.__init__(self)
+        self._data = [
+            (common.Header(None, 'a&b<c>"d"', datetime(2004, 1, 1),
+                           ['x&y', 'z'], False),
+             common.Metadata(None, {'title': [u'caf\xe9 <&> "\r\n"'],
+                                    'creator': [None, ''],
+                                    'rights': ['\t']}),
+             None),
+            (common.Header(None, 'empty', datetime(2004, 1, 2), [], False),
+             common.Metadata(None, {}), None),
+            ]
+
+def custom_writer(element, metadata):
+    e_custom = SubElement(element, '{http://example.com/custom}custom',
+                          nsmap={'c': 'http://example.com/custom'})
+    e_custom.set('{%s}schemaLocation' % server.NS_XSI, 'x y')
+    for value in metadata.getMap().get('title', []):
+        e = SubElement(e_custom, '{http://example.com/custom}title')
+        e.text = value
+
+class TemplateTestCase(unittest.TestCase):
+    def getServers(self, fake_server, **kw):
+        metadata_registry = metadata.MetadataRegistry()
+        metadata_registry.registerWriter('oai_dc', server.oai_dc_writer)
+        metadata_registry.registerWriter('custom', custom_writer)
+        tree_server = server.Server(fake_server, metadata_registry,
+                                    resumption_batch_size=7, **kw)
+        template_server = server.Server(fake_server, metadata_registry,
+                                        resumption_batch_size=7, **kw)
+        template_server.setTemplateRendering(True)
+        return tree_server, template_server
+
+    def assertSameResponses(self, fake_server, requests, validate=True,
+                            **kw):
+        tree_server, template_server = self.getServers(fake_server, **kw)
+        for request in requests:
+            expected = self.normalize(tree_server.handleRequest(request))
+            xml = template_server.handleRequest(request)
+            self.assertEquals(expected, self.normalize(xml))
+            self.assertEquals(expected, self.normalize(b''.join(
+                template_server.handleRequestStreaming(request))))
+            if validate:
+                self.assert_(oaischema.validate(etree_parse(xml)))
+
+    def normalize(self, xml):
+        return re.sub(b'<responseDate>[^<]*</responseDate>',
+                      b'<responseDate/>', xml)
+
+    def test_fakeServer(self):
+        xml = server.Server(fakeserver.FakeServer()).handleRequest(
+            {'verb': 'ListIdentifiers', 'metadataPrefix': 'oai_dc'})
+        token = etree_parse(xml).xpath(
+            '//oai:resumptionToken/text()', namespaces={'oai': NS_OAIPMH})[0]
+        self.assertSameResponses(fakeserver.FakeServer(), [
+            {'verb': 'ListRecords', 'metadataPrefix': 'oai_dc'},
+            {'verb': 'ListRecords', 'metadataPrefix': 'custom',
+             'from': '2004-01-01', 'until': '2004-07-01'},
+            {'verb': 'ListIdentifiers', 'resumptionToken': token},
+            {'verb': 'GetRecord', 'metadataPrefix': 'oai_dc',
+             'identifier': '3'},
+            {'verb': 'GetRecord', 'metadataPrefix': 'custom',
+             'identifier': '3'},
+            {'verb': 'ListRecords', 'metadataPrefix': 'nonexistent'},
+            {'verb': 'ListRecords', 'metadataPrefix': 'oai_dc',
+             'from': '2003-01-01', 'until': '2003-07-01'},
+            {'verb': 'Identify'},
+            ])
+
+    def test_deletions(self):
+        fake_server = fakeserver.FakeServerWithDeletions()
+        fake_server.deletionEvent()
+        self.assertSameResponses(fake_server, [
+            {'verb': 'ListRecords', 'metadataPrefix': 'oai_dc'},
+            {'verb': 'ListIdentifiers', 'metadataPrefix': 'oai_dc'},
+            {'verb': 'GetRecord', 'metadataPrefix': 'nonexistent',
+             'identifier': '1'},
+            ])
+
+    def test_sets(self):
+        self.assertSameResponses(fakeserver.SetFakeServer(), [
+            {'verb': 'ListRecords', 'metadataPrefix': 'oai_dc',
+             'set': 'three'},
+            {'verb': 'ListIdentifiers', 'metadataPrefix': 'oai_dc'},
+            ])
+
+    def test_escaping(self):
+        self.assertSameResponses(SpecialCharactersServer(), [
+            {'verb': 'ListRecords', 'metadataPrefix': 'oai_dc'},
+            {'verb': 'ListRecords', 'metadataPrefix': 'custom'},
+            {'verb': 'ListIdentifiers', 'metadataPrefix': 'oai_dc'},
+            # setSpecs can't hold these characters
+            ], validate=False)
+
+    def test_nsmap(self):
+        self.assertSameResponses(fakeserver.FakeServer(), [
+            {'verb': 'ListRecords', 'metadataPrefix': 'oai_dc'},
+            {'verb': 'ListRecords', 'metadataPrefix': 'custom'},
+            ], nsmap={'cow': 'http://www.cow.com', 'dc': server.NS_DC})
+
+    def test_invalidCharacters(self):
+        fake_server = SpecialCharactersServer()
+        fake_server._data[0][1].getMap()['title'] = ['\x01']
+        for oai_server in self.getServers(fake_server):
+            self.assertRaises(ValueError, oai_server.handleRequest,
+                              {'verb': 'ListRecords',
+                               'metadataPrefix': 'oai_dc'})
+
 class NsMapTestCase(unittest.TestCase):
     def setUp(self):
         self._fakeserver = fakeserver.FakeServer()
@@ -418,10 +972,16 @@ def test_suite():
         unittest.makeSuite(XMLTreeServerTestCase),
         unittest.makeSuite(ServerTestCase),
         unittest.makeSuite(ResumptionTestCase),
+        unittest.makeSuite(LazyResumptionTestCase),
+        unittest.makeSuite(ResultCacheTestCase),
         unittest.makeSuite(BatchingResumptionTestCase),
+        unittest.makeSuite(KeysetResumptionTestCase),
         unittest.makeSuite(ClientServerTestCase),
         unittest.makeSuite(ErrorTestCase),
         unittest.makeSuite(DeletionTestCase),
+        unittest.makeSuite(StreamingTestCase),
+        unittest.makeSuite(IdentifyCacheTestCase),
+        unittest.makeSuite(TemplateTestCase),
         unittest.makeSuite(NsMapTestCase)])
 
 if __name__=='__main__':
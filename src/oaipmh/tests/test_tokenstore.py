@@ -0,0 +1,168 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+from datetime import datetime, timedelta
+from unittest import TestCase, TestSuite, makeSuite, main
+
+from lxml import etree
+
+import fakeserver
+from oaipmh import client, error, metadata, server, tokenstore
+
+NS = {'oai': server.NS_OAIPMH}
+
+class CountingFakeServer(fakeserver.FakeServer):
+    def __init__(self):
+        fakeserver.FakeServer.__init__(self)
+        self.counts = 0
+
+    def countRecords(self, **kw):
+        self.counts += 1
+        return len(self.listRecords(**kw))
+
+class BatchingCountingFakeServer(fakeserver.BatchingFakeServer):
+    def countIdentifiers(self, **kw):
+        return len(self._data)
+
+class MemoryTokenStoreTestCase(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.registry = metadata.MetadataRegistry()
+        self.registry.registerWriter('oai_dc', server.oai_dc_writer)
+        self.registry.registerReader('oai_dc', metadata.oai_dc_reader)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def createStore(self, ttl=tokenstore.DEFAULT_TTL):
+        return tokenstore.MemoryTokenStore(ttl=ttl)
+
+    def test_put(self):
+        store = self.createStore()
+        token, expirationDate = store.put('metadataPrefix=oai_dc&cursor=10',
+                                          100)
+        self.assertEqual(16, len(token))
+        self.assertTrue(abs(datetime.utcnow() + timedelta(hours=1) -
+                            expirationDate) < timedelta(seconds=5))
+        self.assertEqual(('metadataPrefix=oai_dc&cursor=10', 100),
+                         store.get(token))
+        # tokens can be used again
+        self.assertEqual(('metadataPrefix=oai_dc&cursor=10', 100),
+                         store.get(token))
+        other, expirationDate = store.put('metadataPrefix=oai_dc&cursor=20')
+        self.assertNotEqual(token, other)
+        self.assertEqual(('metadataPrefix=oai_dc&cursor=20', None),
+                         store.get(other))
+        self.assertEqual(None, store.get('foo'))
+        store.clear()
+        self.assertEqual(None, store.get(token))
+
+    def test_expired(self):
+        store = self.createStore(ttl=-1)
+        token, expirationDate = store.put('cursor=10')
+        self.assertEqual(None, store.get(token))
+
+    def test_max_tokens(self):
+        store = tokenstore.MemoryTokenStore(max_tokens=3)
+        tokens = [store.put('cursor=%s' % i)[0] for i in range(5)]
+        self.assertEqual(3, len(store))
+        self.assertEqual([None, None, ('cursor=2', None)],
+                         [store.get(token) for token in tokens[:3]])
+
+    def harvest(self, myserver, verb='ListRecords'):
+        myclient = client.ServerClient(myserver, self.registry)
+        method = {'ListRecords': myclient.listRecords,
+                  'ListIdentifiers': myclient.listIdentifiers}[verb]
+        items = method(metadataPrefix='oai_dc')
+        if verb == 'ListRecords':
+            return [header.identifier() for header, md, about in items]
+        return [header.identifier() for header in items]
+
+    def test_server(self):
+        fake_server = CountingFakeServer()
+        myserver = server.Server(fake_server, self.registry,
+                                 resumption_batch_size=7,
+                                 token_store=self.createStore())
+        self.assertEqual([str(i) for i in range(100)], self.harvest(myserver))
+        # the complete list size is kept in the store
+        self.assertEqual(1, fake_server.counts)
+        myserver.setTemplateRendering(True)
+        self.assertEqual([str(i) for i in range(100)], self.harvest(myserver))
+
+    def test_token(self):
+        myserver = server.Server(CountingFakeServer(), self.registry,
+                                 resumption_batch_size=7,
+                                 token_store=self.createStore())
+        tree = etree.fromstring(myserver.handleRequest(
+            {'verb': 'ListRecords', 'metadataPrefix': 'oai_dc'}))
+        e_token, = tree.xpath('//oai:resumptionToken', namespaces=NS)
+        self.assertEqual(16, len(e_token.text))
+        self.assertEqual('100', e_token.get('completeListSize'))
+        self.assertEqual('0', e_token.get('cursor'))
+        self.assertTrue(e_token.get('expirationDate') >
+                        server.datetime_to_datestamp(datetime.utcnow()))
+        tree = etree.fromstring(myserver.handleRequest(
+            {'verb': 'ListRecords', 'resumptionToken': e_token.text}))
+        e_token, = tree.xpath('//oai:resumptionToken', namespaces=NS)
+        self.assertEqual('7', e_token.get('cursor'))
+
+    def test_bad_token(self):
+        myserver = server.Server(fakeserver.FakeServer(), self.registry,
+                                 token_store=self.createStore())
+        tree = etree.fromstring(myserver.handleRequest(
+            {'verb': 'ListRecords', 'resumptionToken': 'foo'}))
+        self.assertEqual(['badResumptionToken'],
+                         tree.xpath('//oai:error/@code', namespaces=NS))
+        # tokens that hold the request aren't accepted either
+        resumption = server.Resumption(fakeserver.FakeServer(), 7)
+        result, token = resumption.listIdentifiers(metadataPrefix='oai_dc')
+        resumption = server.Resumption(fakeserver.FakeServer(), 7,
+                                       token_store=self.createStore())
+        self.assertRaises(error.BadResumptionTokenError,
+                          resumption.listIdentifiers, resumptionToken=token)
+
+    def test_batching(self):
+        myserver = server.BatchingServer(BatchingCountingFakeServer(),
+                                         self.registry,
+                                         resumption_batch_size=7,
+                                         token_store=self.createStore())
+        self.assertEqual([str(i) for i in range(100)],
+                         self.harvest(myserver, 'ListIdentifiers'))
+
+class SQLiteTokenStoreTestCase(MemoryTokenStoreTestCase):
+
+    def createStore(self, ttl=tokenstore.DEFAULT_TTL, purge_interval=60):
+        return tokenstore.SQLiteTokenStore(
+            os.path.join(self.directory, 'tokens.db'), ttl, purge_interval)
+
+    def countRows(self):
+        connection = sqlite3.connect(
+            os.path.join(self.directory, 'tokens.db'))
+        try:
+            return connection.execute(
+                'SELECT COUNT(*) FROM resumption_token').fetchone()[0]
+        finally:
+            connection.close()
+
+    def test_shared(self):
+        token, expirationDate = self.createStore().put('cursor=10', 100)
+        self.assertEqual(('cursor=10', 100), self.createStore().get(token))
+
+    def test_purge(self):
+        store = self.createStore(ttl=-1, purge_interval=3600)
+        store.put('cursor=10')
+        store.put('cursor=20')
+        # purged when the first token was stored
+        self.assertEqual(1, self.countRows())
+        store = self.createStore(ttl=-1, purge_interval=0)
+        store.put('cursor=30')
+        self.assertEqual(0, self.countRows())
+
+def test_suite():
+    return TestSuite((makeSuite(MemoryTokenStoreTestCase),
+                      makeSuite(SQLiteTokenStoreTestCase)))
+
+if __name__ == '__main__':
+    main()
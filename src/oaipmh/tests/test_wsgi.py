@@ -0,0 +1,240 @@
+import gzip
+import io
+import threading
+import zlib
+from unittest import TestCase, TestSuite, makeSuite, main
+from wsgiref.simple_server import make_server, WSGIRequestHandler
+from wsgiref.util import setup_testing_defaults
+
+from lxml import etree
+
+from fakeserver import FakeServer
+from oaipmh import client, error, metadata, server, wsgi
+
+NS = {'oai': server.NS_OAIPMH}
+
+class CompressingFakeServer(FakeServer):
+    compression = ['gzip', 'deflate']
+
+    def identify(self):
+        identify = FakeServer.identify(self)
+        identify._compression = self.compression
+        return identify
+
+class FailingIdentifyFakeServer(CompressingFakeServer):
+    """Raises exception the first time Identify is asked for.
+    """
+    def __init__(self, exception):
+        CompressingFakeServer.__init__(self)
+        self.exception = exception
+
+    def identify(self):
+        if self.exception is not None:
+            exception, self.exception = self.exception, None
+            raise exception
+        return CompressingFakeServer.identify(self)
+
+def createServer(fake_server):
+    registry = metadata.MetadataRegistry()
+    registry.registerWriter('oai_dc', server.oai_dc_writer)
+    registry.registerReader('oai_dc', metadata.oai_dc_reader)
+    return server.Server(fake_server, registry, resumption_batch_size=7)
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+class WSGIApplicationTestCase(TestCase):
+
+    def setUp(self):
+        self.app = wsgi.WSGIApplication(createServer(CompressingFakeServer()))
+
+    def request(self, query='', method='GET', body=b'', **headers):
+        environ = {'REQUEST_METHOD': method, 'QUERY_STRING': query,
+                   'CONTENT_LENGTH': str(len(body)),
+                   'wsgi.input': io.BytesIO(body)}
+        environ.update(headers)
+        setup_testing_defaults(environ)
+        response = {}
+        def start_response(status, headers):
+            response['status'] = status
+            response['headers'] = dict(headers)
+        chunks = list(self.app(environ, start_response))
+        return response['status'], response['headers'], chunks
+
+    def test_get(self):
+        status, headers, chunks = self.request(
+            'verb=ListIdentifiers&metadataPrefix=oai_dc')
+        self.assertEqual('200 OK', status)
+        self.assertEqual('text/xml; charset=utf-8', headers['Content-Type'])
+        self.assertEqual('Accept-Encoding', headers['Vary'])
+        self.assertFalse('Content-Encoding' in headers)
+        tree = etree.fromstring(b''.join(chunks))
+        self.assertEqual(7, len(tree.xpath('//oai:header', namespaces=NS)))
+
+    def test_post(self):
+        status, headers, chunks = self.request(
+            method='POST', body=b'verb=GetRecord&metadataPrefix=oai_dc'
+            b'&identifier=3',
+            CONTENT_TYPE='application/x-www-form-urlencoded')
+        tree = etree.fromstring(b''.join(chunks))
+        self.assertEqual(['3'], tree.xpath('//oai:identifier/text()',
+                                           namespaces=NS))
+
+    def test_post_utf8(self):
+        status, headers, chunks = self.request(
+            method='POST', body=u'verb=ListIdentifiers&metadataPrefix=oai_dc'
+            u'&set=s\xe9t'.encode('utf-8'),
+            CONTENT_TYPE='application/x-www-form-urlencoded')
+        tree = etree.fromstring(b''.join(chunks))
+        self.assertEqual([u's\xe9t'], tree.xpath('//oai:request/@set',
+                                                 namespaces=NS))
+
+    def test_get_utf8(self):
+        # the bytes of the URL as latin-1 text, see PEP 3333
+        status, headers, chunks = self.request(
+            u'verb=ListIdentifiers&metadataPrefix=oai_dc&set=s\xe9t'.encode(
+                'utf-8').decode('latin-1'))
+        tree = etree.fromstring(b''.join(chunks))
+        self.assertEqual([u's\xe9t'], tree.xpath('//oai:request/@set',
+                                                 namespaces=NS))
+
+    def test_head(self):
+        status, headers, chunks = self.request(
+            'verb=ListIdentifiers&metadataPrefix=oai_dc', method='HEAD',
+            HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual('200 OK', status)
+        self.assertEqual('text/xml; charset=utf-8', headers['Content-Type'])
+        self.assertEqual('gzip', headers['Content-Encoding'])
+        self.assertEqual([], chunks)
+
+    def test_repeated(self):
+        status, headers, chunks = self.request(
+            'verb=Identify&verb=Identify')
+        tree = etree.fromstring(b''.join(chunks))
+        self.assertEqual(['badArgument'], tree.xpath('//oai:error/@code',
+                                                     namespaces=NS))
+
+    def test_error(self):
+        status, headers, chunks = self.request('verb=Frotz')
+        self.assertEqual('200 OK', status)
+        tree = etree.fromstring(b''.join(chunks))
+        self.assertEqual(['badVerb'], tree.xpath('//oai:error/@code',
+                                                 namespaces=NS))
+
+    def test_method(self):
+        status, headers, chunks = self.request(method='PUT')
+        self.assertEqual('405 Method Not Allowed', status)
+        self.assertEqual('GET, HEAD, POST', headers['Allow'])
+
+    def test_too_large(self):
+        self.app = wsgi.WSGIApplication(
+            createServer(FakeServer()), max_content_length=10)
+        status, headers, chunks = self.request(
+            method='POST', body=b'verb=Identify&foo=bar')
+        self.assertEqual('413 Request Entity Too Large', status)
+
+    def test_gzip(self):
+        status, headers, chunks = self.request(
+            'verb=ListRecords&metadataPrefix=oai_dc',
+            HTTP_ACCEPT_ENCODING='deflate;q=0.5, gzip')
+        self.assertEqual('gzip', headers['Content-Encoding'])
+        xml = gzip.GzipFile(fileobj=io.BytesIO(b''.join(chunks))).read()
+        tree = etree.fromstring(xml)
+        self.assertEqual(7, len(tree.xpath('//oai:record', namespaces=NS)))
+
+    def test_deflate(self):
+        status, headers, chunks = self.request(
+            'verb=Identify', HTTP_ACCEPT_ENCODING='gzip;q=0, deflate')
+        self.assertEqual('deflate', headers['Content-Encoding'])
+        tree = etree.fromstring(zlib.decompress(b''.join(chunks)))
+        self.assertEqual(['gzip', 'deflate'], tree.xpath(
+            '//oai:compression/text()', namespaces=NS))
+
+    def test_not_advertised(self):
+        self.app = wsgi.WSGIApplication(createServer(FakeServer()))
+        status, headers, chunks = self.request(
+            'verb=Identify', HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertFalse('Content-Encoding' in headers)
+        self.assertFalse('Vary' in headers)
+
+    def test_invalidateIdentify(self):
+        fake_server = CompressingFakeServer()
+        fake_server.compression = ['identity']
+        self.app = wsgi.WSGIApplication(createServer(fake_server))
+        status, headers, chunks = self.request(
+            'verb=Identify', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse('Content-Encoding' in headers)
+        fake_server.compression = ['gzip']
+        self.app.invalidateIdentify()
+        status, headers, chunks = self.request(
+            'verb=Identify', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual('gzip', headers['Content-Encoding'])
+
+    def test_identify_fails(self):
+        for exception in [ZeroDivisionError(),
+                          error.BadArgumentError("Not available")]:
+            fake_server = FailingIdentifyFakeServer(exception)
+            self.app = wsgi.WSGIApplication(createServer(fake_server))
+            status, headers, chunks = self.request(
+                'verb=ListIdentifiers&metadataPrefix=oai_dc',
+                HTTP_ACCEPT_ENCODING='gzip')
+            self.assertFalse('Content-Encoding' in headers)
+            # Identify is asked again with the next request
+            status, headers, chunks = self.request(
+                'verb=ListIdentifiers&metadataPrefix=oai_dc',
+                HTTP_ACCEPT_ENCODING='gzip')
+            self.assertEqual('gzip', headers['Content-Encoding'])
+
+    def test_chooseEncoding(self):
+        compression = ['gzip', 'deflate']
+        self.assertEqual('gzip', wsgi.chooseEncoding('*', compression))
+        self.assertEqual('deflate', wsgi.chooseEncoding(
+            'identity, deflate', compression))
+        self.assertEqual(None, wsgi.chooseEncoding(
+            'gzip;q=0, deflate;q=0.0', compression))
+        self.assertEqual(None, wsgi.chooseEncoding('', compression))
+
+class WSGIClientTestCase(TestCase):
+    """Harvest through a real WSGI server, with several clients at the
+    same time.
+    """
+    def setUp(self):
+        self.httpd = make_server(
+            '127.0.0.1', 0,
+            wsgi.WSGIApplication(createServer(CompressingFakeServer())),
+            handler_class=QuietHandler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever,
+                                       kwargs={'poll_interval': 0.05})
+        self.thread.daemon = True
+        self.thread.start()
+        self.url = 'http://127.0.0.1:%s/oai' % self.httpd.server_address[1]
+
+    def tearDown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def test_harvest(self):
+        registry = metadata.MetadataRegistry()
+        registry.registerReader('oai_dc', metadata.oai_dc_reader)
+        results = []
+        def harvest(force_http_get):
+            oai_client = client.Client(self.url, registry,
+                                       force_http_get=force_http_get,
+                                       use_compression=True)
+            results.append([header.identifier() for header, md, about in
+                            oai_client.listRecords(metadataPrefix='oai_dc')])
+        threads = [threading.Thread(target=harvest, args=(i % 2,))
+                   for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([[str(i) for i in range(100)]] * 4, results)
+
+def test_suite():
+    return TestSuite((makeSuite(WSGIApplicationTestCase),
+                      makeSuite(WSGIClientTestCase)))
+
+if __name__ == '__main__':
+    main()
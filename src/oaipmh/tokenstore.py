@@ -0,0 +1,150 @@
+"""Stores for the state behind resumption tokens, so that the server can
+hand out short opaque tokens with an expirationDate.
+
+A store keeps for each token the state of the list it continues, the
+encoded arguments of the request and the cursor (see
+server.encodeResumptionToken), and the completeListSize, until the
+token expires. Tokens are not removed when they are used, so a
+harvester can repeat a request until the token expires.
+"""
+import base64
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+# seconds a token is kept by default
+DEFAULT_TTL = 60 * 60
+
+def createKey():
+    """Return a new random token, of 16 URL safe characters.
+    """
+    return base64.urlsafe_b64encode(os.urandom(12)).decode('ascii')
+
+def getExpirationDate(expires):
+    return datetime.utcfromtimestamp(int(expires))
+
+class MemoryTokenStore(object):
+    """Keeps tokens in memory, for a server running in a single process.
+
+    A token is kept ttl seconds. At most max_tokens tokens are kept; when
+    there are more, the oldest tokens are removed before they expire.
+    """
+    def __init__(self, max_tokens=10000, ttl=DEFAULT_TTL):
+        self._max_tokens = max_tokens
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        # key -> (expires, state, completeListSize), as all tokens are
+        # kept equally long the first to expire comes first
+        self._tokens = OrderedDict()
+
+    def put(self, state, completeListSize=None):
+        """Store the state of a list and return (token, expirationDate).
+        """
+        key = createKey()
+        now = time.time()
+        expires = now + self._ttl
+        with self._lock:
+            self._tokens[key] = expires, state, completeListSize
+            while self._tokens:
+                first = next(iter(self._tokens))
+                if (len(self._tokens) <= self._max_tokens and
+                    self._tokens[first][0] >= now):
+                    break
+                del self._tokens[first]
+        return key, getExpirationDate(expires)
+
+    def get(self, token):
+        """Return (state, completeListSize) for token, or None if it is
+        unknown or has expired.
+        """
+        with self._lock:
+            entry = self._tokens.get(token)
+        if entry is None or entry[0] < time.time():
+            return None
+        return entry[1:]
+
+    def clear(self):
+        with self._lock:
+            self._tokens.clear()
+
+    def __len__(self):
+        return len(self._tokens)
+
+class SQLiteTokenStore(object):
+    """Keeps tokens in a SQLite database, which can be shared by several
+    processes serving the same repository.
+
+    A token is kept ttl seconds. Expired tokens are removed when new
+    tokens are stored, at most once every purge_interval seconds.
+    """
+    def __init__(self, path, ttl=DEFAULT_TTL, purge_interval=60):
+        self._path = path
+        self._ttl = ttl
+        self._purge_interval = purge_interval
+        self._purged = 0
+        connection = self._connect()
+        try:
+            with connection:
+                connection.execute(
+                    'CREATE TABLE IF NOT EXISTS resumption_token ('
+                    'token TEXT PRIMARY KEY, state TEXT, '
+                    'complete_list_size INTEGER, expires REAL)')
+                connection.execute(
+                    'CREATE INDEX IF NOT EXISTS resumption_token_expires '
+                    'ON resumption_token (expires)')
+        finally:
+            connection.close()
+
+    def _connect(self):
+        return sqlite3.connect(self._path, timeout=30)
+
+    def put(self, state, completeListSize=None):
+        """Store the state of a list and return (token, expirationDate).
+        """
+        key = createKey()
+        now = time.time()
+        expires = now + self._ttl
+        connection = self._connect()
+        try:
+            with connection:
+                connection.execute(
+                    'INSERT INTO resumption_token '
+                    '(token, state, complete_list_size, expires) '
+                    'VALUES (?, ?, ?, ?)',
+                    (key, state, completeListSize, expires))
+                if self._purged + self._purge_interval <= now:
+                    # harmless if several threads do this at the same time
+                    self._purged = now
+                    connection.execute(
+                        'DELETE FROM resumption_token WHERE expires < ?',
+                        (now,))
+        finally:
+            connection.close()
+        return key, getExpirationDate(expires)
+
+    def get(self, token):
+        """Return (state, completeListSize) for token, or None if it is
+        unknown or has expired.
+        """
+        connection = self._connect()
+        try:
+            row = connection.execute(
+                'SELECT state, complete_list_size FROM resumption_token '
+                'WHERE token = ? AND expires >= ?',
+                (token, time.time())).fetchone()
+        finally:
+            connection.close()
+        if row is None:
+            return None
+        return tuple(row)
+
+    def clear(self):
+        connection = self._connect()
+        try:
+            with connection:
+                connection.execute('DELETE FROM resumption_token')
+        finally:
+            connection.close()
@@ -0,0 +1,181 @@
+"""A WSGI application that serves an OAI-PMH repository.
+"""
+import zlib
+
+from lxml import etree
+
+try:
+    from urllib.parse import parse_qs
+except ImportError:
+    from urlparse import parse_qs
+
+from oaipmh import error
+from oaipmh.server import NS_OAIPMH
+
+# largest POST body accepted, in bytes
+MAX_CONTENT_LENGTH = 64 * 1024
+
+CONTENT_TYPE = 'text/xml; charset=utf-8'
+
+COMPRESSION_WBITS = {
+    'gzip': 16 + zlib.MAX_WBITS,
+    'deflate': zlib.MAX_WBITS,
+    }
+
+class WSGIApplication(object):
+    """Serves the requests for a ServerBase.
+
+    Requests can be done with GET, HEAD or POST, and responses are
+    streamed, see ServerBase.handleRequestStreaming. Arguments are
+    decoded as UTF-8. Responses are compressed
+    with gzip or deflate if the client accepts it and the compression
+    is advertised by Identify; pass `compression` to override what
+    Identify says.
+
+    The application keeps no state per request, so it can be used by
+    multi-threaded and multi-process WSGI servers, as long as the
+    server it wraps can.
+    """
+    def __init__(self, server, compression=None,
+                 max_content_length=MAX_CONTENT_LENGTH,
+                 compression_level=6):
+        self._server = server
+        self._configured_compression = compression
+        self._compression = compression
+        self._max_content_length = max_content_length
+        self._compression_level = compression_level
+
+    def __call__(self, environ, start_response):
+        method = environ.get('REQUEST_METHOD', 'GET')
+        if method in ('GET', 'HEAD'):
+            query = environ.get('QUERY_STRING', '')
+            if not isinstance(query, bytes):
+                # WSGI passes the bytes of the URL as latin-1 text
+                try:
+                    query = query.encode('latin-1')
+                except UnicodeError:
+                    query = query.encode('utf-8')
+        elif method == 'POST':
+            try:
+                length = int(environ.get('CONTENT_LENGTH') or 0)
+            except ValueError:
+                length = 0
+            if length > self._max_content_length:
+                return self.respondStatus(
+                    start_response, '413 Request Entity Too Large')
+            query = environ['wsgi.input'].read(length)
+        else:
+            return self.respondStatus(
+                start_response, '405 Method Not Allowed',
+                [('Allow', 'GET, HEAD, POST')])
+        request_kw = {}
+        repeated = []
+        query = query.decode('utf-8', 'replace')
+        for key, values in parse_qs(query, True).items():
+            if len(values) > 1:
+                repeated.append(key)
+            request_kw[key] = values[0]
+        if repeated:
+            e = error.BadArgumentError(
+                "Repeated arguments: %s" % ', '.join(sorted(repeated)))
+            chunks = iter([self._server.handleException(
+                request_kw, (type(e), e, None))])
+        else:
+            chunks = self._server.handleRequestStreaming(request_kw)
+        headers = [('Content-Type', CONTENT_TYPE)]
+        compression = self.getCompression()
+        if compression:
+            headers.append(('Vary', 'Accept-Encoding'))
+            encoding = chooseEncoding(
+                environ.get('HTTP_ACCEPT_ENCODING', ''), compression)
+            if encoding is not None:
+                headers.append(('Content-Encoding', encoding))
+                chunks = compressChunks(
+                    chunks, encoding, self._compression_level)
+        start_response('200 OK', headers)
+        if method == 'HEAD':
+            # the headers of a GET, without the body
+            close = getattr(chunks, 'close', None)
+            if close is not None:
+                close()
+            return []
+        return chunks
+
+    def getCompression(self):
+        """The compressions to use, the ones advertised by Identify
+        unless given when the application was created.
+        """
+        compression = self._compression
+        if compression is None:
+            try:
+                compression = getIdentifyCompression(self._server)
+            except Exception:
+                compression = None
+            if compression is None:
+                # Identify failed, so respond uncompressed and ask again
+                # with the next request
+                return []
+            # harmless if several threads do this at the same time
+            self._compression = compression
+        return [item for item in compression if item in COMPRESSION_WBITS]
+
+    def invalidateIdentify(self):
+        """Call when the Identify of the server changes, as it is cached.
+        """
+        self._compression = self._configured_compression
+        self._server.invalidateIdentify()
+
+    def respondStatus(self, start_response, status, headers=None):
+        body = status.encode('ascii')
+        start_response(status, [('Content-Type', 'text/plain'),
+                                 ('Content-Length', str(len(body)))] +
+                       (headers or []))
+        return [body]
+
+def getIdentifyCompression(server):
+    """Return the compressions advertised by the Identify response of
+    server, or None if the response is an error.
+    """
+    tree = etree.fromstring(server.handleRequest({'verb': 'Identify'}))
+    if tree.xpath('//oai:error', namespaces={'oai': NS_OAIPMH}):
+        return None
+    # WSGI wants plain strings in headers
+    return [str(compression) for compression in tree.xpath(
+        '//oai:Identify/oai:compression/text()',
+        namespaces={'oai': NS_OAIPMH})]
+
+def chooseEncoding(accept_encoding, compression):
+    """Return the first of compression that is acceptable according to
+    the Accept-Encoding header, or None.
+    """
+    accepted = {}
+    for item in accept_encoding.split(','):
+        parts = item.strip().split(';')
+        coding = parts[0].strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        for param in parts[1:]:
+            name, sep, value = param.strip().partition('=')
+            if name.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[coding] = quality
+    for coding in compression:
+        if accepted.get(coding, accepted.get('*', 0)) > 0:
+            return coding
+    return None
+
+def compressChunks(chunks, encoding, level=6):
+    """Compress an iterator of chunks, flushing after each chunk so that
+    the response keeps streaming.
+    """
+    compressor = zlib.compressobj(
+        level, zlib.DEFLATED, COMPRESSION_WBITS[encoding])
+    for chunk in chunks:
+        data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()